@@ -0,0 +1,292 @@
+# @file bdd.py
+# @author Evan Brody
+# @brief Exact failure probabilities through reduced ordered binary decision diagrams
+
+import numpy as np
+from graph.dep_graph import DepGraph
+
+# Every direct failure and every edge with a weight below 1 is an
+# independent boolean variable. A vertex fails if it fails directly or
+# any predecessor fails and its edge transmits, an AND gate fails if
+# all of them do, and a voting gate if at least k do. Compiling those
+# formulas into one shared BDD keeps every variable in a single place,
+# so shared components are counted once and the probabilities come out
+# exact instead of the path-wise approximation calc_r() makes
+
+class BDD:
+    FALSE = 0
+    TRUE = 1
+
+    def __init__(self, var_count: int) -> None:
+        self.var_count = var_count
+        # Node i tests variable var[i], going to lo[i] if it's 0 and
+        # hi[i] if it's 1. The terminals sit below every variable
+        self.var = [var_count, var_count]
+        self.lo = [self.FALSE, self.TRUE]
+        self.hi = [self.FALSE, self.TRUE]
+        # (var, lo, hi) -> node, so equal functions are the same node
+        self.unique = {}
+        # (op, u, v) -> node, with u <= v since both ops commute
+        self.memo = {}
+
+    def __len__(self) -> int:
+        return len(self.var)
+
+    def mk(self, var: int, lo: int, hi: int) -> int:
+        if lo == hi:
+            return lo
+        key = (var, lo, hi)
+        node = self.unique.get(key)
+        if node is None:
+            node = len(self.var)
+            self.var.append(var)
+            self.lo.append(lo)
+            self.hi.append(hi)
+            self.unique[key] = node
+        return node
+
+    def variable(self, var: int) -> int:
+        return self.mk(var, self.FALSE, self.TRUE)
+
+    # The result of op on u and v if it's already known, else None
+    def lookup(self, op: str, u: int, v: int) -> int:
+        if u > v:
+            u, v = v, u
+        if u == v:
+            return u
+        if "and" == op:
+            if self.FALSE == u:
+                return self.FALSE
+            if self.TRUE == u:
+                return v
+        else:
+            if self.TRUE == u:
+                return self.TRUE
+            if self.FALSE == u:
+                return v
+        return self.memo.get((op, u, v))
+
+    # Shannon expansion on the topmost variable of u and v. Done with
+    # an explicit stack since BDDs can be as deep as there are variables
+    def apply(self, op: str, u: int, v: int) -> int:
+        stack = [(u, v, False)]
+        while stack:
+            u, v, expanded = stack.pop()
+            if self.lookup(op, u, v) is not None:
+                continue
+
+            top = min(self.var[u], self.var[v])
+            u0, u1 = (self.lo[u], self.hi[u]) if self.var[u] == top else (u, u)
+            v0, v1 = (self.lo[v], self.hi[v]) if self.var[v] == top else (v, v)
+
+            if not expanded:
+                stack.append((u, v, True))
+                stack.append((u0, v0, False))
+                stack.append((u1, v1, False))
+                continue
+
+            node = self.mk(top, self.lookup(op, u0, v0), self.lookup(op, u1, v1))
+            self.memo[(op, min(u, v), max(u, v))] = node
+
+        return self.lookup(op, u, v)
+
+    def AND(self, u: int, v: int) -> int:
+        return self.apply("and", u, v)
+
+    def OR(self, u: int, v: int) -> int:
+        return self.apply("or", u, v)
+
+    # Probability of every node being true, given the probability of
+    # each variable. p is either a vector of var_count probabilities or
+    # a (var_count, B) matrix holding B of them as columns.
+    # Children always have smaller ids than their parents but can test
+    # any later variable, so nodes are done a variable at a time from
+    # the bottom up, each group in one vectorized step
+    def probabilities(self, p: np.ndarray) -> np.ndarray:
+        p = np.asarray(p, np.double)
+        var = np.array(self.var, np.intp)
+        lo = np.array(self.lo, np.intp)
+        hi = np.array(self.hi, np.intp)
+
+        P = np.empty((len(var),) + p.shape[1:], np.double)
+        P[self.FALSE] = 0
+        P[self.TRUE] = 1
+
+        by_var = np.argsort(var[2:], kind="stable") + 2
+        bounds = np.searchsorted(var[by_var], np.arange(self.var_count + 1))
+        for v in reversed(range(self.var_count)):
+            nodes = by_var[bounds[v]:bounds[v + 1]]
+            if len(nodes):
+                P[nodes] = (1 - p[v]) * P[lo[nodes]] + p[v] * P[hi[nodes]]
+
+        return P
+
+# Compiles a DepGraph into a BDD once and evaluates it as often as
+# needed. Probabilities are read from the graph on every evaluation,
+# and the BDD is only rebuilt when the structure changes: vertices,
+# edges, gates, or an edge weight moving to or away from 1
+class BDDEvaluator:
+    def __init__(self, dg: DepGraph) -> None:
+        self.dg = dg
+        self.signature = None
+        self.compile()
+
+    # Everything the BDD depends on, as opposed to the
+    # probabilities that only feed its evaluation
+    def structure(self) -> tuple:
+        dg = self.dg
+        n = dg.n
+        edges = tuple(sorted(
+            (a, b, 1 == w) for a, out_edges in dg.succ.items() for b, w in out_edges.items()
+        ))
+        return (n, dg.active[:n].tobytes(), dg.is_AND[:n].tobytes(), dg.vote_k[:n].tobytes(), edges)
+
+    # Depth-first from each sink through the predecessors, giving each
+    # vertex its variable after everything upstream of it. Components
+    # that feed the same vertex end up next to each other in the order,
+    # which is what keeps fault tree BDDs small
+    def variable_order(self) -> tuple[dict]:
+        dg = self.dg
+        slots = np.flatnonzero(dg.active[:dg.n]).tolist()
+        vertex_var = {}
+        edge_var = {}
+        visited = set()
+
+        def assign(v: int) -> None:
+            if not dg.is_AND[v]:
+                vertex_var[v] = len(vertex_var) + len(edge_var)
+            for a, w in dg.pred[v].items():
+                if 1 != w:
+                    edge_var[(a, v)] = len(vertex_var) + len(edge_var)
+
+        roots = [ v for v in slots if not dg.succ[v] ] + slots
+        for root in roots:
+            if root in visited:
+                continue
+            visited.add(root)
+            stack = [(root, iter(sorted(dg.pred[root])))]
+            while stack:
+                v, preds = stack[-1]
+                a = next(preds, None)
+                if a is None:
+                    stack.pop()
+                    assign(v)
+                elif a not in visited:
+                    visited.add(a)
+                    stack.append((a, iter(sorted(dg.pred[a]))))
+
+        return vertex_var, edge_var
+
+    def compile(self) -> None:
+        dg = self.dg
+        self.signature = self.structure()
+        self.vertex_var, self.edge_var = self.variable_order()
+        bdd = self.bdd = BDD(len(self.vertex_var) + len(self.edge_var))
+
+        slots = np.flatnonzero(dg.active[:dg.n]).tolist()
+
+        def edge(a: int, b: int) -> int:
+            var = self.edge_var.get((a, b))
+            return bdd.TRUE if var is None else bdd.variable(var)
+
+        # Direct failures are where every vertex starts
+        f = { v : bdd.FALSE if dg.is_AND[v] else bdd.variable(self.vertex_var[v]) for v in slots }
+
+        def build(v: int) -> int:
+            pred = dg.pred[v]
+            if dg.vote_k[v] > 0:
+                # at_least[j] is true if at least j of the inputs seen
+                # so far failed, which is O(inputs * k) applies
+                k = int(dg.vote_k[v])
+                at_least = [bdd.TRUE] + [bdd.FALSE] * k
+                for a in sorted(pred):
+                    fails = bdd.AND(f[a], edge(a, v))
+                    for j in range(k, 0, -1):
+                        at_least[j] = bdd.OR(at_least[j], bdd.AND(at_least[j - 1], fails))
+                return at_least[k]
+
+            if dg.is_AND[v]:
+                if not pred:
+                    return bdd.FALSE
+                node = bdd.TRUE
+                for a in sorted(pred):
+                    node = bdd.AND(node, bdd.AND(f[a], edge(a, v)))
+                return node
+
+            node = bdd.variable(self.vertex_var[v])
+            for a in sorted(pred):
+                node = bdd.OR(node, bdd.AND(f[a], edge(a, v)))
+            return node
+
+        order = dg.topological_order()
+        if order is not None:
+            for v in order:
+                f[v] = build(v)
+        else:
+            # Cyclic graphs are swept until nothing changes. Since
+            # nodes are canonical, unchanged means the same node, and
+            # failures only spread, so this is the least fixed point
+            changed = True
+            while changed:
+                changed = False
+                for v in slots:
+                    node = build(v)
+                    if node != f[v]:
+                        f[v] = node
+                        changed = True
+
+        self.roots = f
+        # The memo is only needed while building
+        bdd.memo = {}
+
+    # The probability of each variable, as the graph has them now
+    def variable_probabilities(self, r0: np.ndarray=None) -> np.ndarray:
+        dg = self.dg
+        r0 = dg.r0 if r0 is None else r0
+        p = np.empty((self.bdd.var_count,) + np.shape(r0)[1:], np.double)
+        for v, var in self.vertex_var.items():
+            p[var] = r0[v]
+        for (a, b), var in self.edge_var.items():
+            p[var] = dg.succ[a][b]
+        return p
+
+    # Exact failure probability of every slot, laid out like
+    # DepGraph.calc_r(). Empty slots get 0. r0 can be given as an
+    # (n, B) matrix to evaluate B sets of direct risks at once
+    def calc_r(self, r0: np.ndarray=None) -> np.ndarray:
+        if self.structure() != self.signature:
+            self.compile()
+
+        dg = self.dg
+        P = self.bdd.probabilities(self.variable_probabilities(r0))
+        r = np.zeros((dg.n,) + P.shape[1:], np.double)
+        for v, node in self.roots.items():
+            r[v] = P[node]
+        return r
+
+    def get_r_dict(self) -> dict:
+        dg = self.dg
+        r = self.calc_r()
+        return { dg.iref[v] : r[v] for v in self.roots }
+
+if __name__ == "__main__":
+    ########### Testing code ################
+    # Run from the repository root with python -m graph.bdd
+    # A diamond reconverges at d, which calc_r() overestimates
+    dg = DepGraph()
+    dg.add_vertices(['a', 'b', 'c', 'd'], [0.25] * 4)
+    dg.add_edges([('a', 'b'), ('a', 'c'), ('b', 'd'), ('c', 'd')], [0.5] * 4)
+    exact = BDDEvaluator(dg)
+    print("calc_r:", dg.calc_r())
+    print("exact:", exact.calc_r(), "BDD nodes:", len(exact.bdd))
+
+    # Changing a probability only re-evaluates
+    dg.update_vertex('a', 0.5)
+    print("exact:", exact.calc_r(), "BDD nodes:", len(exact.bdd))
+
+    # Both inputs of the AND gate share x
+    dg = DepGraph()
+    dg.add_vertices(['x', 'y', 'z', 'top'], [0.1, 0.2, 0.2, 0])
+    dg.add_AND_gate('AND')
+    dg.add_edges([('x', 'y'), ('x', 'z'), ('y', 'AND'), ('z', 'AND'), ('AND', 'top')])
+    print("exact:", BDDEvaluator(dg).get_r_dict())
@@ -0,0 +1,260 @@
+# @file benchmark.py
+# @author Evan Brody
+# @brief Timing and memory benchmarks for DepGraph on seeded random DAGs
+
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import numpy as np
+from graph.dep_graph import DepGraph
+
+# Every case is a random DAG of some shape and size, built with one of
+# the engines. Each operation is timed on its own, ops_per_case times
+# where that makes sense, and the fastest of those is what gets
+# compared, being the least disturbed by whatever else the machine
+# is doing. Building and the full calc_r() need a fresh graph each
+# time, so they're repeated on new graphs, up to WHOLE_GRAPH_SAMPLES
+# times after a round that isn't counted. Operations with fewer than
+# MIN_COMPARED_SAMPLES samples on either side aren't compared. Peak
+# memory is measured in a separate run of build + calc_r() under
+# tracemalloc, since tracing slows everything else down. Sizes run
+# from small to large, and once a case takes longer than the budget,
+# the larger sizes of that shape and engine are skipped.
+# Results are JSON, so a run can be saved as the baseline for later ones:
+#   python -m graph.benchmark --out baseline.json
+#   python -m graph.benchmark --baseline baseline.json
+# which exits with 1 if anything got slower or bigger than allowed
+
+SHAPES = ("chain", "tree", "layered", "and_gates")
+SIZES = (10, 100, 1000, 5000)
+DEFAULT_SEED = 2024
+DEFAULT_OPS = 20
+# Fresh graphs built per case for the whole-graph operations
+WHOLE_GRAPH_SAMPLES = 5
+# The minimum of fewer samples than this is too noisy to compare
+MIN_COMPARED_SAMPLES = 2
+# Layered graphs give each vertex about this many successors
+LAYERED_OUT_DEGREE = 8
+# Fraction of the vertices past the first layer that are AND gates
+AND_GATE_FRACTION = 0.25
+# A time or peak more than TOLERANCE times its baseline is a regression
+DEFAULT_TOLERANCE = 1.5
+# Differences under this many seconds are noise, whatever the ratio
+MIN_SECONDS = 1e-3
+# Seconds a case can take before the larger ones are skipped
+DEFAULT_BUDGET = 30
+RESULTS_VERSION = 1
+
+# Edges (a, b) of a seeded random DAG with n vertices, as an (E, 2)
+# array, along with weights, direct risks and which vertices are AND
+# gates. Vertices are shuffled so the topological order isn't just
+# the numbering
+def generate(shape: str, n: int, rng: np.random.Generator) -> tuple[np.ndarray]:
+    is_AND = np.zeros(n, bool)
+    if "chain" == shape:
+        edges = np.c_[np.arange(n - 1), np.arange(1, n)]
+    elif "tree" == shape:
+        # Each vertex feeds one earlier one, so everything leads to 0
+        children = np.arange(1, n)
+        edges = np.c_[children, rng.integers(0, children)]
+    elif shape in ("layered", "and_gates"):
+        layers = np.array_split(np.arange(n), max(2, round(np.sqrt(n))))
+        edges = []
+        for upper, lower in zip(layers, layers[1:]):
+            p = min(1, LAYERED_OUT_DEGREE / len(lower))
+            a, b = np.nonzero(rng.random((len(upper), len(lower))) < p)
+            edges.append(np.c_[upper[a], lower[b]])
+        edges = np.concatenate(edges)
+        if "and_gates" == shape:
+            is_AND[layers[0][-1] + 1:] = rng.random(n - len(layers[0])) < AND_GATE_FRACTION
+    else:
+        raise ValueError(f"Unknown shape {shape!r}, expected one of {SHAPES}")
+
+    perm = rng.permutation(n)
+    edges = perm[edges.reshape(-1, 2)]
+    is_AND = is_AND[np.argsort(perm)]
+
+    weights = np.where(rng.random(len(edges)) < 0.5, 1, rng.uniform(0.1, 0.9, len(edges)))
+    direct_risks = np.where(is_AND, 0, rng.uniform(0, 0.1, n))
+    return edges, weights, direct_risks, is_AND
+
+# Up to count new edges that keep the graph acyclic, going forward in
+# the topological order of dg
+def new_edges(dg: DepGraph, count: int, rng: np.random.Generator) -> list[tuple[int]]:
+    order = dg.topological_order()
+    edges = []
+    for _ in range(10 * count):
+        if len(edges) == count or len(order) < 2:
+            break
+        i, j = np.sort(rng.choice(len(order), 2, replace=False))
+        a, b = order[i], order[j]
+        if b not in dg.succ[a] and (a, b) not in edges:
+            edges.append((a, b))
+    return edges
+
+def summarize(samples: list[float]) -> dict:
+    return {
+        "count" : len(samples),
+        "median" : float(np.median(samples)) if samples else None,
+        "min" : float(np.min(samples)) if samples else None,
+        "total" : float(np.sum(samples)),
+    }
+
+# Times every operation on one case. Keys are ints, like a batch job
+# would use, and slots are worked with directly where there's an _i
+# method for it
+def time_case(shape: str, n: int, engine: str, seed: int, ops: int) -> dict:
+    rng = np.random.default_rng([seed, n, SHAPES.index(shape)])
+    edges, weights, direct_risks, is_AND = generate(shape, n, rng)
+    refs = list(range(n))
+    samples = { op : [] for op in ("build", "calc_r", "add_edge", "calc_r_incremental",
+                                   "update_edge_i", "get_r_dict", "delete_vertex") }
+
+    def timed(op: str, f, *args) -> object:
+        start = time.perf_counter()
+        result = f(*args)
+        samples[op].append(time.perf_counter() - start)
+        return result
+
+    for k in range(1 + min(ops, WHOLE_GRAPH_SAMPLES)):
+        dg = timed("build", DepGraph.from_arrays, refs, edges, weights, direct_risks, is_AND, engine)
+        timed("calc_r", dg.calc_r)
+
+        for a, b in new_edges(dg, ops, rng):
+            timed("add_edge", dg.add_edge, (a, b), float(rng.uniform(0.1, 1)))
+        timed("calc_r_incremental", dg.calc_r)
+
+        # The first round only warms up
+        if 0 == k:
+            for s in samples.values():
+                s.clear()
+
+    existing = [ (a, b) for a, out_edges in dg.succ.items() for b in out_edges ]
+    for k in rng.permutation(len(existing))[:ops].tolist():
+        timed("update_edge_i", dg.update_edge_i, existing[k], float(rng.uniform(0.1, 1)))
+        timed("get_r_dict", dg.get_r_dict)
+
+    for ref in rng.permutation(n)[:min(ops, n // 2)].tolist():
+        timed("delete_vertex", dg.delete_vertex, ref)
+
+    # Memory is measured from scratch, without timing anything
+    tracemalloc.start()
+    dg = DepGraph.from_arrays(refs, edges, weights, direct_risks, is_AND, engine)
+    dg.calc_r()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "shape" : shape,
+        "n" : n,
+        "engine" : engine,
+        "edges" : len(edges),
+        "peak_bytes" : peak,
+        "seconds" : float(sum(map(sum, samples.values()))),
+        "ops" : { op : summarize(s) for op, s in samples.items() },
+    }
+
+def run(shapes: list[str]=SHAPES, sizes: list[int]=SIZES, engines: list[str]=DepGraph.ENGINES,
+        seed: int=DEFAULT_SEED, ops: int=DEFAULT_OPS, budget: float=DEFAULT_BUDGET,
+        log=None) -> dict:
+    results = []
+    skipped = []
+    for engine in engines:
+        for shape in shapes:
+            over_budget = False
+            for n in sorted(sizes):
+                reason = None
+                if over_budget:
+                    reason = "over budget"
+                elif "closure" == engine and n > DepGraph.MAX_CLOSURE_VERTICES:
+                    reason = "too large for the closure engine"
+                if reason is not None:
+                    skipped.append({ "shape" : shape, "n" : n, "engine" : engine, "reason" : reason })
+                    if log is not None:
+                        print(f"{engine:>12} {shape:>10} {n:>6}  skipped, {reason}", file=log)
+                    continue
+
+                case = time_case(shape, n, engine, seed, ops)
+                results.append(case)
+                over_budget = case["seconds"] > budget
+                if log is not None:
+                    print(f"{engine:>12} {shape:>10} {n:>6}  build {case['ops']['build']['min']:.4f}s"
+                          f"  calc_r {case['ops']['calc_r']['min']:.4f}s"
+                          f"  peak {case['peak_bytes'] / 2 ** 20:.1f} MiB", file=log)
+
+    return {
+        "version" : RESULTS_VERSION,
+        "seed" : seed,
+        "ops_per_case" : ops,
+        "python" : platform.python_version(),
+        "numpy" : np.__version__,
+        "results" : results,
+        "skipped" : skipped,
+    }
+
+# Every way results is worse than baseline, as readable lines. Cases
+# and operations missing from either side are skipped
+def compare(results: dict, baseline: dict, tolerance: float=DEFAULT_TOLERANCE) -> list[str]:
+    key = lambda case: (case["shape"], case["n"], case["engine"])
+    base_cases = { key(case) : case for case in baseline["results"] }
+
+    regressions = []
+    for case in results["results"]:
+        base = base_cases.get(key(case))
+        if base is None:
+            continue
+        name = "{} n={} {}".format(*key(case))
+
+        if case["peak_bytes"] > tolerance * base["peak_bytes"]:
+            regressions.append(f"{name} peak memory: {base['peak_bytes']} -> {case['peak_bytes']} bytes")
+
+        for op, stats in case["ops"].items():
+            base_stats = base["ops"].get(op)
+            if base_stats is None or stats["min"] is None or base_stats["min"] is None:
+                continue
+            if min(stats["count"], base_stats["count"]) < MIN_COMPARED_SAMPLES:
+                continue
+            new, old = stats["min"], base_stats["min"]
+            if new > tolerance * old and new - old > MIN_SECONDS:
+                regressions.append(f"{name} {op}: {old:.6f}s -> {new:.6f}s ({new / old:.2f}x)")
+
+    return regressions
+
+def main(argv: list[str]=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark DepGraph on seeded random DAGs")
+    parser.add_argument("--shapes", nargs="+", choices=SHAPES, default=SHAPES)
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--engines", nargs="+", choices=DepGraph.ENGINES, default=DepGraph.ENGINES)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--ops", type=int, default=DEFAULT_OPS, help="Samples per timed operation")
+    parser.add_argument("--out", help="Write the results here as JSON")
+    parser.add_argument("--baseline", help="Compare against results saved with --out")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET,
+                        help="Seconds a case can take before larger sizes are skipped")
+    args = parser.parse_args(argv)
+
+    results = run(args.shapes, args.sizes, args.engines, args.seed, args.ops, args.budget, sys.stderr)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(line)
+        print(f"{len(regressions)} regressions against {args.baseline}")
+        return 1 if regressions else 0
+
+    if not args.out:
+        json.dump(results, sys.stdout, indent=1)
+    return 0
+
+if __name__ == "__main__":
+    # Run from the repository root with python -m graph.benchmark
+    sys.exit(main())
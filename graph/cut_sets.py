@@ -0,0 +1,131 @@
+# @file cut_sets.py
+# @author Evan Brody
+# @brief Minimal cut set enumeration for dependency graphs
+
+import numpy as np
+from itertools import combinations
+from collections.abc import Hashable, Iterator
+from graph.dep_graph import DepGraph
+
+# A cut set is a set of components whose direct failures are enough
+# to fail a vertex, and it's minimal if no smaller cut set is inside
+# it. Cut sets are Python ints used as bitsets, bit i standing for the
+# component in slot i, so union is |, and m is inside c if m & c == m.
+# Edges are taken to always transmit, so a cut set's probability is
+# the product of its components' r0. That's an upper bound on what it
+# really contributes, which is what makes it safe to prune by
+
+def popcount(bits: int) -> int:
+    return bin(bits).count("1")
+
+class CutSets:
+    DEFAULT_MAX_ORDER = 4
+
+    def __init__(self, dg: DepGraph) -> None:
+        self.dg = dg
+
+    def keys_of(self, cut_set: int) -> list[Hashable]:
+        dg = self.dg
+        return [ dg.iref[i] for i in range(cut_set.bit_length()) if cut_set >> i & 1 ]
+
+    def probability(self, cut_set: int) -> float:
+        dg = self.dg
+        return float(np.prod([ dg.r0[i] for i in range(cut_set.bit_length()) if cut_set >> i & 1 ]))
+
+    # Top-down expansion in the style of MOCUS. A partial cut set is
+    # the components chosen so far plus the vertices that still have
+    # to fail. Failing a component means picking its own failure or
+    # one of its predecessors', failing an AND gate means failing all
+    # of its predecessors, and failing a voting gate means failing any
+    # k of them. Each pending vertex carries the vertices it
+    # was expanded from, so a failure that only reaches itself through
+    # a cycle gets dropped. Yields every cut set of up to max_order
+    # components, minimal or not, that is at least cutoff likely
+    def expand(self, top: int, max_order: int, cutoff: float) -> Iterator[int]:
+        dg = self.dg
+        stack = [(0, 1.0, ((top, 0),))]
+        while stack:
+            events, p, pending = stack.pop()
+            if not pending:
+                yield events
+                continue
+
+            (v, path), rest = pending[0], pending[1:]
+            path |= 1 << v
+
+            if dg.vote_k[v] > 0:
+                # Any k of the inputs will do
+                pred = [ a for a in sorted(map(int, dg.pred[v])) if not path >> a & 1 ]
+                for chosen in reversed(list(combinations(pred, int(dg.vote_k[v])))):
+                    stack.append((events, p, tuple((a, path) for a in chosen) + rest))
+                continue
+
+            if dg.is_AND[v]:
+                pred = sorted(map(int, dg.pred[v]))
+                if not pred or any(path >> a & 1 for a in pred):
+                    continue
+                stack.append((events, p, tuple((a, path) for a in pred) + rest))
+                continue
+
+            # Fail a predecessor instead
+            for a in sorted(map(int, dg.pred[v]), reverse=True):
+                if not path >> a & 1:
+                    stack.append((events, p, ((a, path),) + rest))
+
+            # Fail v directly
+            if events >> v & 1:
+                stack.append((events, p, rest))
+                continue
+            # A component that can't fail on its own is in no cut set
+            if dg.r0[v] <= 0:
+                continue
+            new_p = p * dg.r0[v]
+            if popcount(events) < max_order and new_p >= cutoff:
+                stack.append((events | 1 << v, new_p, rest))
+
+    # Minimal cut sets of the vertex top, streamed in increasing order.
+    # The expansion is rerun for each order and only the cut sets of
+    # exactly that order are kept, so the only thing held in memory is
+    # the minimal cut sets already found, which the new ones are
+    # checked against
+    def generate(self, top: Hashable, max_order: int=DEFAULT_MAX_ORDER,
+                 cutoff: float=0.0) -> Iterator[int]:
+        # Slots can be numpy ints, which would overflow as bitsets
+        top = int(self.dg.refi[top])
+        found = []
+        for order in range(1, max_order + 1):
+            new = set()
+            for cut_set in self.expand(top, order, cutoff):
+                if order == popcount(cut_set) and cut_set not in new \
+                   and not any(m == m & cut_set for m in found):
+                    new.add(cut_set)
+                    yield cut_set
+            found.extend(new)
+
+    # (top, cut set) for every vertex nothing depends on
+    def generate_all(self, max_order: int=DEFAULT_MAX_ORDER,
+                     cutoff: float=0.0) -> Iterator[tuple[Hashable, int]]:
+        dg = self.dg
+        for v in np.flatnonzero(dg.active[:dg.n]).tolist():
+            if dg.succ[v]:
+                continue
+            top = dg.iref[v]
+            for cut_set in self.generate(top, max_order, cutoff):
+                yield top, cut_set
+
+if __name__ == "__main__":
+    ########### Testing code ################
+    # Run from the repository root with python -m graph.cut_sets
+    dg = DepGraph()
+    dg.add_vertices(['pump1', 'pump2', 'power', 'valve', 'top'], [0.1, 0.1, 0.01, 0.05, 0])
+    dg.add_AND_gate('pumps')
+    dg.add_edges([
+        ('power', 'pump1'), ('power', 'pump2'),
+        ('pump1', 'pumps'), ('pump2', 'pumps'),
+        ('pumps', 'top'), ('valve', 'top')
+    ])
+
+    cs = CutSets(dg)
+    for cut_set in cs.generate('top'):
+        print(cs.keys_of(cut_set), cs.probability(cut_set))
+    print("cutoff 0.005:", [ cs.keys_of(c) for c in cs.generate('top', cutoff=0.005) ])
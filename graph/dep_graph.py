@@ -2,36 +2,310 @@
 # @author Evan Brody
 # @brief Provides backend graph functionality for dependency analysis
 
+import heapq
 import numpy as np
-from itertools import chain, compress, product
-from PyQt5.QtWidgets import QGraphicsRectItem
+from math import prod
+from itertools import compress
+from collections.abc import Hashable, Iterable
+from graph import or_algebra
+from graph.reach import ReachIndex
 
 class DepGraph:
-    MAX_VERTICES = 512
+    INITIAL_CAPACITY = 16
+    # Storage grows by this factor when it runs out of room
+    GROWTH_FACTOR = 2
+    # Slots are compacted once more than this fraction of them are free
+    COMPACT_THRESHOLD = 0.5
     DEFAULT_EDGE_WEIGHT = 1
     DEFAULT_DR = 0.25
-    J = np.ones((MAX_VERTICES, MAX_VERTICES), np.uint8)
-    I = np.identity(MAX_VERTICES, np.uint8)
-
-    def __init__(self) -> None:
-        self.refi = {} # Maps QGraphicsRectItems to indices
-        self.iref = np.empty((self.MAX_VERTICES,), QGraphicsRectItem) # Maps indices to QGraphicsRectItems
-
-        # How many vertices we have
+    # Columns of r0 the batched evaluations work on at once
+    BATCH_COLUMNS = 256
+    # Time at which Weibull parameters are turned into a direct
+    # risk, in hours. We choose failures per one million hours
+    DEFAULT_MISSION_TIME = 1_000_000
+    # Weibull shape parameters are clamped to [0, MAX_WEIBULL_SHAPE]
+    MAX_WEIBULL_SHAPE = 10
+    # How r is worked out. The closure engine keeps the dense transitive
+    # closure up to date, the topological one only the adjacency and an
+    # order of the vertices, with cycles condensed into single units
+    ENGINES = ("closure", "topological")
+    # Most vertices the closure engine takes. Its closure is dense
+    # whatever the edges, a chain of n vertices already reaches n^2 / 2
+    # pairs, so storing it sparsely wouldn't make it track the edge
+    # count. Three capacity^2 matrices of this size are about 400 MB.
+    # Larger graphs need the topological engine
+    MAX_CLOSURE_VERTICES = 4096
+    # Cycles are solved by iterating until nothing moves more than
+    # this, or for at most MAX_FIXED_POINT_ITERATIONS rounds
+    FIXED_POINT_TOL = 1e-12
+    MAX_FIXED_POINT_ITERATIONS = 10_000
+
+    def __init__(self, capacity: int=INITIAL_CAPACITY, engine: str="closure") -> None:
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}, expected one of {self.ENGINES}")
+        self.engine = engine
+
+        # Vertices are referred to by keys, which can be anything hashable.
+        # The GUI uses its QGraphicsRectItems, batch jobs can use ints
+        # or strings without ever importing Qt
+        self.refi = {} # Maps keys to indices
+        # How many slots are in use. Deleted vertices leave their
+        # slot empty until it's reused or the slots are compacted,
+        # so this can be more than the number of vertices
         self.n = 0
+        # Slots below n that are free to reuse
+        self.free_slots = []
+        # How many times compact() has run
+        self.compactions = 0
+        # How many vertices we have room for before we need to grow
+        self.capacity = 0
+
+        # Sparse adjacency. succ[a][b] and pred[b][a] both
+        # store the weight of the edge a -> b
+        self.succ = {}
+        self.pred = {}
+
+        # Everything below is allocated by reserve()
+        self.iref = np.empty((0,), object) # Maps indices to keys
+        # self.active[i] stores whether slot i holds a vertex
+        self.active = np.empty((0,), bool)
         # Direct risk vector
-        self.r0 = np.empty((self.MAX_VERTICES,), np.double)
+        self.r0 = np.empty((0,), np.double)
         # Full risk vector
-        self.r = np.empty((self.MAX_VERTICES,), np.double)
+        self.r = np.empty((0,), np.double)
+        # self.r_dirty[i] stores whether self.r[i] is out of date
+        self.r_dirty = np.empty((0,), bool)
+        # self.r_unreported[i] stores whether self.r[i] changed in a
+        # query on part of the graph since update_r() last reported
+        self.r_unreported = np.empty((0,), bool)
         # self.is_AND[i] stores whether vi is an AND gate
-        self.is_AND = np.empty((self.MAX_VERTICES,), bool)
-        # Adjacency matrix
-        self.A = np.empty((self.MAX_VERTICES, self.MAX_VERTICES), np.double)
-        # Transitive closure of A
-        self.A_tc = np.empty((self.MAX_VERTICES, self.MAX_VERTICES), np.double)
+        self.is_AND = np.empty((0,), bool)
+        # self.weibull[i] stores the (location, scale, shape) of the
+        # three parameter Weibull distribution of vi's failure time,
+        # if self.has_weibull[i]. Otherwise r0 holds for all time
+        self.weibull = np.empty((0, 3), np.double)
+        self.has_weibull = np.empty((0,), bool)
+        # self.vote_k[i] > 0 makes AND gate vi a voting gate, which
+        # fails if at least vote_k[i] of its inputs fail
+        self.vote_k = np.empty((0,), np.int64)
+        # Position of each vertex in a topological order, kept by the
+        # topological engine. Positions only need to increase along
+        # edges, so they have gaps, and new vertices go on the end
+        self.topo_pos = np.empty((0,), np.int64)
+        self.next_topo_pos = 0
+        # Strongly connected components with more than one vertex, as
+        # arrays of slots, for the topological engine. Members of one
+        # share their position in the order. self.scc_of[i] is the
+        # index of vi's component in self.cycles, or -1 if it's on none.
+        # self.cycle_reach caches the reachability inside each of them,
+        # and self.sccs_dirty says the components have to be found again
+        self.cycles = []
+        self.scc_of = np.empty((0,), np.int64)
+        self.cycle_reach = {}
+        self.sccs_dirty = False
+        # Transitive closure of A, only allocated by the closure engine,
+        # and only once the first edge goes in. Its three matrices take
+        # capacity^2 cells each, so a graph of vertices alone doesn't pay
+        # for them. From then on every edge is added to it as it comes,
+        # since which paths get combined depends on the order edges
+        # arrive in. self.closure_built says whether they're allocated
+        self.closure_built = False
+        self.A_tc = np.empty((0, 0), np.double)
         # [i, j] = Count of paths j -> i with weight = 1
         # Probably doesn't need to be 64-bit but that can be figured out later
-        self.one_count = np.empty((self.MAX_VERTICES, self.MAX_VERTICES), np.uint64)
+        self.one_count = np.empty((0, 0), np.uint64)
+        # Cached max(A_tc, one_count > 0), kept up to date by each
+        # mutation as it happens. Only rebuilt wholesale when
+        # something marks it dirty
+        self.Ac_full = np.empty((0, 0), np.double)
+        self.Ac_full_dirty = True
+        # How many times calc_Ac_full() had to rebuild the cache,
+        # and how many times it could hand it out as-is
+        self.Ac_full_rebuilds = 0
+        self.Ac_full_reuses = 0
+        # Which vertex may reach which, only kept by the closure engine.
+        # It holds everything Ac_full connects to a component, which
+        # is all that mark_r_dirty() needs. Edges are added as they come, but
+        # deletions leave what they disconnected in place, so
+        # self.reach_exact says whether it's still exactly the
+        # reachability of the graph. Built by calc_reach() when
+        # self.reach_dirty
+        self.reach = ReachIndex()
+        self.reach_dirty = True
+        self.reach_exact = False
+        # Compiled on the first call to calc_r_exact()
+        self.bdd_evaluator = None
+        # Set by enable_shadow() to check the closure as it's updated
+        self.shadow = None
+
+        self.reserve(capacity)
+
+    # Makes sure there's room for at least capacity vertices. The
+    # closure engine raises rather than go past MAX_CLOSURE_VERTICES
+    def reserve(self, capacity: int) -> None:
+        if capacity <= self.capacity:
+            return
+
+        if "closure" == self.engine:
+            self.check_closure_size(capacity)
+        capacity = max(capacity, int(self.GROWTH_FACTOR * self.capacity))
+        if "closure" == self.engine:
+            capacity = min(capacity, self.MAX_CLOSURE_VERTICES)
+        self.resize(capacity)
+
+    def check_closure_size(self, count: int) -> None:
+        if count > self.MAX_CLOSURE_VERTICES:
+            raise ValueError(f"The closure engine holds at most {self.MAX_CLOSURE_VERTICES} vertices, "
+                             "larger graphs need the topological engine, see set_engine()")
+
+    # Moves everything into storage for capacity vertices, which has to
+    # be at least n. Only the active n x n block is copied, and new
+    # space is zeroed so fresh vertices start disconnected.
+    # There are no matrices to copy until the closure is built
+    def resize(self, capacity: int) -> None:
+        n = self.n
+
+        def grow_vec(old: np.ndarray) -> np.ndarray:
+            new = np.zeros((capacity,) + old.shape[1:], old.dtype)
+            new[:n] = old[:n]
+            return new
+
+        def grow_mat(old: np.ndarray) -> np.ndarray:
+            new = np.zeros((capacity, capacity), old.dtype)
+            new[:n, :n] = old[:n, :n]
+            return new
+
+        self.iref = grow_vec(self.iref)
+        self.active = grow_vec(self.active)
+        self.r0 = grow_vec(self.r0)
+        self.r = grow_vec(self.r)
+        self.r_dirty = grow_vec(self.r_dirty)
+        self.r_unreported = grow_vec(self.r_unreported)
+        self.is_AND = grow_vec(self.is_AND)
+        self.weibull = grow_vec(self.weibull)
+        self.has_weibull = grow_vec(self.has_weibull)
+        self.vote_k = grow_vec(self.vote_k)
+        self.topo_pos = grow_vec(self.topo_pos)
+        self.scc_of = grow_vec(self.scc_of)
+        if self.closure_built:
+            self.A_tc = grow_mat(self.A_tc)
+            self.one_count = grow_mat(self.one_count)
+            self.Ac_full = grow_mat(self.Ac_full)
+        if "closure" == self.engine:
+            self.reach.reserve(capacity, n)
+
+        self.capacity = capacity
+
+    # Hands out d slots for new vertices, reusing free ones first
+    def alloc_slots(self, d: int) -> np.ndarray:
+        n = self.n
+        fresh = max(0, d - len(self.free_slots))
+        # Before anything is taken, in case there's no room
+        self.reserve(n + fresh)
+        reused = [self.free_slots.pop() for _ in range(d - fresh)]
+        self.n += fresh
+
+        return np.array(reused + list(range(n, n + fresh)), np.intp)
+
+    # Indices of the given keys, in order
+    def indices_of(self, refs: Iterable[Hashable]) -> np.ndarray:
+        refs = list(refs)
+        return np.fromiter(map(self.refi.__getitem__, refs), np.intp, len(refs))
+
+    # Keys at the given indices, in order
+    def keys_of(self, indices: np.ndarray) -> np.ndarray:
+        return self.iref[np.asarray(indices, np.intp)]
+
+    # Zeroes the rows and columns of the given slots
+    # and forgets their Weibull parameters and voting thresholds
+    def clear_slots(self, slots: np.ndarray) -> None:
+        n = self.n
+        if self.closure_built:
+            for M in (self.A_tc, self.one_count, self.Ac_full):
+                M[slots, :n] = 0
+                M[:n, slots] = 0
+        if "closure" == self.engine:
+            if not self.reach_dirty:
+                self.reach.clear(slots, n)
+        self.has_weibull[slots] = False
+        self.vote_k[slots] = 0
+        self.scc_of[slots] = -1
+
+    # Moves every vertex to the front so that the slots are
+    # contiguous again. This is the only place indices change
+    def compact(self) -> None:
+        n = self.n
+        keep = np.flatnonzero(self.active[:n])
+        m = len(keep)
+        new_index = np.full(n, -1, np.intp)
+        new_index[keep] = np.arange(m)
+
+        for v in (self.iref, self.active, self.r0, self.r, self.r_dirty, self.r_unreported,
+                  self.is_AND, self.weibull, self.has_weibull, self.vote_k, self.topo_pos, self.scc_of):
+            v[:m] = v[keep]
+            v[m:n] = 0
+        self.iref[m:n] = None
+
+        if self.closure_built:
+            block = np.ix_(keep, keep)
+            for M in (self.A_tc, self.one_count, self.Ac_full):
+                M[:m, :m] = M[block]
+                M[m:n, :n] = 0
+                M[:n, m:n] = 0
+        if "closure" == self.engine:
+            if not self.reach_dirty:
+                self.reach.compact(keep, n)
+
+        new_index = new_index.tolist()
+        self.refi = { ref : new_index[i] for ref, i in self.refi.items() }
+        self.succ = { new_index[a] : { new_index[b] : w for b, w in out_edges.items() } for a, out_edges in self.succ.items() }
+        self.pred = { new_index[b] : { new_index[a] : w for a, w in in_edges.items() } for b, in_edges in self.pred.items() }
+
+        self.n = m
+        self.free_slots = []
+        self.compactions += 1
+
+        # The cycles hold slots, so they're simply found again
+        if "topological" == self.engine:
+            self.condense()
+
+    def maybe_compact(self) -> None:
+        if len(self.free_slots) > self.COMPACT_THRESHOLD * self.n:
+            self.compact()
+
+    # Number of vertices, as opposed to slots
+    @property
+    def vertex_count(self) -> int:
+        return len(self.refi)
+
+    # Dense view of the adjacency matrix, [b, a] = weight of a -> b
+    @property
+    def A(self) -> np.ndarray:
+        n = self.n
+        A = np.zeros((n, n), np.double)
+        for a, out_edges in self.succ.items():
+            for b, weight in out_edges.items():
+                A[b, a] = weight
+
+        return A
+
+    # Number of edges currently stored
+    @property
+    def edge_count(self) -> int:
+        return sum(len(out_edges) for out_edges in self.succ.values())
+
+    def get_edge_weight_i(self, edge: tuple[int]) -> float:
+        a, b = edge
+        return self.succ[a].get(b, 0)
+
+    def set_edge_weight_i(self, edge: tuple[int], weight: float) -> None:
+        a, b = edge
+        if weight:
+            self.succ[a][b] = weight
+            self.pred[b][a] = weight
+        else:
+            self.succ[a].pop(b, None)
+            self.pred[b].pop(a, None)
 
     # P(a U b)
     def scl_or_scl(self, a: float, b: float) -> float:
@@ -43,95 +317,361 @@ class DepGraph:
         return (a - b) / (1 - b)
     
     def vec_or_vec(self, v1: np.ndarray, v2: np.ndarray) -> np.ndarray:
-        n = self.n
-        return self.J[0, :n] - np.multiply(self.J[0, :n] - v1, self.J[0, :n] - v2)
+        return or_algebra.vec_or_vec(v1, v2)
 
+    # v may also be an (n, B) matrix of B vectors, which
+    # are all evaluated in one pass
     def mat_or_vec(self, a: np.ndarray, v: np.ndarray) -> np.ndarray:
-        lenv = len(v)
-        return self.J[0, :lenv] - np.prod(self.J[:lenv, :lenv] - np.multiply(a, v), axis=1)
+        return or_algebra.mat_or_vec(a, v)
 
     def mat_or_mat(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
-        res = np.empty((a.shape[0], b.shape[1]), np.double)
-        
-        for i, j in product(range(a.shape[0]), range(b.shape[1])):
-            res[i, j] = 1 - np.prod(self.J[0, :a.shape[1]] - np.multiply(a[i], b.T[j]))
-        
-        return res
+        return or_algebra.mat_or_mat(a, b)
     
+    # Returns a read-only view of the cached Ac_full, building the
+    # closure first if it hasn't been yet
     def calc_Ac_full(self) -> np.ndarray:
         n = self.n
-        Ac_full = np.empty((n, n), np.double)
-        for i, j in product(range(n), repeat=2):
-            Ac_full[i, j] = max(self.A_tc[i, j], int(bool(self.one_count[i, j])))
-        
-        return Ac_full
-    
-    def add_vertices(self, refs: list[QGraphicsRectItem], direct_risks: list[float]=None) -> None:
-        n = self.n
-        d = len(refs)
-
-        for i, ref in enumerate(refs):
-            self.refi[ref] = n + i
-            self.iref[n + i] = ref
-
-        if direct_risks:
-            self.r0[n:n + d] = direct_risks
+        if not self.closure_built:
+            self.build_closure()
+        if self.Ac_full_dirty:
+            np.maximum(self.A_tc[:n, :n], self.one_count[:n, :n] > 0, out=self.Ac_full[:n, :n])
+            self.Ac_full_dirty = False
+            self.Ac_full_rebuilds += 1
         else:
-            self.r0[n:n + d] = self.DEFAULT_DR
-
-        self.is_AND[n:n + d] = False
-
-        self.A[n:n + d, :n + d] = 0
-        self.A[:n, n:n + d] = 0
+            self.Ac_full_reuses += 1
 
-        self.A_tc[n:n + d, :n + d] = 0
-        self.A_tc[:n, n:n + d] = 0
-
-        self.one_count[n:n + d, :n + d] = 0
-        self.one_count[:n, n:n + d] = 0
-
-        self.n += d
+        Ac_full = self.Ac_full[:n, :n]
+        Ac_full.flags.writeable = False
+        return Ac_full
 
-    def add_vertex(self, ref: QGraphicsRectItem, direct_risk: float=DEFAULT_DR) -> None:
+    # The reachability index, rebuilt from the edges if it has to be.
+    # Whatever the closure connects to a component is added in as
+    # well, since it can keep paths that deleting edges should have
+    # removed. Its AND gate rows also connect things that don't reach
+    # them at all, which only matters to the gate weights, and those
+    # are always recomputed from the closure itself
+    def calc_reach(self) -> ReachIndex:
         n = self.n
-        self.refi[ref] = n
-        self.iref[n] = ref
-
-        self.r0[n] = direct_risk
-        self.is_AND[n] = False
-
-        self.A[n, :n + 1] = 0
-        self.A[:n, n] = 0
-
-        self.A_tc[n, :n + 1] = 0
-        self.A_tc[:n, n] = 0
-
-        self.one_count[n, :n + 1] = 0
-        self.one_count[:n, n] = 0
+        if self.reach_dirty:
+            self.reach.rebuild(self.strongly_connected_components(), self.succ, n)
+            words = self.reach.words(n)
+            exact = self.reach.bits[:n, :words].copy()
+            self.reach.include((self.calc_Ac_full() != 0).T & ~self.is_AND[:n])
+            self.reach_exact = np.array_equal(exact, self.reach.bits[:n, :words])
+            if not self.reach_exact:
+                self.reach.close(n)
+            self.reach_dirty = False
+        return self.reach
+
+    # Whether there's a path a -> ... -> b along edges with nonzero
+    # weight. Read off the reachability index while it's exact,
+    # otherwise found by searching the successors of a
+    def reaches_i(self, a: int, b: int) -> bool:
+        if "closure" == self.engine and self.closure_built:
+            reach = self.calc_reach()
+            if self.reach_exact:
+                return reach.reaches(a, b)
+
+        seen = { a }
+        stack = [a]
+        while stack:
+            for v in self.succ[stack.pop()]:
+                if v == b:
+                    return True
+                if v not in seen:
+                    seen.add(v)
+                    stack.append(v)
+        return False
+
+    def reaches(self, a: Hashable, b: Hashable) -> bool:
+        return self.reaches_i(self.refi[a], self.refi[b])
+
+    # Whether adding edge would close a cycle
+    def creates_cycle(self, edge: tuple[Hashable]) -> bool:
+        a, b = edge
+        return a == b or self.reaches(b, a)
+
+    # Brings the cached Ac_full up to date for the cells at index
+    # after A_tc or one_count were changed there. Callers that already
+    # hold the new values of those cells can pass them in, which saves
+    # gathering them again
+    def patch_Ac_full(self, index: tuple, A_tc: np.ndarray=None, one_count: np.ndarray=None) -> None:
+        if self.Ac_full_dirty:
+            return
 
-        self.n += 1
+        if A_tc is None:
+            A_tc, one_count = self.A_tc[index], self.one_count[index]
+        self.Ac_full[index] = np.maximum(A_tc, one_count > 0)
 
-    def add_AND_gate(self, ref: QGraphicsRectItem) -> None:
-        n = self.n
-        self.refi[ref] = n
-        self.iref[n] = ref
+    # ORs new_paths into the closure wherever mask is set.
+    # A_tc and one_count are views of the cells being updated.
+    # Paths of weight exactly 1 are counted rather than combined
+    def or_paths(self, A_tc: np.ndarray, one_count: np.ndarray,
+                 new_paths: np.ndarray, mask: np.ndarray) -> None:
+        is_one = 1 == new_paths
+        one_count[mask & is_one] += 1
 
-        self.r0[n] = 0
-        self.is_AND[n] = True
+        is_frac = mask & ~is_one
+        A_tc[is_frac] = 1 - (1 - A_tc[is_frac]) * (1 - new_paths[is_frac])
 
-        self.A[n, :n + 1] = 0
-        self.A[:n, n] = 0
+    def add_vertices(self, refs: list[Hashable], direct_risks: list[float]=None) -> None:
+        slots = self.alloc_slots(len(refs))
 
-        self.A_tc[n, :n + 1] = 0
-        self.A_tc[:n, n] = 0
+        for i, ref in zip(slots, refs):
+            self.refi[ref] = i
+            self.iref[i] = ref
+            self.succ[i] = {}
+            self.pred[i] = {}
 
-        self.n += 1
+        if direct_risks is not None:
+            self.r0[slots] = direct_risks
+        else:
+            self.r0[slots] = self.DEFAULT_DR
+
+        self.active[slots] = True
+        self.is_AND[slots] = False
+        self.clear_slots(slots)
+        self.append_to_order(slots)
+        self.mark_new_r(slots)
+
+    def add_vertex(self, ref: Hashable, direct_risk: float=DEFAULT_DR) -> None:
+        i = self.alloc_slots(1)[0]
+        self.refi[ref] = i
+        self.iref[i] = ref
+        self.succ[i] = {}
+        self.pred[i] = {}
+
+        self.r0[i] = direct_risk
+        self.active[i] = True
+        self.is_AND[i] = False
+        self.clear_slots(i)
+        self.append_to_order(i)
+        self.mark_new_r(i)
+
+    def add_AND_gate(self, ref: Hashable) -> None:
+        i = self.alloc_slots(1)[0]
+        self.refi[ref] = i
+        self.iref[i] = ref
+        self.succ[i] = {}
+        self.pred[i] = {}
+
+        self.r0[i] = 0
+        self.active[i] = True
+        self.is_AND[i] = True
+        self.clear_slots(i)
+        self.append_to_order(i)
+        self.mark_new_r(i)
+
+    # A k-out-of-n gate, failing if at least k of its inputs do. It
+    # sits in the closure exactly like an AND gate, which is a voting
+    # gate with k equal to its number of inputs
+    def add_voting_gate(self, ref: Hashable, k: int) -> None:
+        self.add_AND_gate(ref)
+        self.vote_k[self.refi[ref]] = k
+
+    # The new weight is picked up by the next update_r()
+    def set_vote_k(self, ref: Hashable, k: int) -> None:
+        self.vote_k[self.refi[ref]] = k
+
+    # Puts new vertices at the end of the topological order, which
+    # is always valid since they don't have any edges yet
+    def append_to_order(self, slots: np.ndarray) -> None:
+        slots = np.atleast_1d(slots)
+        self.topo_pos[slots] = self.next_topo_pos + np.arange(len(slots))
+        self.next_topo_pos += len(slots)
+
+    # Keeps the topological order valid as the edge a -> b goes in,
+    # following Pearce and Kelly. Only the vertices between b and a in
+    # the order can be out of place: those b reaches and those that
+    # reach a. Both sets are moved together, the ones reaching a first,
+    # onto the positions they held between them. Returns False without
+    # changing anything if b reaches a, meaning the edge closes a cycle
+    def reorder_for_edge(self, a: int, b: int) -> bool:
+        pos = self.topo_pos
+        lower, upper = pos[b], pos[a]
+        if lower > upper or a == b:
+            return True
+
+        forward = []
+        seen = {b}
+        stack = [b]
+        while stack:
+            v = stack.pop()
+            forward.append(v)
+            for i in self.succ[v]:
+                if i == a:
+                    return False
+                if i not in seen and pos[i] < upper:
+                    seen.add(i)
+                    stack.append(i)
+
+        backward = []
+        seen = {a}
+        stack = [a]
+        while stack:
+            v = stack.pop()
+            backward.append(v)
+            for j in self.pred[v]:
+                if j not in seen and pos[j] > lower:
+                    seen.add(j)
+                    stack.append(j)
+
+        moved = np.array(sorted(backward, key=pos.__getitem__) + sorted(forward, key=pos.__getitem__), np.intp)
+        pos[moved] = np.sort(pos[moved])
+        return True
+
+    # Tarjan's algorithm, with an explicit stack since dependency
+    # chains can be deeper than Python's recursion limit. Returns the
+    # strongly connected components of the active vertices as lists of
+    # slots, in topological order of the condensed graph
+    def strongly_connected_components(self) -> list[list[int]]:
+        index = {}
+        low = {}
+        on_stack = set()
+        stack = []
+        components = []
+
+        for root in np.flatnonzero(self.active[:self.n]).tolist():
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.succ[root]))]
+            while work:
+                v, out = work[-1]
+                b = next(out, None)
+                if b is not None:
+                    if b not in index:
+                        index[b] = low[b] = len(index)
+                        stack.append(b)
+                        on_stack.add(b)
+                        work.append((b, iter(self.succ[b])))
+                    elif b in on_stack:
+                        low[v] = min(low[v], index[b])
+                    continue
+
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    low[u] = min(low[u], low[v])
+                if low[v] == index[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        on_stack.discard(w)
+                        component.append(w)
+                        if w == v:
+                            break
+                    components.append(component)
+
+        # Tarjan finishes components downstream first
+        components.reverse()
+        return components
+
+    # Rebuilds the order and the cycles of the topological engine from
+    # scratch. Each component gets one position, in topological order
+    def condense(self) -> None:
+        components = self.strongly_connected_components()
+        self.cycles = []
+        self.cycle_reach = {}
+        self.scc_of[:self.n] = -1
+        for position, component in enumerate(components):
+            component = np.array(component, np.intp)
+            self.topo_pos[component] = position
+            if len(component) > 1:
+                self.scc_of[component] = len(self.cycles)
+                self.cycles.append(np.sort(component))
+        self.next_topo_pos = len(components)
+        self.sccs_dirty = False
+
+    # Switches to engine, computing whatever it keeps from the
+    # adjacency. Returns the engine in use afterwards. Every r is
+    # recomputed, since the engines approximate shared paths differently
+    def set_engine(self, engine: str) -> str:
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}, expected one of {self.ENGINES}")
 
-    # edge is a tuple (a, b) where a -> b
-    def add_edge(self, edge: tuple[QGraphicsRectItem], weight: float=DEFAULT_EDGE_WEIGHT) -> None:
         n = self.n
-        a, b = self.refi[edge[0]], self.refi[edge[1]]
-        self.A[b, a] = weight
+        if "topological" == engine:
+            self.condense()
+            # The closure matrices are the memory this saves
+            for name, dtype in (("A_tc", np.double), ("one_count", np.uint64), ("Ac_full", np.double)):
+                setattr(self, name, np.empty((0, 0), dtype))
+            self.closure_built = False
+            self.Ac_full_dirty = True
+            self.reach = ReachIndex()
+            self.reach_dirty = True
+
+        if engine == self.engine:
+            return engine
+
+        if "closure" == engine:
+            self.check_closure_size(self.vertex_count)
+            if self.n > self.MAX_CLOSURE_VERTICES:
+                self.compact()
+            if self.capacity > self.MAX_CLOSURE_VERTICES:
+                self.resize(self.MAX_CLOSURE_VERTICES)
+        self.engine = engine
+        # The closure is built when it's first needed
+        if "closure" == engine:
+            self.reach = ReachIndex(self.capacity)
+        self.r_dirty[:n] = self.active[:n]
+        return engine
+
+    # Keeps the topological engine's order and cycles valid as a -> b
+    # goes in. While the graph is acyclic the order is repaired in place.
+    # An edge that closes a cycle, or any backward edge once there are
+    # cycles, leaves the components to be found again before the next
+    # evaluation. An edge inside a cycle changes how it's solved
+    def insert_topological_edge(self, a: int, b: int) -> None:
+        pos = self.topo_pos
+        c = self.scc_of[a]
+        if 0 <= c and c == self.scc_of[b]:
+            self.cycle_changed(c)
+        elif self.sccs_dirty:
+            pass
+        elif self.cycles:
+            self.sccs_dirty = pos[a] > pos[b]
+        else:
+            self.sccs_dirty = not self.reorder_for_edge(a, b)
+        self.r_dirty[b] = True
+
+    # The existing edge a -> b changed weight or went away
+    def update_topological_edge(self, a: int, b: int, new_weight: float) -> None:
+        c = self.scc_of[a]
+        if 0 <= c and c == self.scc_of[b]:
+            self.cycle_changed(c)
+            # Losing an edge can split the cycle
+            if 0 == new_weight:
+                self.sccs_dirty = True
+        self.r_dirty[b] = True
+
+    # Everything on cycle c depends on everything else on it
+    def cycle_changed(self, c: int) -> None:
+        self.cycle_reach.pop(c, None)
+        self.r_dirty[self.cycles[c]] = True
+
+    # edge is a tuple of references (a, b) where a -> b
+    def add_edge(self, edge: tuple[Hashable], weight: float=DEFAULT_EDGE_WEIGHT) -> None:
+        self.add_edge_i((self.refi[edge[0]], self.refi[edge[1]]), weight)
+
+    # edge is a tuple of integers (a, b) where a -> b
+    def add_edge_i(self, edge: tuple[int], weight: float=DEFAULT_EDGE_WEIGHT) -> None:
+        n = self.n
+        a, b = edge
+        if "topological" == self.engine:
+            self.set_edge_weight_i(edge, weight)
+            self.insert_topological_edge(a, b)
+            return
+        # Before the edge goes into the adjacency, which the
+        # closure would otherwise be built from
+        if not self.closure_built:
+            self.build_closure()
+        self.set_edge_weight_i(edge, weight)
+
+        if weight and not self.reach_dirty:
+            self.reach.add_edge(a, b, n)
 
         # Add to A-collapse by combining with existing connections
         if 1 == weight:
@@ -140,33 +680,38 @@ class DepGraph:
             self.A_tc[b, a] = self.scl_or_scl(
                 self.A_tc[b, a], weight
             )
+        self.patch_Ac_full((b, a))
 
         Ac_full = self.calc_Ac_full()
+        # Column a is about to change, but the paths through
+        # a below are built from what it was before this edge
+        Ac_full_a = Ac_full[:, a].copy()
 
         # Collapse paths starting at a and passing through b
         # If we're dealing with an AND gate as B, we should
         # only collapse paths leading to other AND gates
         # Skip b because we don't care about loops
-        to_update_to = np.copy(self.is_AND[:n]) if self.is_AND[b] else [True] * n
+        to_update_to = np.copy(self.is_AND[:n]) if self.is_AND[b] else np.ones(n, bool)
         to_update_to[b] = False
-        for i in compress(range(n), to_update_to):
-            # When a != AND & b = AND don't incorporate
-            # (b -> i) in (a -> b -> i)_c
-            new_path = weight
-            if not self.is_AND[b] or self.is_AND[a]:
-                new_path *= Ac_full[i, b]
-
-            if 1 == new_path:
-                self.one_count[i, a] += 1
-            else:
-                # a -> i OR (a -> b AND b -> i)
-                self.A_tc[i, a] = self.scl_or_scl(
-                    self.A_tc[i, a], new_path
-                )
+
+        # When a != AND & b = AND don't incorporate
+        # (b -> i) in (a -> b -> i)_c
+        if not self.is_AND[b] or self.is_AND[a]:
+            new_paths = weight * Ac_full[:, b]
+        else:
+            new_paths = np.full(n, weight, np.double)
+
+        # a -> i OR (a -> b AND b -> i)
+        self.or_paths(self.A_tc[:n, a], self.one_count[:n, a], new_paths, to_update_to)
+        # AND gate rows change here whether or not a reaches them
+        # along the edges, so every changed row needs a new r
+        self.r_dirty[b] = True
+        self.r_dirty[:n] |= to_update_to & (0 != new_paths)
 
         # Make sure a doesn't loop on itself
         self.A_tc[a, a] = 0
         self.one_count[a, a] = 0
+        self.patch_Ac_full((slice(None, n), a))
         
         # Collapse other paths that pass through a to b
         # Skip a's and b's columns. A's because we already
@@ -174,28 +719,48 @@ class DepGraph:
         # about loops
         # If we're dealing with an AND gate as a, we only want to
         # collapse paths of the form (i -> a -> AND)
-        to_update_to = np.copy(self.is_AND[:n]) if self.is_AND[a] else [True] * n
+        to_update_to = np.copy(self.is_AND[:n]) if self.is_AND[a] else np.ones(n, bool)
         to_update_to[a] = False
-        to_update_from = [True] * n
+        to_update_from = np.ones(n, bool)
         to_update_from[a] = False
         to_update_from[b] = False
-        for j in compress(range(n), to_update_from):
-            for i in compress(range(n), to_update_to):
-                # j -> i OR (j -> a AND a -> i)
-                new_path = Ac_full[a, j]
-                if not self.is_AND[a] or self.is_AND[j]:
-                    new_path *= Ac_full[i, a]
-                
-                if 1 == new_path:
-                    self.one_count[i, j] += 1
-                else:
-                    self.A_tc[i, j] = self.scl_or_scl(self.A_tc[i, j], new_path)
+
+        # Only cells where j reaches a, and a reaches i unless a is
+        # an AND gate, get any new paths, so we work on that block
+        if not self.is_AND[a]:
+            to_update_to &= 0 != Ac_full_a
+        to_update_from &= 0 != Ac_full[a, :]
+        rows = np.flatnonzero(to_update_to)
+        cols = np.flatnonzero(to_update_from)
+        block = np.ix_(rows, cols)
+
+        # [i, j] = (j -> a AND a -> i), a rank-1 update. Columns
+        # for non-AND j feeding an AND gate a skip (a -> i)
+        Ac_full_to_a = Ac_full[a, cols]
+        new_paths = np.outer(Ac_full_a[rows], Ac_full_to_a)
+        if self.is_AND[a]:
+            skip_a_to_i = ~self.is_AND[cols]
+            new_paths[:, skip_a_to_i] = Ac_full_to_a[skip_a_to_i]
+
+        # j -> i OR (j -> a AND a -> i)
+        A_tc = self.A_tc[block]
+        one_count = self.one_count[block]
+        self.or_paths(A_tc, one_count, new_paths, np.ones(new_paths.shape, bool))
 
         # Remove any loops we've created
-        np.fill_diagonal(self.A_tc[:n, :n], 0)
-        np.fill_diagonal(self.one_count[:n, :n], 0)
+        loops = rows[:, None] == cols[None, :]
+        A_tc[loops] = 0
+        one_count[loops] = 0
+        self.A_tc[block] = A_tc
+        self.one_count[block] = one_count
+        self.patch_Ac_full(block, A_tc, one_count)
+        self.r_dirty[rows[np.any(0 != new_paths, axis=1)]] = True
+
+        # Every path this edge created ends somewhere a now reaches
+        self.mark_r_dirty(a)
+        self.after_mutation(edge, weight)
     
-    def add_edges(self, edges: list[tuple[QGraphicsRectItem]], weights: list[float]=None) -> None:
+    def add_edges(self, edges: list[tuple[Hashable]], weights: list[float]=None) -> None:
         if None == weights:
             for e in edges:
                 self.add_edge(e)
@@ -203,186 +768,1028 @@ class DepGraph:
             for e, w in zip(edges, weights):
                 self.add_edge(e, w)
 
+    # Kahn's algorithm over the active vertices
+    # Returns None if the graph has a cycle
+    def topological_order(self) -> list[int]:
+        in_degree = { b : len(in_edges) for b, in_edges in self.pred.items() }
+        order = [ v for v, d in in_degree.items() if 0 == d ]
+        for v in order:
+            for b in self.succ[v]:
+                in_degree[b] -= 1
+                if 0 == in_degree[b]:
+                    order.append(b)
+
+        return order if len(order) == len(in_degree) else None
+
+    # Sources in the order build_closure() adds their edges, each one's
+    # all at once in the order of self.succ. For acyclic graphs that's
+    # reverse topological order, so every vertex comes after everything
+    # it reaches, cyclic ones are just taken slot by slot
+    def closure_sources(self) -> list[int]:
+        order = self.topological_order()
+        if order is None:
+            return sorted(self.succ)
+        return order[::-1]
+
+    # Every edge (a, b), in the order build_closure() adds them
+    def closure_edge_order(self) -> list[tuple[int]]:
+        return [ (a, b) for a in self.closure_sources() for b in self.succ[a] ]
+
+    # Recomputes A_tc and one_count from the adjacency alone. The result
+    # is exactly what add_edge_i() gives for every edge one by one in
+    # closure_edge_order(), but the edges out of each vertex go in
+    # together, see add_out_edges_i(). The matrices are allocated here
+    # the first time
+    def build_closure(self) -> None:
+        n = self.n
+        if not self.closure_built:
+            self.A_tc = np.zeros((self.capacity, self.capacity), np.double)
+            self.one_count = np.zeros((self.capacity, self.capacity), np.uint64)
+            self.Ac_full = np.zeros((self.capacity, self.capacity), np.double)
+            self.closure_built = True
+        for M in (self.A_tc, self.one_count, self.Ac_full):
+            M[:n, :n] = 0
+        self.Ac_full_dirty = False
+
+        for a in self.closure_sources():
+            if self.succ[a]:
+                self.add_out_edges_i(a)
+
+        self.reach_dirty = True
+        self.r_dirty[:n] = self.active[:n]
+        if self.shadow is not None:
+            self.shadow.closure_rebuilt()
+
+    # Adds every edge out of a to the closure, as the same add_edge_i()
+    # calls in the order of self.succ[a] would. Each call ORs paths into
+    # column a, reading the column of its b, and then into the columns
+    # of whatever reaches a, reading row a. Nothing changes row a along
+    # the way, so the second part of every call works on one block of
+    # the columns reaching a, gathered once. Columns of components that
+    # reach an AND gate a get the same paths from each call, so those
+    # are ORed in k times at the end, unless one is read on the way.
+    # The r, reachability and shadow bookkeeping of add_edge_i() is
+    # left to the caller
+    def add_out_edges_i(self, a: int) -> None:
+        n = self.n
+        is_AND = self.is_AND[:n]
+        A_tc = self.A_tc[:n, :n]
+        one_count = self.one_count[:n, :n]
+        succ = list(self.succ[a].items())
+
+        # [j] = (j -> a), as it stays for all of them
+        to_a = np.maximum(A_tc[a], one_count[a] > 0)
+        rows = np.flatnonzero(is_AND if is_AND[a] else np.ones(n, bool))
+        rows = rows[rows != a]
+        cols = np.flatnonzero(to_a)
+        # For an AND gate a, components j only get (j -> a) itself
+        same = is_AND[a] & ~is_AND[cols]
+        same_cols = cols[same]
+        cols = cols[~same]
+        block = np.ix_(rows, cols)
+        block_A_tc = A_tc[block]
+        block_one_count = one_count[block]
+        loops = rows[:, None] == cols[None, :]
+        col_index = { j : k for k, j in enumerate(cols.tolist()) }
+        same_index = { j : k for k, j in enumerate(same_cols.tolist()) }
+
+        A_tc_a = A_tc[:, a].copy()
+        one_count_a = one_count[:, a].copy()
+        for k, (b, weight) in enumerate(succ):
+            if 1 == weight:
+                one_count_a[b] += 1
+            else:
+                A_tc_a[b] = self.scl_or_scl(A_tc_a[b], weight)
+            Ac_full_a = np.maximum(A_tc_a, one_count_a > 0)
+
+            # Column b, with whatever the calls before this one
+            # ORed into it
+            Ac_full_b = np.maximum(A_tc[:, b], one_count[:, b] > 0)
+            if b in col_index:
+                p = col_index[b]
+                Ac_full_b[rows] = np.maximum(block_A_tc[:, p], block_one_count[:, p] > 0)
+            elif b in same_index:
+                Ac_full_b[rows] = self.or_repeated(A_tc[rows, b], one_count[rows, b], to_a[b], k)
+
+            to_update_to = np.copy(is_AND) if is_AND[b] else np.ones(n, bool)
+            to_update_to[b] = False
+            if not is_AND[b] or is_AND[a]:
+                new_paths = weight * Ac_full_b
+            else:
+                new_paths = np.full(n, weight, np.double)
+            self.or_paths(A_tc_a, one_count_a, new_paths, to_update_to)
+            A_tc_a[a] = 0
+            one_count_a[a] = 0
+
+            # j -> i OR (j -> a AND a -> i), for the j reaching a
+            if len(cols):
+                from_a = Ac_full_a[rows]
+                mask = np.outer(is_AND[a] | (from_a != 0), cols != b)
+                new_paths = np.outer(from_a, to_a[cols])
+                self.or_paths(block_A_tc, block_one_count, new_paths, mask)
+                block_A_tc[loops] = 0
+                block_one_count[loops] = 0
+
+        A_tc[:, a] = A_tc_a
+        one_count[:, a] = one_count_a
+        self.patch_Ac_full((slice(None, n), a))
+        if len(cols):
+            A_tc[block] = block_A_tc
+            one_count[block] = block_one_count
+            self.patch_Ac_full(block, block_A_tc, block_one_count)
+        if len(same_cols):
+            # Every call but the one for the edge to j itself
+            times = len(succ) - np.isin(same_cols, list(self.succ[a]))
+            times = np.broadcast_to(times, (len(rows), len(same_cols)))
+            paths = np.broadcast_to(to_a[same_cols], times.shape)
+            same_block = np.ix_(rows, same_cols)
+            A_tc_same, one_count_same = A_tc[same_block], one_count[same_block]
+            is_one = 1 == paths
+            one_count_same[is_one] += times[is_one].astype(one_count.dtype)
+            A_tc_same[~is_one] = 1 - (1 - A_tc_same[~is_one]) * (1 - paths[~is_one]) ** times[~is_one]
+            A_tc[same_block] = A_tc_same
+            one_count[same_block] = one_count_same
+            self.patch_Ac_full(same_block, A_tc_same, one_count_same)
+
+    # Ac_full of cells holding A_tc and one_count after the path p
+    # was ORed into them times times
+    @staticmethod
+    def or_repeated(A_tc: np.ndarray, one_count: np.ndarray, p: float, times: int) -> np.ndarray:
+        if 1 == p:
+            return np.maximum(A_tc, (one_count + times) > 0)
+        return np.maximum(1 - (1 - A_tc) * (1 - p) ** times, one_count > 0)
+
+    # Builds a graph from complete arrays in one go instead of edge by
+    # edge. edges is an (E, 2) array of indices into refs, one row per
+    # edge (a -> b), and is_AND marks which refs are AND gates. The
+    # closure engine adds the edges in closure_edge_order(), which
+    # doesn't depend on the order they're given in, all out of one
+    # vertex at a time. With keep_order they're added one by one in the
+    # order given instead, as add_edges() would
+    @classmethod
+    def from_arrays(cls, refs: list[Hashable], edges: np.ndarray,
+                    weights: np.ndarray=None, direct_risks: np.ndarray=None,
+                    is_AND: np.ndarray=None, engine: str="closure",
+                    keep_order: bool=False) -> "DepGraph":
+        dg = cls(len(refs), engine)
+        dg.add_vertices(refs, direct_risks)
+
+        if is_AND is not None:
+            is_AND = np.asarray(is_AND, bool)
+            dg.is_AND[:len(refs)] = is_AND
+            dg.r0[:len(refs)][is_AND] = 0
+
+        edges = np.asarray(edges, np.intp).reshape(-1, 2)
+        if weights is None:
+            weights = np.full(len(edges), cls.DEFAULT_EDGE_WEIGHT)
+        edges = zip(edges.tolist(), np.asarray(weights).tolist())
+        if keep_order and "closure" == engine:
+            for (a, b), weight in edges:
+                dg.add_edge_i((a, b), weight)
+            return dg
+
+        for (a, b), weight in edges:
+            dg.set_edge_weight_i((a, b), weight)
+        if "topological" == engine:
+            # Orders everything at once
+            dg.set_engine(engine)
+        else:
+            dg.build_closure()
+        return dg
+
+    # A is a view of closure probabilities and b holds the
+    # weights of events to remove from them, where b != 1.
+    # Dividing by 1 - b blows up whatever rounding A carries as b
+    # nears 1, so the result is clamped to a probability
+    def mat_or_inv(self, A: np.ndarray, b: np.ndarray) -> None:
+        np.subtract(A, b, out=A)
+        np.divide(A, 1 - b, out=A)
+        np.clip(A, 0, 1, out=A)
+
     # edge is a tuple of integers (a, b) where (a -> b)
     def update_edge_i(self, edge: tuple[int], new_weight: float) -> None:
         n = self.n
         a, b = edge
 
-        # We need to add the identity matrix so our calculations
-        # for broken_path_weight are accurate when i or j = a or b
-        Ac_full = self.I[:n, :n] + self.calc_Ac_full()
-        old_weight = Ac_full[b, a]
+        # Note that (a -> b) is not all possible paths (a -> b),
+        # but the specific edge we're updating
+        old_weight = self.get_edge_weight_i(edge)
         if old_weight == new_weight:
             return
-        self.A[b, a] = new_weight
+        # A new edge goes in exactly as add_edge_i() would put it
+        if not old_weight:
+            self.add_edge_i(edge, new_weight)
+            return
+        if "closure" == self.engine and not self.closure_built:
+            self.build_closure()
+        self.set_edge_weight_i(edge, new_weight)
+
+        if "topological" == self.engine:
+            self.update_topological_edge(a, b, new_weight)
+            return
+
+        if not new_weight:
+            self.reach_exact = False
+
+        # We need to add the identity matrix so our calculations
+        # for broken_paths are accurate when i or j = a or b.
+        # The diagonal of Ac_full is always 0, so we only need
+        # it on the column and row we use
+        Ac_full = self.calc_Ac_full()
+        Ac_full_b = Ac_full[:, b].copy()
+        Ac_full_b[b] = 1
+        Ac_full_a = Ac_full[a, :].copy()
+        Ac_full_a[a] = 1
+
+        # Only paths (i -> a -> b -> j) can be affected, so we work
+        # on the block of rows that b reaches and columns that reach a
+        rows = np.flatnonzero(Ac_full_b)
+        cols = np.flatnonzero(Ac_full_a)
+        block = np.ix_(rows, cols)
 
-        # Handle the edge itself directly if a is an AND gate
-        # In all other cases, this is handled in the for-loop below
-        if self.is_AND[a]:
-            if 1 == old_weight:
-                self.one_count[b, a] -= 1
-            else:
-                self.A_tc[b, a] = self.or_inv(
-                    self.A_tc[b, a], old_weight
-                )
-            
-            if 1 == new_weight:
-                self.one_count[b, a] += 1
-            else:
-                self.A_tc[b, a] = self.scl_or_scl(
-                    self.A_tc[b, a], new_weight
-                )
-        
-        # Remove influence of deleted edge on other paths
-        # then add influence of new edge weight
         # Skip diagonal because we don't allow those edges
         # If the edge involves an AND gate, we should only update
         # connections through it to other AND gates
-        to_update_to = self.is_AND[:n] if self.is_AND[a] or self.is_AND[b] else [True] * n
-        rangen = range(n)
-        for i, j in filter(lambda t: t[0] != t[1], product(rangen, compress(rangen, to_update_to))):
-            # (i -> a) AND (a -> b) AND (b -> j)
-            # Note that (a -> b) is not all possible paths (a -> b),
-            # but the specific edge we're updating
-            broken_path_weight = Ac_full[a, i] * old_weight * Ac_full[j, b]
-            # Remove influence of (a -> b) on (i -> j)
-            if 1 == broken_path_weight:
-                self.one_count[j, i] -= 1
-            else:
-                self.A_tc[j, i] = self.or_inv(
-                    self.A_tc[j, i], broken_path_weight
-                )
-
-            # Add influence of new weight
-            if 1 == new_weight:
-                self.one_count[j, i] += 1
-            else:
-                self.A_tc[j, i] = self.scl_or_scl(
-                    self.A_tc[j, i], new_weight
-                )
+        to_update_to = self.is_AND[rows] if self.is_AND[a] or self.is_AND[b] else np.ones(len(rows), bool)
+        mask = np.outer(to_update_to, np.ones(len(cols), bool))
+        mask &= rows[:, None] != cols[None, :]
+        # The edge itself is always updated, AND gate or not
+        mask |= np.outer(rows == b, cols == a)
+
+        # [j, i] = (i -> a) AND (a -> b) AND (b -> j)
+        broken_paths = np.outer(Ac_full_b[rows], Ac_full_a[cols] * old_weight)
+        new_paths = np.outer(Ac_full_b[rows], Ac_full_a[cols] * new_weight)
+
+        A_tc = self.A_tc[block]
+        one_count = self.one_count[block]
+
+        # Remove influence of (a -> b) on (i -> j). Counts are
+        # floored at zero so they can't wrap around
+        is_one = mask & (1 == broken_paths)
+        one_count[is_one] -= (one_count[is_one] > 0).astype(one_count.dtype)
+
+        is_frac = mask & (1 != broken_paths)
+        A_frac = A_tc[is_frac]
+        self.mat_or_inv(A_frac, broken_paths[is_frac])
+        A_tc[is_frac] = A_frac
+
+        # Add influence of new weight along the same paths
+        self.or_paths(A_tc, one_count, new_paths, mask & (0 != new_paths))
+
+        self.A_tc[block] = A_tc
+        self.one_count[block] = one_count
+        self.patch_Ac_full(block, A_tc, one_count)
+        self.r_dirty[rows] = True
+        self.after_mutation(edge, new_weight)
 
     # edge is a tuple of references (a, b) where (a -> b)
-    def update_edge(self, edge: tuple[QGraphicsRectItem], new_weight: float) -> None:
+    def update_edge(self, edge: tuple[Hashable], new_weight: float) -> None:
         self.update_edge_i((self.refi[edge[0]], self.refi[edge[1]]), new_weight)
 
-    def update_edges(self, edges: list[tuple[QGraphicsRectItem]], new_weights: list[float]) -> None:
+    def update_edges(self, edges: list[tuple[Hashable]], new_weights: list[float]) -> None:
         for e, w in zip(edges, new_weights):
             self.update_edge(e, w)
 
-    def update_vertex(self, ref: QGraphicsRectItem, new_weight: float) -> None:
-        self.r0[self.refi[ref]] = new_weight
-
-    def update_vertices(self, refs: list[QGraphicsRectItem], new_weights: list[float]) -> None:
-        for ref, nw in zip(refs, new_weights):
-            self.update_vertex(ref, nw)
+    # A direct risk set by hand replaces any Weibull distribution
+    def update_vertex(self, ref: Hashable, new_weight: float) -> None:
+        i = self.refi[ref]
+        self.has_weibull[i] = False
+        if self.r0[i] == new_weight:
+            return
+        self.r0[i] = new_weight
+        self.mark_r_dirty(i)
+
+    def update_vertices(self, refs: list[Hashable], new_weights: list[float]) -> None:
+        indices = self.indices_of(refs)
+        self.has_weibull[indices] = False
+        new_weights = np.asarray(new_weights, np.double)
+        changed = self.r0[indices] != new_weights
+        self.r0[indices] = new_weights
+        self.mark_r_dirty(indices[changed])
+
+    # CDF of the three parameter Weibull distribution, with the
+    # parameters as they're stored in the database: lb is the location,
+    # be the scale and ub the shape. Broadcasts over all arguments
+    @classmethod
+    def weibull_cdf(cls, t: np.ndarray, lb: np.ndarray, be: np.ndarray, ub: np.ndarray) -> np.ndarray:
+        t, lb, be, ub = np.broadcast_arrays(*(np.asarray(x, np.double) for x in (t, lb, be, ub)))
+        shape = np.clip(ub, 0, cls.MAX_WEIBULL_SHAPE)
+
+        # Nothing fails before the location, and a scale of
+        # 0 means we have no data, which we treat as no risk
+        with np.errstate(divide="ignore", invalid="ignore"):
+            e_power = (np.maximum(t - lb, 0) / be) ** shape
+        return np.where(0 == be, 0, -np.expm1(-e_power))
+
+    # Gives ref a Weibull failure time distribution, params being
+    # (location, scale, shape), and sets its direct risk to the
+    # probability of failing by mission_time
+    def set_weibull(self, ref: Hashable, params: tuple[float],
+                    mission_time: float=DEFAULT_MISSION_TIME) -> None:
+        self.update_vertex(ref, float(self.weibull_cdf(mission_time, *params)))
+        i = self.refi[ref]
+        self.weibull[i] = params
+        self.has_weibull[i] = True
+
+    # [k, i] = r0[i] at times[k]. Vertices without a Weibull
+    # distribution keep their r0 at every time
+    def calc_r0_at(self, times: np.ndarray) -> np.ndarray:
+        n = self.n
+        times = np.atleast_1d(np.asarray(times, np.double))
+        r0 = np.repeat(self.r0[None, :n], len(times), axis=0)
+
+        dist = np.flatnonzero(self.has_weibull[:n])
+        lb, be, ub = self.weibull[dist].T
+        r0[:, dist] = self.weibull_cdf(times[:, None], lb, be, ub)
+        return r0
+
+    # [k, j] = r[rows[j]] at times[k], every row by default, so a column
+    # is the unreliability curve of a vertex. The times are evaluated
+    # BATCH_COLUMNS at a time as columns of one r0 matrix
+    def calc_r_at(self, times: np.ndarray, rows: np.ndarray=None) -> np.ndarray:
+        n = self.n
+        times = np.atleast_1d(np.asarray(times, np.double))
+        rows = np.arange(n) if rows is None else np.atleast_1d(rows)
+
+        r = np.empty((len(times), len(rows)), np.double)
+        for start in range(0, len(times), self.BATCH_COLUMNS):
+            chunk = times[start:start + self.BATCH_COLUMNS]
+            r[start:start + len(chunk)] = self.calc_r_batch(self.calc_r0_at(chunk).T, rows).T
+        return r
+
+    # The first time in times at which the risk of ref reaches
+    # threshold, interpolated linearly between the two times around
+    # it. times should be increasing. None if it never does
+    def crossing_time(self, ref: Hashable, threshold: float, times: np.ndarray) -> float:
+        times = np.atleast_1d(np.asarray(times, np.double))
+        r = self.calc_r_at(times, self.refi[ref])[:, 0]
+
+        above = r >= threshold
+        if not np.any(above):
+            return None
+        k = int(np.argmax(above))
+        if 0 == k:
+            return float(times[0])
+
+        t0, t1 = times[k - 1], times[k]
+        r0, r1 = r[k - 1], r[k]
+        return float(t0 + (threshold - r0) * (t1 - t0) / (r1 - r0))
 
     # edge is a tuple of integers (a, b) where (a -> b)
     def delete_edge_i(self, edge: tuple[int]) -> None:
         self.update_edge_i(edge, 0)
             
     # edge is a tuple of references (a, b) where (a -> b)
-    def delete_edge(self, edge: tuple[QGraphicsRectItem]) -> None:
+    def delete_edge(self, edge: tuple[Hashable]) -> None:
         self.delete_edge_i((self.refi[edge[0]], self.refi[edge[1]]))
 
-    def delete_edges(self, edges: list[tuple[QGraphicsRectItem]]) -> None:
+    def delete_edges(self, edges: list[tuple[Hashable]]) -> None:
         for e in edges:
             self.delete_edge(e)
 
     # This works for AND gates too
-    def delete_vertex(self, ref: QGraphicsRectItem) -> None:
-        n = self.n
+    # The slot is emptied in place and only reused or compacted
+    # later, so no other vertex changes index here
+    def delete_vertex(self, ref: Hashable, compact: bool=True) -> None:
         vi = self.refi[ref]
+        # Whatever vi reached loses it, even through paths the
+        # edge deletions below leave alone
+        self.mark_r_dirty(vi)
 
         # Delete edges before we lose their information
-        for i, j in chain(product((vi,), range(n)), product(range(n), (vi,))):
-            if self.A[i, j]:
-                self.delete_edge_i((j, i))
+        for j in sorted(self.pred[vi]):
+            self.delete_edge_i((j, vi))
+        for i in sorted(self.succ[vi]):
+            self.delete_edge_i((vi, i))
+
+        # delete_edge_i() leaves edges with no weight left in the
+        # closure alone, so drop whatever is still attached to vi
+        for i in self.succ.pop(vi):
+            del self.pred[i][vi]
+        for j in self.pred.pop(vi):
+            del self.succ[j][vi]
 
         del self.refi[ref]
-        for key in self.refi.keys():
-            index = self.refi[key]
-            if index > vi:
-                self.refi[key] = index - 1
-
-        self.iref[vi:n - 1] = self.iref[vi + 1:n]
-        self.r0[vi:n - 1] = self.r0[vi + 1:n]
-        self.is_AND[vi:n - 1] = self.is_AND[vi + 1:n]
+        self.iref[vi] = None
+        self.active[vi] = False
+        self.r0[vi] = 0
+        self.r[vi] = 0
+        self.r_dirty[vi] = False
+        self.r_unreported[vi] = False
+        self.is_AND[vi] = False
+        self.clear_slots(vi)
+        self.free_slots.append(vi)
+
+        if compact:
+            self.maybe_compact()
+
+    # Compacts at most once, however many vertices are deleted
+    def delete_vertices(self, refs: list[Hashable]) -> None:
+        for ref in refs:
+            self.delete_vertex(ref, compact=False)
+
+        self.maybe_compact()
+
+    # Returns r0 with the gate entries replaced by their weights.
+    # r0 is either a vector of n probabilities or an (n, B) matrix
+    # holding B of them as columns, which are all evaluated together.
+    # AND gates are done all at once by calc_product_weights() and
+    # voting gates one at a time in topological order, since each
+    # needs the risks of its inputs. When the two kinds feed each other
+    # this alternates until no gate weight moves more than
+    # FIXED_POINT_TOL. With cone, a mask of vertices that holds the
+    # ancestors of each of them, only the gates in it are worked out
+    def calc_AND_weights(self, r0: np.ndarray, cone: np.ndarray=None) -> np.ndarray:
+        n = self.n
+        r0 = np.array(r0, np.double)
+        is_vec = 1 == r0.ndim
+        if is_vec:
+            r0 = r0[:, None]
+
+        cone = np.ones(n, bool) if cone is None else cone
+        is_vote = (self.vote_k[:n] > 0) & cone
+        # Gates start from 0, whatever was stored for them before, and
+        # their weights only grow from there. That makes the result the
+        # least fixed point, the same however often it's worked out
+        gates = np.flatnonzero(self.is_AND[:n] & cone)
+        r0[gates] = 0
+        r0 = self.calc_product_weights(r0, cone)
+        if not np.any(is_vote):
+            return r0[:, 0] if is_vec else r0
+
+        order = self.topological_order()
+        if order is None:
+            order = range(n)
+        votes = [ v for v in order if is_vote[v] ]
+
+        for _ in range(self.MAX_FIXED_POINT_ITERATIONS):
+            old = r0[gates].copy()
+            for v in votes:
+                r0[v] = self.calc_vote_weight(v, r0)
+            r0 = self.calc_product_weights(r0, cone)
+            if np.max(np.abs(r0[gates] - old)) <= self.FIXED_POINT_TOL:
+                break
+
+        return r0[:, 0] if is_vec else r0
+
+    # P(at least k of the independent events with probabilities p
+    # happen), by dynamic programming over the events in O(m * k).
+    # p is (m,) or (m, B) for B sets of m events
+    @staticmethod
+    def prob_at_least(p: np.ndarray, k: int) -> np.ndarray:
+        p = np.asarray(p, np.double)
+        if k <= 0:
+            return np.ones(p.shape[1:])
+        if k > len(p):
+            return np.zeros(p.shape[1:])
+
+        # dist[j] = P(exactly j happened so far) for j < k,
+        # and dist[k] = P(at least k happened so far)
+        dist = np.zeros((k + 1,) + p.shape[1:])
+        dist[0] = 1
+        for p_i in p:
+            # Everything moves up one with probability p_i, except
+            # that dist[k] keeps all of its own mass
+            top = dist[k] * p_i
+            shifted = dist[:-1] * p_i
+            dist *= 1 - p_i
+            dist[1:] += shifted
+            dist[k] += top
+        return dist[k]
+
+    # Weight of voting gate v. Each input fails with its own risk, or
+    # its weight if it's a gate, times the weight of its edge into v
+    def calc_vote_weight(self, v: int, r0: np.ndarray) -> np.ndarray:
+        pred = self.pred[v]
+        inputs = np.fromiter(pred.keys(), np.intp, len(pred))
+        weights = np.fromiter(pred.values(), np.double, len(pred))
+
+        p = r0[inputs].copy()
+        comps = ~self.is_AND[inputs]
+        if np.any(comps):
+            rows = inputs[comps]
+            p[comps] = self.vec_or_vec(r0[rows], self.mat_or_vec(self.calc_Ac_full()[rows, :], r0))
+
+        return self.prob_at_least(p * weights[:, None], self.vote_k[v])
+
+    # Returns the (n, B) r0 with the AND gate entries replaced by their
+    # weights, leaving voting gates as they are. An AND gate's weight
+    # is the product of (j -> i) * r0[j] over the components and voting
+    # gates j connected to it, times (j -> i) * r0[j] over the AND gates
+    # j feeding it. AND gates with nothing connected get 0.
+    # In log space both products are sums, the first is a pair of
+    # matmuls and the second is a triangular system over the AND gates.
+    # cone is as in calc_AND_weights()
+    def calc_product_weights(self, r0: np.ndarray, cone: np.ndarray=None) -> np.ndarray:
+        n = self.n
+        Ac_full = self.calc_Ac_full()
 
-        self.A[vi:n - 1, :n] = self.A[vi + 1:n, :n]
-        self.A[:n - 1, vi:n - 1] = self.A[:n - 1, vi + 1:n]
+        is_AND = self.is_AND[:n] & (self.vote_k[:n] <= 0)
+        # Components and voting gates both have known weights here
+        known = ~is_AND
+        if cone is not None:
+            is_AND &= cone
+            known &= cone
+        AND_indices = np.flatnonzero(is_AND)
+        if not len(AND_indices):
+            return r0
+
+        # Pairs with no path between them are skipped
+        with np.errstate(divide="ignore"):
+            log_Ac = np.log(Ac_full[AND_indices])
+        log_Ac[np.isinf(log_Ac)] = 0
+        is_path = 0 != Ac_full[AND_indices]
+
+        comp_path = is_path[:, known]
+        connected = np.any(comp_path, axis=1)
+        comp_r0 = r0[known]
+        with np.errstate(divide="ignore"):
+            log_r0 = np.where(0 != comp_r0, np.log(comp_r0), 0)
+        log_comp = comp_path @ log_r0 + (log_Ac[:, known] * comp_path) @ (0 != comp_r0)
+        # A connected component that can't fail makes the product 0,
+        # which has no log, so those are tracked on the side
+        certain_ok = (comp_path.astype(np.double) @ (0 == comp_r0)) > 0
+
+        # Only AND gates connected to a component have a nonzero
+        # weight, so only they take part in AND -> AND products.
+        # Sorting by how many AND gates reach each one puts every
+        # gate after those feeding it, since the closure of a DAG
+        # gives upstream gates strictly smaller reach sets. Inside
+        # a cycle, gates later in the order see earlier ones' final
+        # weights and earlier ones see later ones' component-only
+        # weights, as if they were multiplied in one at a time
+        AND_path = is_path[:, AND_indices] & connected[None, :] & connected[:, None]
+        np.fill_diagonal(AND_path, False)
+        order = np.argsort(np.count_nonzero(AND_path, axis=1), kind="stable")
+        order = order[connected[order]]
+        r0[AND_indices] = 0
+        if not len(order):
+            return r0
+
+        AND_path = AND_path[np.ix_(order, order)]
+        log_Ac_AND = log_Ac[:, AND_indices][np.ix_(order, order)] * AND_path
+
+        # x = log_comp + log_Ac_AND.sum(1) + lower @ x + upper @ log_comp
+        lower = np.tril(AND_path, -1).astype(np.double)
+        upper = np.triu(AND_path, 1).astype(np.double)
+        rhs = log_comp[order] + log_Ac_AND.sum(axis=1)[:, None] + upper @ log_comp[order]
+        log_AND = np.linalg.solve(np.identity(len(order)) - lower, rhs)
+
+        # Anything fed by a gate that can't fail can't fail either.
+        # AND_path comes from the closure, so one step reaches them all
+        certain_ok = certain_ok[order]
+        certain_ok |= (AND_path.astype(np.double) @ certain_ok) > 0
+
+        r0[AND_indices[order]] = np.where(certain_ok, 0, np.exp(log_AND))
+        return r0
 
-        self.A_tc[vi:n - 1, :n] = self.A_tc[vi + 1:n, :n]
-        self.A_tc[:n - 1, vi:n - 1] = self.A_tc[:n - 1, vi + 1:n]
+    def update_AND_weights(self) -> None:
+        n = self.n
+        self.r0[:n] = self.calc_AND_weights(self.r0[:n])
 
-        self.one_count[vi:n - 1, :n] = self.one_count[vi + 1:n, :n]
-        self.one_count[:n - 1, vi:n - 1] = self.one_count[:n - 1, vi + 1:n]
+    # Marks the downstream cone of the given vertices, meaning
+    # themselves and everything they reach, as needing a new r.
+    # The topological engine finds the cone as it propagates
+    def mark_r_dirty(self, sources: np.ndarray) -> None:
+        n = self.n
+        sources = np.atleast_1d(sources)
+        if not len(sources):
+            return
 
-        self.n -= 1
+        self.r_dirty[sources] = True
+        # Building the closure marks everything anyway
+        if "topological" == self.engine or not self.closure_built:
+            return
+        self.r_dirty[:n] |= self.calc_reach().descendants(sources, n)
+
+    # New vertices have no r yet. NaN makes sure update_r()
+    # reports them as changed whatever they come out to
+    def mark_new_r(self, slots: np.ndarray) -> None:
+        self.r[slots] = np.nan
+        self.r_dirty[slots] = True
+
+    # Recomputes r for the dirty vertices only. With cone, a mask from
+    # ancestor_cone(), only for the dirty vertices in it, and the rest
+    # stay dirty. Returns the indices whose r actually changed. Without
+    # cone that's since the last update_r() without one, so nothing
+    # worked out for a cone in between goes unreported
+    def update_r(self, cone: np.ndarray=None) -> np.ndarray:
+        n = self.n
+        if "topological" == self.engine:
+            changed = self.propagate_r(cone)
+        else:
+            changed = self.update_closure_r(cone)
 
-    def delete_vertices(self, refs: list[QGraphicsRectItem]) -> None:
-        for ref in refs:
-            self.delete_vertex(ref)
+        if cone is not None:
+            self.r_unreported[changed] = True
+            return changed
+        changed = np.union1d(changed, np.flatnonzero(self.r_unreported[:n]))
+        self.r_unreported[:n] = False
+        return changed
 
-    def update_AND_weights(self) -> None:
+    # update_r() for the closure engine
+    def update_closure_r(self, cone: np.ndarray=None) -> np.ndarray:
         n = self.n
-        Ac_full = self.calc_Ac_full()
-
-        AND_indices = compress(range(n), self.is_AND[:n])
-        comp_bools = np.logical_not(self.is_AND[:n])
-        comp_indices = compress(range(n), comp_bools)
-        for i in AND_indices:
-            # If an AND gate isn't connected to any components,
-            # we calculate its risk separately and mark it as 0
-            # for now
-            if not np.any(Ac_full[i, comp_bools]):
-                self.r0[i] = 0
+        # AND gate weights depend on everything feeding them, so
+        # any of them that moved drag their own cone in as well
+        old_r0 = self.r0[:n].copy()
+        self.r0[:n] = self.calc_AND_weights(self.r0[:n], cone)
+        self.mark_r_dirty(np.flatnonzero(self.r0[:n] != old_r0))
+
+        dirty = self.r_dirty[:n] if cone is None else self.r_dirty[:n] & cone
+        rows = np.flatnonzero(dirty)
+        self.r_dirty[rows] = False
+        if not len(rows):
+            return rows
+
+        # Every vertex also fails on its own, which is the identity
+        # term in (I + Ac_full). We OR it in rather than building I
+        new_r = self.vec_or_vec(self.r0[rows], self.mat_or_vec(self.calc_Ac_full()[rows, :], self.r0[:n]))
+        changed = new_r != self.r[rows]
+        self.r[rows] = new_r
+
+        return rows[changed]
+
+    # Mask of the given slots and everything upstream of them, which is
+    # all their risks depend on. For the closure engine that's whatever
+    # Ac_full connects to them, taken again from each vertex found until
+    # nothing new turns up, so that gate weights in it only depend on
+    # the rest of it even where the closure isn't quite transitive
+    def ancestor_cone(self, slots: np.ndarray) -> np.ndarray:
+        n = self.n
+        cone = np.zeros(n, bool)
+        frontier = np.atleast_1d(slots)
+        cone[frontier] = True
+        while len(frontier):
+            if "topological" == self.engine:
+                found = [ a for v in frontier.tolist() for a in self.pred[v] ]
+                found = np.unique(np.array(found, np.intp))
+                found = found[~cone[found]]
+            else:
+                found = np.flatnonzero(np.any(self.calc_Ac_full()[frontier] != 0, axis=0) & ~cone)
+            cone[found] = True
+            frontier = found
+        return cone
+
+    # Combines the failure probabilities of v's inputs as independent
+    # events: OR with its direct risk r0_v for a component, AND for an
+    # AND gate and at least k for a voting gate. The inputs are either
+    # floats, or arrays of B columns to do them all at once
+    def combine_inputs(self, v: int, inputs: list, r0_v: np.ndarray) -> np.ndarray:
+        if self.is_AND[v]:
+            if not inputs:
+                return 0
+            if self.vote_k[v] > 0:
+                return self.prob_at_least(np.array(inputs), self.vote_k[v])
+            return prod(inputs)
+
+        survive = prod(1 - p for p in inputs)
+        return 1 - (1 - r0_v) * survive
+
+    # Risk of v under the topological engine, from the direct risks r0
+    # and the risks r of its predecessors, which have to be final. Each
+    # input fails with its predecessor's risk times its edge weight.
+    # This is exact when no two inputs share anything upstream. r0 and
+    # r are either sequences of floats, or (n, B) arrays. A self-loop
+    # can't fail v by itself, so it's left out
+    def propagate_vertex(self, v: int, r0: np.ndarray, r: np.ndarray) -> np.ndarray:
+        inputs = [ w * r[a] for a, w in self.pred[v].items() if a != v ]
+        return self.combine_inputs(v, inputs, r0[v])
+
+    # [i, j] = P(a failure of member j of cycle c reaches member i)
+    # along paths inside the cycle, with the diagonal left at 0. Paths
+    # don't go through gates, which need more than one input to fail.
+    # This is the least fixed point of Y = W (I + Y) in the OR algebra,
+    # W holding the edge weights inside the cycle, found by iterating
+    # from Y = 0. It depends on nothing but the edges, unlike a closure
+    # built edge by edge, and is cached until the cycle changes
+    def calc_cycle_reach(self, c: int) -> np.ndarray:
+        Y = self.cycle_reach.get(c)
+        if Y is not None:
+            return Y
+
+        members = self.cycles[c].tolist()
+        local = { v : i for i, v in enumerate(members) }
+        W = np.zeros((len(members), len(members)), np.double)
+        for i, v in enumerate(members):
+            if self.is_AND[v]:
+                continue
+            for a, w in self.pred[v].items():
+                j = local.get(a)
+                if j is not None and j != i:
+                    W[i, j] = w
+
+        I = np.identity(len(members))
+        Y = W.copy()
+        for _ in range(self.MAX_FIXED_POINT_ITERATIONS):
+            new_Y = self.mat_or_mat(W, I + Y)
+            np.fill_diagonal(new_Y, 0)
+            done = np.max(np.abs(new_Y - Y)) <= self.FIXED_POINT_TOL
+            Y = new_Y
+            if done:
+                break
+
+        self.cycle_reach[c] = Y
+        return Y
+
+    # Risks of the members of cycle c, in the order of self.cycles[c],
+    # given the final risks r of everything upstream of it. Each member
+    # starts from its own failure ORed with its inputs from outside the
+    # cycle, and those spread through calc_cycle_reach(). Gates on the
+    # cycle are sources whose weight depends on the risks of their
+    # inputs, so they're recomputed until they settle. They only ever
+    # grow, which makes that converge. r0 and r are as in propagate_vertex()
+    def solve_cycle(self, c: int, r0: np.ndarray, r: np.ndarray) -> np.ndarray:
+        members = self.cycles[c].tolist()
+        local = { v : i for i, v in enumerate(members) }
+        Y = self.calc_cycle_reach(c)
+
+        # Rows are assigned one by one so that gates without
+        # inputs, which come out as a plain 0, broadcast
+        src = np.zeros((len(members),) + np.shape(r0[members[0]]), np.double)
+        gates = []
+        for i, v in enumerate(members):
+            if self.is_AND[v]:
+                gates.append(i)
+            else:
+                src[i] = self.combine_inputs(v, [ w * r[a] for a, w in self.pred[v].items() if a not in local ], r0[v])
+
+        new_src = src[gates]
+        for _ in range(self.MAX_FIXED_POINT_ITERATIONS):
+            x = self.vec_or_vec(src, self.mat_or_vec(Y, src))
+            if not gates:
+                break
+
+            for k, i in enumerate(gates):
+                v = members[i]
+                new_src[k] = self.combine_inputs(v, [
+                    w * (x[local[a]] if a in local else r[a]) for a, w in self.pred[v].items() if a != v
+                ], 0)
+            done = np.all(np.abs(new_src - src[gates]) <= self.FIXED_POINT_TOL)
+            src[gates] = new_src
+            if done:
+                break
+
+        return x
+
+    # update_r() for the topological engine. Dirty vertices are taken in
+    # topological order off a heap, and a vertex whose risk changes
+    # pushes its successors, so each vertex is visited at most once and
+    # only as far as the change actually spreads. A cycle is solved
+    # whole the first time one of its members comes up. With cone, the
+    # change stops at its edge, leaving whatever it would've reached
+    # outside dirty for later
+    def propagate_r(self, cone: np.ndarray=None) -> np.ndarray:
+        n = self.n
+        if self.sccs_dirty:
+            self.condense()
+        pos = self.topo_pos
+        dirty = self.r_dirty[:n] & self.active[:n]
+        if cone is not None:
+            dirty &= cone
+        dirty = np.flatnonzero(dirty)
+        self.r_dirty[dirty] = False
+
+        r0 = self.r0[:n].tolist()
+        r = self.r[:n].tolist()
+        heap = list(zip(pos[dirty].tolist(), dirty.tolist()))
+        heapq.heapify(heap)
+        queued = set(dirty.tolist())
+        solved = set()
+        changed = []
+        while heap:
+            _, v = heapq.heappop(heap)
+            c = int(self.scc_of[v])
+            if c < 0:
+                updates = [(v, float(self.propagate_vertex(v, r0, r)))]
+            elif c in solved:
+                continue
+            else:
+                solved.add(c)
+                updates = zip(self.cycles[c].tolist(), self.solve_cycle(c, r0, r).tolist())
+
+            for v, new_r in updates:
+                # NaN marks a new vertex, which always counts as changed
+                if new_r == r[v]:
+                    continue
+                r[v] = new_r
+                changed.append(v)
+                for b in self.succ[v]:
+                    if b in queued:
+                        continue
+                    if cone is not None and not cone[b]:
+                        self.r_dirty[b] = True
+                        continue
+                    queued.add(b)
+                    heapq.heappush(heap, (int(pos[b]), b))
+
+        changed = np.sort(np.array(changed, np.intp))
+        self.r[changed] = [ r[v] for v in changed.tolist() ]
+        return changed
+
+    # Note: self.r values for AND gates are garbage values,
+    # except under the topological engine, where they're the
+    # probability of the gate failing
+    def calc_r(self) -> np.ndarray:
+        self.update_r()
+        return self.r[:self.n]
+
+    # calc_r() for B sets of direct risks at once. r0 is (n, B), one set
+    # per column, and only the given rows of r are worked out. The
+    # graph's own r and r0 are left alone
+    def calc_r_batch(self, r0: np.ndarray, rows: np.ndarray=None) -> np.ndarray:
+        n = self.n
+        rows = np.arange(n) if rows is None else np.atleast_1d(rows)
+        if "topological" == self.engine:
+            if self.sccs_dirty:
+                self.condense()
+            r0 = np.asarray(r0, np.double)
+            r = np.zeros_like(r0)
+            active = np.flatnonzero(self.active[:n])
+            solved = set()
+            for v in active[np.argsort(self.topo_pos[active], kind="stable")].tolist():
+                c = int(self.scc_of[v])
+                if c < 0:
+                    r[v] = self.propagate_vertex(v, r0, r)
+                elif c not in solved:
+                    solved.add(c)
+                    r[self.cycles[c]] = self.solve_cycle(c, r0, r)
+            return r[rows]
+
+        r0 = self.calc_AND_weights(r0)
+        return self.vec_or_vec(r0[rows], self.mat_or_vec(self.calc_Ac_full()[rows, :], r0))
+
+    # Risks for a fleet of B copies of this graph, each with its own
+    # direct risks and optionally its own edge weights. r0 is (B, n)
+    # and weights is (B, n, n), laid out like A, so [k, b, a] is the
+    # weight of a -> b in copy k. Only the edges the graph has are read
+    # from it. Returns the (B, len(rows)) risks, every row by default.
+    # Copies are done chunk at a time, as the columns of one (n, chunk)
+    # matrix, so temporaries stay within n x chunk whatever B is, and
+    # weights can be a memmap much larger than memory.
+    # Without weights this is calc_r_batch(), whatever the engine.
+    # Weights are only taken by the topological engine, as a sweep of
+    # propagate_vertex() with each copy's weights, which needs the graph
+    # to be acyclic. The closure engine would need a closure per copy,
+    # and its risks combine shared paths differently from the sweep, so
+    # it raises rather than quietly give the other engine's answer
+    def calc_r_fleet(self, r0: np.ndarray, weights: np.ndarray=None,
+                     rows: np.ndarray=None, chunk: int=BATCH_COLUMNS) -> np.ndarray:
+        n = self.n
+        r0 = np.asarray(r0, np.double)
+        if r0.ndim != 2 or r0.shape[1] != n:
+            raise ValueError(f"Expected r0 of shape (B, {n}), got {r0.shape}")
+        if weights is not None and weights.shape != (len(r0), n, n):
+            raise ValueError(f"Expected weights of shape ({len(r0)}, {n}, {n}), got {weights.shape}")
+        rows = np.arange(n) if rows is None else np.atleast_1d(rows)
+
+        order = None
+        if weights is not None:
+            if "topological" != self.engine:
+                raise ValueError("Per-copy edge weights need the topological engine, see set_engine()")
+            order = self.topological_order()
+            if order is None:
+                raise ValueError("Per-copy edge weights need an acyclic graph")
+            pred = { v : np.fromiter(self.pred[v].keys(), np.intp, len(self.pred[v])) for v in order }
+
+        r = np.empty((len(r0), len(rows)), np.double)
+        for start in range(0, len(r0), chunk):
+            r0_chunk = r0[start:start + chunk].T
+            if weights is None:
+                r[start:start + chunk] = self.calc_r_batch(r0_chunk, rows).T
                 continue
 
-            self.r0[i] = 1
-            for j in comp_indices:
-                # (j -> i)
-                path_weight = Ac_full[i, j]
-                # Include vertex weight if j is a component
-                if not self.is_AND[j]:
-                    path_weight *= self.r0[j]
-                if path_weight:
-                    self.r0[i] *= path_weight
-
-        for i, j in filter(lambda t: t[0] != t[1], product(AND_indices, repeat=2)):
-            # Only consider risk from AND gates that are
-            # connected to a component. AND gates that
-            # have no connected components will have an r0
-            # value of 0
-            path_weight = self.r0[j] * Ac_full[i, j]
-            if path_weight:
-                self.r0[i] *= path_weight
-
-    # Note: self.r values for AND gates are garbage values
-    def calc_r(self) -> None:
+            W = weights[start:start + chunk]
+            r_chunk = np.zeros_like(r0_chunk)
+            for v in order:
+                inputs = np.asarray(W[:, v, pred[v]], np.double).T * r_chunk[pred[v]]
+                r_chunk[v] = self.combine_inputs(v, list(inputs), r0_chunk[v])
+            r[start:start + chunk] = r_chunk[rows].T
+
+        return r
+
+    # Importance of every component to the risk of target, as
+    # { key : (Birnbaum, Fussell-Vesely, RAW, RRW) }. Each component
+    # is set to certain failure and to no failure, and all of those
+    # r0 vectors go through calc_r_batch() together, a chunk of
+    # BATCH_COLUMNS components at a time
+    def calc_importance(self, target: Hashable) -> dict:
         n = self.n
-        self.update_AND_weights()
-        self.r = self.mat_or_vec(self.I[:n, :n] + self.calc_Ac_full(), self.r0[:n])
-        return self.r
+        t = self.refi[target]
+        comps = np.flatnonzero(self.active[:n] & ~self.is_AND[:n])
+        base = self.calc_r_batch(self.r0[:n, None], t)[0, 0]
+
+        r_fail = np.empty(len(comps), np.double)
+        r_ok = np.empty(len(comps), np.double)
+        for start in range(0, len(comps), self.BATCH_COLUMNS):
+            chunk = comps[start:start + self.BATCH_COLUMNS]
+            cols = np.arange(len(chunk))
+            r0 = np.repeat(self.r0[:n, None], 2 * len(chunk), axis=1)
+            r0[chunk, cols] = 1
+            r0[chunk, cols + len(chunk)] = 0
+            r = self.calc_r_batch(r0, t)[0]
+            r_fail[start:start + len(chunk)] = r[:len(chunk)]
+            r_ok[start:start + len(chunk)] = r[len(chunk):]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            birnbaum = r_fail - r_ok
+            fussell_vesely = (base - r_ok) / base
+            raw = r_fail / base
+            rrw = base / r_ok
+
+        return {
+            self.iref[i] : m for i, m in zip(comps.tolist(), zip(
+                birnbaum.tolist(), fussell_vesely.tolist(), raw.tolist(), rrw.tolist()
+            ))
+        }
+
+    # Writes a snapshot of the graph to path, see graph/snapshot.py
+    def save(self, path: str, keys: list[Hashable]=None) -> str:
+        from graph import snapshot
+        return snapshot.save(self, path, keys)
+
+    # Opens a snapshot written by save(). With mmap the closure
+    # matrices are mapped from the file rather than read
+    @classmethod
+    def load(cls, path: str, mmap: bool=True, verify: bool=False) -> "DepGraph":
+        from graph import snapshot
+        return snapshot.load(path, mmap, verify)
+
+    # Checks the incremental closure against a replay of the edges
+    # every check_every edge changes, see graph/shadow.py. Returns the
+    # checker, whose report() has the divergence found so far. The
+    # closure is rebuilt here, so that the replay can start from the
+    # edges the graph already has
+    def enable_shadow(self, check_every: int=100, resync_every: int=0,
+                      tolerance: float=1e-9, resync: bool=False) -> "ShadowChecker":
+        from graph.shadow import ShadowChecker
+        self.shadow = ShadowChecker(self, check_every, resync_every, tolerance, resync)
+        # Only a closure that's kept up as the graph changes has
+        # anything to check
+        if "closure" == self.engine:
+            self.build_closure()
+        return self.shadow
+
+    def disable_shadow(self) -> None:
+        self.shadow = None
+
+    # Called after every incremental change to the closure, with the
+    # edge that changed and its new weight
+    def after_mutation(self, edge: tuple[int], weight: float) -> None:
+        if self.shadow is not None:
+            self.shadow.after_mutation(edge, weight)
+
+    # Exact version of calc_r(), through a BDD of the whole graph.
+    # Shared components are only counted once, and AND gates get
+    # real probabilities too. The BDD is kept between calls and only
+    # rebuilt when the structure of the graph changes
+    def calc_r_exact(self) -> np.ndarray:
+        from graph.bdd import BDDEvaluator
+        if self.bdd_evaluator is None:
+            self.bdd_evaluator = BDDEvaluator(self)
+        return self.bdd_evaluator.calc_r()
     
-    def get_edge_weight_A(self, edge: tuple[QGraphicsRectItem]) -> float:
-        return self.A_tc[self.refi[edge[1]], self.refi[edge[0]]]
+    def get_edge_weight_A(self, edge: tuple[Hashable]) -> float:
+        return self.get_edge_weight_i((self.refi[edge[0]], self.refi[edge[1]]))
 
-    def get_edge_weight_Ac(self, edge: tuple[QGraphicsRectItem]) -> float:
+    def get_edge_weight_Ac(self, edge: tuple[Hashable]) -> float:
+        if not self.closure_built:
+            self.build_closure()
         return self.A_tc[self.refi[edge[1]], self.refi[edge[0]]]
 
-    def get_vertex_weight(self, ref: QGraphicsRectItem) -> float:
+    def get_vertex_weight(self, ref: Hashable) -> float:
         return self.r0[self.refi[ref]]
     
-    def get_total_risk(self, ref: QGraphicsRectItem) -> float:
-        return self.r[self.refi[ref]]
+    # Only works out what ref depends on, so asking about a few top
+    # events doesn't recompute the whole graph. Risks stay in r until
+    # something upstream of them changes
+    def get_total_risk(self, ref: Hashable) -> float:
+        return self.get_total_risks([ref])[ref]
+
+    def get_total_risks(self, refs: list[Hashable]) -> dict:
+        n = self.n
+        slots = self.indices_of(refs)
+        if np.any(self.r_dirty[:n]):
+            cone = self.ancestor_cone(slots)
+            if np.any(self.r_dirty[:n] & cone):
+                self.update_r(cone)
+        return { ref : self.r[i] for ref, i in zip(refs, slots.tolist()) }
     
     def get_r_dict(self) -> dict:
         n = self.n
         self.calc_r()
-        return { self.iref[i] : risk for i, risk in compress(enumerate(self.r), np.logical_not(self.is_AND[:n])) }
+        return { self.iref[i] : risk for i, risk in compress(enumerate(self.r), self.active[:n] & ~self.is_AND[:n]) }
+
+    # Same as get_r_dict(), but only for components whose
+    # risk changed since the last time r was calculated
+    def get_r_changes(self) -> dict:
+        changed = self.update_r()
+        changed = changed[~self.is_AND[changed]]
+        return { self.iref[i] : self.r[i] for i in changed.tolist() }
 
 if __name__ == "__main__":
     ########### Testing code ################
+    # Run from the repository root with python -m graph.dep_graph
     # Test 1
     def test_suite_1():
         dg = DepGraph()
@@ -483,7 +1890,7 @@ if __name__ == "__main__":
         dg.add_edge(('b', 'AND'), 1)
         n = dg.n
 
-        print(dg.calc_Ac_full()[:n, :n] + dg.I[:n, :n])
+        print(dg.calc_Ac_full()[:n, :n] + np.identity(n))
 
         print("AND calc_r:")
         print(dg.calc_r())
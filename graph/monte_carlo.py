@@ -0,0 +1,302 @@
+# @file monte_carlo.py
+# @author Evan Brody
+# @brief Monte Carlo failure simulation for dependency graphs
+
+import os
+import numpy as np
+from collections.abc import Hashable
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+from graph.dep_graph import DepGraph
+
+# calc_r() ORs every path as if they were independent, which
+# overcounts whenever paths reconverge. Here every component failure
+# and every edge transmission is drawn per trial, and failures are
+# pushed through the graph exactly, so the estimates converge to the
+# true probabilities of the model. Trials are stored as bits, 64 to a
+# word, so one row of words holds a vertex's state in every trial
+
+# Bits are unpacked in blocks of this many vertices when weights
+# have to be applied to them
+UNPACK_ROWS = 256
+
+# Number of set bits in each word
+def popcount(words: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    bits = np.unpackbits(words.view(np.uint8), axis=-1)
+    return bits.reshape(words.shape + (64,)).sum(axis=-1, dtype=np.uint64)
+
+def pack_bits(bits: np.ndarray) -> np.ndarray:
+    return np.packbits(bits, axis=-1, bitorder="little").view(np.uint64)
+
+def unpack_bits(words: np.ndarray) -> np.ndarray:
+    return np.unpackbits(words.view(np.uint8), axis=-1, bitorder="little").view(bool)
+
+# words * 64 independent draws that are each 1 with probability p
+def sample_bits(rng: np.random.Generator, p: float, words: int) -> np.ndarray:
+    if p <= 0:
+        return np.zeros(words, np.uint64)
+    if p >= 1:
+        return np.full(words, ~np.uint64(0))
+    return pack_bits(rng.random(64 * words) < p)
+
+# A snapshot of the parts of a DepGraph the simulation needs.
+# Only numpy arrays and plain containers, so it's cheap to
+# send to worker processes
+class FailureModel:
+    def __init__(self, dg: DepGraph) -> None:
+        slots = np.flatnonzero(dg.active[:dg.n])
+        index = np.full(dg.n, -1, np.intp)
+        index[slots] = np.arange(len(slots))
+
+        self.n = len(slots)
+        self.keys = dg.keys_of(slots)
+        self.is_AND = dg.is_AND[slots].copy()
+        self.vote_k = dg.vote_k[slots].copy()
+        # AND gates have no failure of their own. Their r0 in
+        # the DepGraph is an analytic estimate we don't want
+        self.r0 = np.where(self.is_AND, 0, dg.r0[slots])
+
+        # Edges grouped by the vertex they point to
+        self.pred = []
+        self.pred_weights = []
+        for b in slots.tolist():
+            in_edges = dg.pred[b]
+            self.pred.append(index[np.fromiter(in_edges.keys(), np.intp, len(in_edges))])
+            self.pred_weights.append(np.fromiter(in_edges.values(), np.double, len(in_edges)))
+        self.is_sink = np.array([ 0 == len(dg.succ[a]) for a in slots.tolist() ], bool)
+
+        # None if the graph has a cycle
+        order = dg.topological_order()
+        self.order = None if order is None else index[order]
+
+    def indices_of(self, keys: list[Hashable]) -> np.ndarray:
+        key_index = { key : i for i, key in enumerate(self.keys.tolist()) }
+        return np.fromiter((key_index[key] for key in keys), np.intp, len(keys))
+
+    # One vertex's state given everything upstream of it
+    def propagate_vertex(self, v: int, fail: np.ndarray, direct: np.ndarray,
+                         transmit: list[np.ndarray]) -> np.ndarray:
+        pred = self.pred[v]
+        if self.vote_k[v] > 0:
+            # at_least[j] has the trials where at least j of the
+            # inputs seen so far failed
+            k = int(self.vote_k[v])
+            at_least = [np.full(fail.shape[1], ~np.uint64(0))] + [np.zeros(fail.shape[1], np.uint64)] * k
+            for fails in (fail[pred] & transmit[v]) if len(pred) else ():
+                for j in range(k, 0, -1):
+                    at_least[j] = at_least[j] | (at_least[j - 1] & fails)
+            return at_least[k]
+
+        if self.is_AND[v]:
+            # An AND gate with no inputs never fails
+            if not len(pred):
+                return np.zeros(fail.shape[1], np.uint64)
+            return np.bitwise_and.reduce(fail[pred] & transmit[v], axis=0)
+
+        if not len(pred):
+            return direct[v]
+        return direct[v] | np.bitwise_or.reduce(fail[pred] & transmit[v], axis=0)
+
+    # Failure bits of every vertex for one chunk of trials
+    def propagate(self, direct: np.ndarray, transmit: list[np.ndarray]) -> np.ndarray:
+        fail = direct.copy()
+        if self.order is not None:
+            for v in self.order.tolist():
+                fail[v] = self.propagate_vertex(v, fail, direct, transmit)
+            return fail
+
+        # Cycles have no order to go in, so sweep until nothing
+        # changes. Failures only ever spread, so this stops at the
+        # least fixed point after at most n sweeps
+        changed = True
+        while changed:
+            changed = False
+            for v in range(self.n):
+                new = self.propagate_vertex(v, fail, direct, transmit)
+                if np.any(new != fail[v]):
+                    fail[v] = new
+                    changed = True
+        return fail
+
+# Runs trials in chunks of chunk_words * 64 and sums up, per vertex
+# and for the system, the weight of the trials where it failed and the
+# square of that weight. Without a bias every weight is 1. With one,
+# component failures are drawn from the biased probabilities q instead
+# of r0 and each trial is weighted by its likelihood ratio
+def run_batch(model: FailureModel, seed: np.random.SeedSequence, words: int,
+              chunk_words: int, targets: np.ndarray, q: np.ndarray=None) -> tuple:
+    rng = np.random.default_rng(seed)
+    n = model.n
+
+    if q is not None:
+        # log of the likelihood ratio for a trial is the sum of these
+        # over the components that failed in it, plus those over the
+        # components that didn't
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_fail = np.where(model.r0 > 0, np.log(model.r0) - np.log(q), 0)
+            log_ok = np.where(q < 1, np.log1p(-model.r0) - np.log1p(-q), 0)
+        log_ok_total = log_ok.sum()
+        log_diff = log_fail - log_ok
+    p_direct = model.r0 if q is None else q
+
+    s1 = np.zeros(n, np.double)
+    s2 = np.zeros(n, np.double)
+    system = np.zeros(2, np.double)
+    for start in range(0, words, chunk_words):
+        cw = min(chunk_words, words - start)
+
+        direct = np.stack([ sample_bits(rng, p, cw) for p in p_direct.tolist() ]) if n else np.zeros((0, cw), np.uint64)
+        transmit = [
+            np.stack([ sample_bits(rng, w, cw) for w in weights.tolist() ]) if len(weights) else None
+            for weights in model.pred_weights
+        ]
+        fail = model.propagate(direct, transmit)
+        system_fail = np.bitwise_or.reduce(fail[targets], axis=0) if len(targets) else np.zeros(cw, np.uint64)
+
+        if q is None:
+            counts = popcount(fail).sum(axis=1, dtype=np.uint64).astype(np.double)
+            s1 += counts
+            s2 += counts
+            system += popcount(system_fail).sum(dtype=np.uint64)
+            continue
+
+        log_w = np.full(64 * cw, log_ok_total)
+        for v in np.flatnonzero(log_diff).tolist():
+            log_w[unpack_bits(direct[v])] += log_diff[v]
+        w = np.exp(log_w)
+        w2 = w * w
+
+        for block in range(0, n, UNPACK_ROWS):
+            bits = unpack_bits(fail[block:block + UNPACK_ROWS])
+            s1[block:block + UNPACK_ROWS] += bits @ w
+            s2[block:block + UNPACK_ROWS] += bits @ w2
+        system_bits = unpack_bits(system_fail)
+        system += (w[system_bits].sum(), w2[system_bits].sum())
+
+    return s1, s2, system[0], system[1]
+
+# Estimates and their confidence intervals. p, lo and hi are
+# indexed like keys, the system ones are for any target failing
+class MonteCarloResult:
+    def __init__(self, keys: np.ndarray, trials: int, p: np.ndarray, lo: np.ndarray,
+                 hi: np.ndarray, system: tuple[float]) -> None:
+        self.keys = keys
+        self.trials = trials
+        self.p = p
+        self.lo = lo
+        self.hi = hi
+        self.system_p, self.system_lo, self.system_hi = system
+
+    # { key : (p, lo, hi) }
+    def as_dict(self) -> dict:
+        return { key : t for key, t in zip(self.keys.tolist(), zip(self.p.tolist(), self.lo.tolist(), self.hi.tolist())) }
+
+class MonteCarlo:
+    # Trials handed to a worker at once
+    DEFAULT_BATCH_SIZE = 1 << 22
+    # Trials simulated at once inside a batch, which bounds memory
+    # to about (n + edges) * CHUNK_SIZE / 8 bytes
+    CHUNK_SIZE = 1 << 16
+    DEFAULT_CONFIDENCE = 0.95
+    # Biased probabilities are capped here so the
+    # likelihood ratios of the non-failures stay tame
+    MAX_BIASED_P = 0.5
+
+    def __init__(self, dg: DepGraph, batch_size: int=DEFAULT_BATCH_SIZE,
+                 workers: int=None, seed: int=None) -> None:
+        self.model = FailureModel(dg)
+        self.batch_size = batch_size
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.seed_seq = np.random.SeedSequence(seed)
+
+    # Simulates at least trials trials, rounded up to a whole number
+    # of words. targets are the keys that count as the system failing,
+    # by default every vertex nothing depends on. With a bias, each
+    # component fails bias times as often as it should, capped at
+    # MAX_BIASED_P, and the trials are reweighted to make up for it.
+    # Use that when the system failure probability is too small for
+    # plain sampling to ever see it
+    def run(self, trials: int, targets: list[Hashable]=None, bias: float=None,
+            confidence: float=DEFAULT_CONFIDENCE) -> MonteCarloResult:
+        model = self.model
+        targets = np.flatnonzero(model.is_sink) if targets is None else model.indices_of(targets)
+
+        q = None
+        if bias is not None:
+            q = np.where(model.r0 < self.MAX_BIASED_P,
+                         np.minimum(model.r0 * bias, self.MAX_BIASED_P), model.r0)
+
+        words = -(-trials // 64)
+        batch_words = max(1, self.batch_size // 64)
+        chunk_words = max(1, self.CHUNK_SIZE // 64)
+        batches = [ min(batch_words, words - start) for start in range(0, words, batch_words) ]
+        # Independent streams, one per batch, so the results don't
+        # depend on how the batches are spread over the workers
+        seeds = self.seed_seq.spawn(len(batches))
+
+        args = (
+            [model] * len(batches), seeds, batches, [chunk_words] * len(batches),
+            [targets] * len(batches), [q] * len(batches)
+        )
+        if self.workers > 1 and len(batches) > 1:
+            with ProcessPoolExecutor(min(self.workers, len(batches))) as pool:
+                results = list(pool.map(run_batch, *args))
+        else:
+            results = list(map(run_batch, *args))
+
+        trials = 64 * words
+        s1 = sum(r[0] for r in results)
+        s2 = sum(r[1] for r in results)
+        system_s1 = sum(r[2] for r in results)
+        system_s2 = sum(r[3] for r in results)
+
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        if q is None:
+            interval = self.wilson_interval
+        else:
+            interval = self.weighted_interval
+        p, lo, hi = interval(s1, s2, trials, z)
+        system = tuple(float(x) for x in interval(system_s1, system_s2, trials, z))
+
+        return MonteCarloResult(model.keys, trials, p, lo, hi, system)
+
+    # Wilson score interval, which behaves even when
+    # there are few or no failures
+    @staticmethod
+    def wilson_interval(s1: np.ndarray, s2: np.ndarray, trials: int, z: float) -> tuple[np.ndarray]:
+        p = np.asarray(s1, np.double) / trials
+        denom = 1 + z * z / trials
+        center = (p + z * z / (2 * trials)) / denom
+        half = z * np.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denom
+        return p, np.maximum(center - half, 0), np.minimum(center + half, 1)
+
+    # Normal interval from the sample variance of the weighted indicators
+    @staticmethod
+    def weighted_interval(s1: np.ndarray, s2: np.ndarray, trials: int, z: float) -> tuple[np.ndarray]:
+        p = np.asarray(s1, np.double) / trials
+        var = np.maximum(np.asarray(s2, np.double) / trials - p * p, 0) / trials
+        half = z * np.sqrt(var)
+        return p, np.maximum(p - half, 0), np.minimum(p + half, 1)
+
+if __name__ == "__main__":
+    ########### Testing code ################
+    # Run from the repository root with python -m graph.monte_carlo
+    # A diamond reconverges at d, so calc_r() overestimates it
+    dg = DepGraph()
+    dg.add_vertices(['a', 'b', 'c', 'd'], [0.25] * 4)
+    dg.add_edges([('a', 'b'), ('a', 'c'), ('b', 'd'), ('c', 'd')], [0.5] * 4)
+    print("calc_r:", dict(zip(dg.keys_of(range(dg.n)), dg.calc_r())))
+
+    res = MonteCarlo(dg, seed=0).run(1 << 22)
+    print("Monte Carlo:", res.as_dict())
+    print("System:", res.system_p, res.system_lo, res.system_hi)
+
+    # A rare event: both inputs of an AND gate failing, p = 1e-8
+    dg = DepGraph()
+    dg.add_vertices(['x', 'y', 'top'], [1e-4, 1e-4, 0])
+    dg.add_AND_gate('AND')
+    dg.add_edges([('x', 'AND'), ('y', 'AND'), ('AND', 'top')])
+    res = MonteCarlo(dg, seed=0).run(1 << 20, targets=['top'], bias=2000)
+    print("Importance sampling:", res.system_p, res.system_lo, res.system_hi)
@@ -0,0 +1,76 @@
+# @file or_algebra.py
+# @author Evan Brody
+# @brief Probability-OR algebra for dependency analysis, done in log-complement space
+
+import numpy as np
+
+# The OR of independent events with probabilities p_k fails to happen
+# with probability prod(1 - p_k), so we keep everything as
+# log(1 - p) = log1p(-p) and turn products into sums. This also
+# stays accurate for probabilities close to 1, where 1 - p
+# would otherwise lose most of its digits.
+
+# Rows of a matrix processed at once, which bounds the size of
+# every temporary to BLOCK_ROWS x n
+BLOCK_ROWS = 256
+
+# log(1 - p), -inf for p = 1
+def log_cmp(p: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore"):
+        return np.log1p(-np.asarray(p, np.double))
+
+# Inverse of log_cmp(). Accurate for results near 0 and near 1
+def prob_from_log_cmp(log_q: np.ndarray) -> np.ndarray:
+    return -np.expm1(log_q)
+
+# P(a U b) for independent a, b
+def vec_or_vec(v1: np.ndarray, v2: np.ndarray) -> np.ndarray:
+    return prob_from_log_cmp(log_cmp(v1) + log_cmp(v2))
+
+# [i, ...] = log P(NOT OR_j (a[i, j] AND v[j, ...]))
+# v is either a vector of n probabilities or an (n, B) matrix holding
+# B of them as columns, in which case all B are evaluated together.
+# Entries of a equal to 1 are the common case (weight-1 paths), and
+# for those log(1 - a v) = log(1 - v), so they reduce to one matmul.
+# log(1 - a v) doesn't split any further for fractional entries, so
+# those take a log1p each, one column of v at a time. Multiplying
+# out 1 - a v instead would round away anything below ~1e-16
+def mat_or_vec_log(a: np.ndarray, v: np.ndarray, block_rows: int=BLOCK_ROWS) -> np.ndarray:
+    v = np.asarray(v, np.double)
+    is_vec = 1 == v.ndim
+    if is_vec:
+        v = v[:, None]
+
+    # Certain failures would give 0 * -inf = nan in the matmul,
+    # so they're counted separately and forced to -inf afterwards
+    certain = (v >= 1).astype(np.double)
+    log_q_v = log_cmp(np.where(v >= 1, 0, v))
+
+    res = np.empty((a.shape[0], v.shape[1]), np.double)
+    for start in range(0, a.shape[0], block_rows):
+        block = a[start:start + block_rows]
+
+        is_one = 1 == block
+        ones = is_one.astype(np.double)
+        res_block = ones @ log_q_v
+        res_block[(ones @ certain) > 0] = -np.inf
+
+        # The weight-1 entries are already in, and this zeroes them
+        frac = block - ones
+        if np.any(frac):
+            with np.errstate(divide="ignore"):
+                for k in range(v.shape[1]):
+                    res_block[:, k] += np.log1p(-frac * v[:, k]).sum(axis=1)
+
+        res[start:start + block_rows] = res_block
+
+    return res[:, 0] if is_vec else res
+
+# [i, ...] = P(OR_j (a[i, j] AND v[j, ...]))
+def mat_or_vec(a: np.ndarray, v: np.ndarray, block_rows: int=BLOCK_ROWS) -> np.ndarray:
+    return prob_from_log_cmp(mat_or_vec_log(a, v, block_rows))
+
+# [i, j] = P(OR_k (a[i, k] AND b[k, j]))
+# Each column of b is just another vector for mat_or_vec()
+def mat_or_mat(a: np.ndarray, b: np.ndarray, block_rows: int=BLOCK_ROWS) -> np.ndarray:
+    return mat_or_vec(a, np.asarray(b, np.double), block_rows)
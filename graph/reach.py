@@ -0,0 +1,141 @@
+# @file reach.py
+# @author Evan Brody
+# @brief Reachability between vertices as packed bit rows
+
+import numpy as np
+
+# Whether one vertex reaches another only takes a bit, so where the
+# closure engine doesn't need the probabilities, it asks this instead
+# of scanning float64 columns of Ac_full. Row a holds a bit for every
+# b that a reaches, WORD_BITS to a word, which is n^2 / 8 bytes for n
+# vertices. A new edge a -> b makes everything that reaches a, and a
+# itself, reach b and whatever b reaches, which is one OR of b's row
+# into each of their rows, a word at a time. Deleting an edge can't
+# be undone that way, so after one the index only says what may be
+# reached, until it's rebuilt from the adjacency, see rebuild().
+# Unlike the closure, this is plain reachability along edges with
+# nonzero weight, gates or not
+
+class ReachIndex:
+    WORD_BITS = 64
+
+    def __init__(self, capacity: int=0) -> None:
+        self.bits = np.zeros((capacity, self.words(capacity)), np.uint64)
+
+    @classmethod
+    def words(cls, n: int) -> int:
+        return (n + cls.WORD_BITS - 1) // cls.WORD_BITS
+
+    # Word of b in a row, and the mask of b's bit in that word
+    @classmethod
+    def locate(cls, b: int) -> tuple:
+        return b // cls.WORD_BITS, np.uint64(1) << np.uint64(b % cls.WORD_BITS)
+
+    # Bits as a mask of n bools, word by word from the lowest bit
+    @staticmethod
+    def unpack(row: np.ndarray, n: int) -> np.ndarray:
+        as_bytes = np.ascontiguousarray(row, "<u8").view(np.uint8)
+        return np.unpackbits(as_bytes, bitorder="little")[:n].astype(bool)
+
+    # Rows of an (m, n) mask as packed bits
+    @classmethod
+    def pack(cls, mask: np.ndarray) -> np.ndarray:
+        m, n = mask.shape
+        as_bytes = np.zeros((m, cls.words(n) * cls.WORD_BITS // 8), np.uint8)
+        as_bytes[:, :(n + 7) // 8] = np.packbits(mask, axis=1, bitorder="little")
+        return as_bytes.view("<u8").astype(np.uint64)
+
+    # Only the first n rows and their words are copied when we grow
+    def reserve(self, capacity: int, n: int) -> None:
+        bits = np.zeros((capacity, self.words(capacity)), np.uint64)
+        words = self.words(n)
+        bits[:n, :words] = self.bits[:n, :words]
+        self.bits = bits
+
+    def reaches(self, a: int, b: int) -> bool:
+        word, bit = self.locate(b)
+        return bool(self.bits[a, word] & bit)
+
+    # Mask of the n slots that any of the given ones reaches
+    def descendants(self, slots: np.ndarray, n: int) -> np.ndarray:
+        slots = np.atleast_1d(slots)
+        row = np.bitwise_or.reduce(self.bits[slots, :self.words(n)], axis=0)
+        return self.unpack(row, n)
+
+    # Mask of the n slots that reach b
+    def ancestors(self, b: int, n: int) -> np.ndarray:
+        word, bit = self.locate(b)
+        return 0 != (self.bits[:n, word] & bit)
+
+    # a -> b was added to a graph with n slots
+    def add_edge(self, a: int, b: int, n: int) -> None:
+        word, bit = self.locate(b)
+        if self.bits[a, word] & bit:
+            return
+
+        words = self.words(n)
+        row = self.bits[b, :words].copy()
+        row[word] |= bit
+        sources = self.ancestors(a, n)
+        sources[a] = True
+        self.bits[np.flatnonzero(sources), :words] |= row
+
+    # [a, b] says whether a reaches b, for the first n slots
+    def include(self, mask: np.ndarray) -> None:
+        n = len(mask)
+        self.bits[:n, :self.words(n)] |= self.pack(mask)
+
+    # Makes everything that reaches a slot reach whatever it does,
+    # one slot at a time, after include() added pairs on their own
+    def close(self, n: int) -> None:
+        words = self.words(n)
+        for k in range(n):
+            sources = np.flatnonzero(self.ancestors(k, n))
+            if len(sources):
+                self.bits[sources, :words] |= self.bits[k, :words]
+
+    # The slots were emptied, so nothing reaches them and they reach
+    # nothing. What used to reach through them still may
+    def clear(self, slots: np.ndarray, n: int) -> None:
+        slots = np.atleast_1d(slots)
+        self.bits[slots] = 0
+        for b in slots.tolist():
+            word, bit = self.locate(b)
+            self.bits[:n, word] &= ~bit
+
+    # Moves the slots in keep to the front, like DepGraph.compact()
+    def compact(self, keep: np.ndarray, n: int) -> None:
+        m = len(keep)
+        rows = np.empty((m, n), bool)
+        for i, a in enumerate(keep.tolist()):
+            rows[i] = self.unpack(self.bits[a], n)
+        self.bits[:n] = 0
+        self.bits[:m, :self.words(m)] = self.pack(rows[:, keep])
+
+    # Everything from scratch. components are the strongly connected
+    # components in topological order, and succ maps each slot to its
+    # out-edges and their weights. Components are done in reverse, so
+    # the rows of everything downstream are finished when they're used
+    def rebuild(self, components: list[list[int]], succ: dict, n: int) -> None:
+        words = self.words(n)
+        self.bits[:n] = 0
+        for component in reversed(components):
+            row = np.zeros(words, np.uint64)
+            members = set(component)
+            # Members of a cycle reach each other and themselves
+            cyclic = len(component) > 1
+            for a in component:
+                for b, weight in succ[a].items():
+                    if not weight:
+                        continue
+                    if b in members:
+                        cyclic = True
+                        continue
+                    row |= self.bits[b, :words]
+                    word, bit = self.locate(b)
+                    row[word] |= bit
+            if cyclic:
+                for a in component:
+                    word, bit = self.locate(a)
+                    row[word] |= bit
+            self.bits[component, :words] = row
@@ -0,0 +1,308 @@
+# @file redundancy.py
+# @author Evan Brody
+# @brief Searches for where redundant components cut a target's risk the most
+
+import os
+import numpy as np
+from collections.abc import Hashable, Callable
+from concurrent.futures import ProcessPoolExecutor
+from graph.dep_graph import DepGraph
+from graph.snapshot import snapshot_arrays, graph_from_arrays
+
+# Making component c redundant means c's own failure needs both it and
+# a spare to fail, while whatever c depends on still fails it as before.
+# As a graph, c's direct risk moves to a new primary unit, and that and
+# the spare feed an AND gate that feeds c, see apply_plan(). For the
+# search it's just c's direct risk going from r0[c] to
+# r0[c] * spare_risk, which is exactly what the structure gives under
+# the topological engine. The closure engine only agrees while the
+# graph has no other AND gates, the ones earlier steps add included,
+# since it has the new gate reach every other one. So under it,
+# optimize() applies each plan it returns to a copy of the graph and
+# reports the risks that really come out, though the search itself
+# still ranks by the simple model.
+# Only the target's ancestor cone matters to its risk, so the search
+# runs on a copy of just that, keyed by position. Every candidate is a
+# column of r0 over the cone. Under the closure engine the target's
+# risk factors over the cone, 1 - prod(1 - Ac[t, j] r0[j]), and a
+# candidate only changes its own factor and those of the AND gates, so
+# only those are worked out again. The topological engine sweeps the
+# cone with calc_r_batch() for the target's row only.
+# Worker processes get the cone as arrays and build their own copy, so
+# graphs keyed by GUI items never need pickling.
+# apply_plan() isn't wired into the GUI, which would have to draw the
+# new vertices. make_keys is there so it can hand out its own items
+
+# Set in each worker process once, so the cone is only pickled once
+worker_graph = None
+
+def init_worker(arrays: dict, engine: str) -> None:
+    global worker_graph
+    worker_graph = graph_from_arrays(list(range(len(arrays["r0"]))), arrays, engine)
+
+# Risks of the target for each (n, B) column of r0, BATCH_COLUMNS at a time
+def target_risks(dg: DepGraph, target: int, r0: np.ndarray) -> np.ndarray:
+    risks = np.empty(r0.shape[1], np.double)
+    for start in range(0, r0.shape[1], dg.BATCH_COLUMNS):
+        risks[start:start + dg.BATCH_COLUMNS] = dg.calc_r_batch(r0[:, start:start + dg.BATCH_COLUMNS], target)[0]
+    return risks
+
+# AND gate weights for each (n, B) column of r0, one row per gate
+def gate_weights(dg: DepGraph, gates: np.ndarray, r0: np.ndarray) -> np.ndarray:
+    weights = np.empty((len(gates), r0.shape[1]), np.double)
+    for start in range(0, r0.shape[1], dg.BATCH_COLUMNS):
+        weights[:, start:start + dg.BATCH_COLUMNS] = dg.calc_AND_weights(r0[:, start:start + dg.BATCH_COLUMNS])[gates]
+    return weights
+
+def worker_target_risks(target: int, r0: np.ndarray) -> np.ndarray:
+    return target_risks(worker_graph, target, r0)
+
+def worker_gate_weights(gates: np.ndarray, r0: np.ndarray) -> np.ndarray:
+    return gate_weights(worker_graph, gates, r0)
+
+# One made-redundant component, with the target's risk after it
+class RedundancyStep:
+    def __init__(self, key: Hashable, spare_risk: float, cost: float, risk: float) -> None:
+        self.key = key
+        self.spare_risk = spare_risk
+        self.cost = cost
+        self.risk = risk
+
+    def as_dict(self) -> dict:
+        return { "key" : self.key, "spare_risk" : self.spare_risk, "cost" : self.cost, "risk" : self.risk }
+
+class RedundancyPlan:
+    def __init__(self, base_risk: float, steps: tuple[RedundancyStep]=()) -> None:
+        self.base_risk = base_risk
+        self.steps = steps
+
+    @property
+    def risk(self) -> float:
+        return self.steps[-1].risk if self.steps else self.base_risk
+
+    @property
+    def cost(self) -> float:
+        return sum(step.cost for step in self.steps)
+
+    @property
+    def keys(self) -> list[Hashable]:
+        return [ step.key for step in self.steps ]
+
+    def extend(self, step: RedundancyStep) -> "RedundancyPlan":
+        return RedundancyPlan(self.base_risk, self.steps + (step,))
+
+    def as_dict(self) -> dict:
+        return {
+            "base_risk" : self.base_risk,
+            "risk" : self.risk,
+            "cost" : self.cost,
+            "steps" : [ step.as_dict() for step in self.steps ],
+        }
+
+class RedundancyOptimizer:
+    DEFAULT_COST = 1
+    # Candidates below this many aren't worth a process pool
+    MIN_PARALLEL_CANDIDATES = 1024
+
+    # costs and spare_risks map keys to what a spare for that component
+    # costs and how likely it is to fail. By default every spare costs
+    # DEFAULT_COST and fails as often as the component it backs up.
+    # candidates defaults to every component that can fail. Candidates
+    # outside the target's cone can't change its risk, so they're left out
+    def __init__(self, dg: DepGraph, target: Hashable, costs: dict=None,
+                 spare_risks: dict=None, candidates: list[Hashable]=None,
+                 workers: int=None) -> None:
+        n = dg.n
+        self.dg = dg
+        self.target_key = target
+        self.workers = workers if workers is not None else os.cpu_count()
+
+        # The cone's own copy, where everything is found by position.
+        # snapshot_arrays() can hand out views of the graph's own arrays
+        cone = dg.ancestor_cone(dg.refi[target])
+        cone_slots = np.flatnonzero(cone)
+        self.arrays = { name : a.copy() for name, a in snapshot_arrays(dg, cone_slots) }
+        self.graph = graph_from_arrays(list(range(len(cone_slots))), self.arrays, dg.engine)
+        position = np.full(n, -1, np.intp)
+        position[cone_slots] = np.arange(len(cone_slots))
+        self.target = position[dg.refi[target]]
+
+        if candidates is None:
+            slots = np.flatnonzero(dg.active[:n] & ~dg.is_AND[:n] & (dg.r0[:n] > 0) & cone)
+        else:
+            slots = dg.indices_of(candidates)
+            slots = slots[cone[slots]]
+        self.slots = position[slots]
+        self.keys = dg.keys_of(slots).tolist()
+
+        costs = {} if costs is None else costs
+        spare_risks = {} if spare_risks is None else spare_risks
+        self.costs = np.array([ costs.get(key, self.DEFAULT_COST) for key in self.keys ], np.double)
+        self.spare_risks = np.array([
+            spare_risks.get(key, dg.r0[i]) for key, i in zip(self.keys, slots.tolist())
+        ], np.double)
+
+    # f(graph, *args, columns) for the (m, B) columns, split over the
+    # workers along B, with worker_f being the same for their copy
+    def map_columns(self, f: Callable, worker_f: Callable, args: tuple,
+                    columns: np.ndarray, pool: ProcessPoolExecutor) -> np.ndarray:
+        if pool is None:
+            return f(self.graph, *args, columns)
+        chunks = np.array_split(np.arange(columns.shape[1]), self.workers)
+        chunks = [ chunk for chunk in chunks if len(chunk) ]
+        results = pool.map(worker_f, *([ arg ] * len(chunks) for arg in args), [ columns[:, c] for c in chunks ])
+        return np.concatenate(list(results), axis=-1)
+
+    # Risk of the target after each candidate is made redundant on top
+    # of r0, which is over the cone. Candidates not in which are left at nan
+    def score(self, r0: np.ndarray, which: np.ndarray, pool: ProcessPoolExecutor=None) -> np.ndarray:
+        g = self.graph
+        m = g.n
+        slots = self.slots[which]
+        new_r0 = r0[slots] * self.spare_risks[which]
+        risks = np.full(len(self.slots), np.nan)
+        if not len(slots):
+            return risks
+
+        # r0 with each candidate made redundant in its own column
+        def columns() -> np.ndarray:
+            columns = np.repeat(r0[:, None], len(slots), axis=1)
+            columns[slots, np.arange(len(slots))] = new_r0
+            return columns
+
+        if "closure" == g.engine:
+            # [j] = P(a failure of j reaches the target), in which
+            # case r_target = 1 - prod(1 - a * r0), with the gate
+            # weights in r0
+            a = np.array(g.calc_Ac_full()[self.target], np.double)
+            a[self.target] = 1
+            base = g.calc_AND_weights(r0)
+            gates = np.flatnonzero(g.is_AND[:m])
+            weights = np.empty((0, len(slots)), np.double)
+            if len(gates):
+                weights = self.map_columns(gate_weights, worker_gate_weights, (gates,), columns(), pool)
+            if np.all(a * base < 1) and np.all(a[gates, None] * weights < 1):
+                log_new = np.sum(np.log1p(-a * base))
+                log_new = log_new - np.log1p(-a[slots] * base[slots]) + np.log1p(-a[slots] * new_r0)
+                log_new = log_new + np.sum(np.log1p(-a[gates, None] * weights) - np.log1p(-a[gates] * base[gates])[:, None], axis=0)
+                risks[which] = -np.expm1(log_new)
+                return risks
+
+        risks[which] = self.map_columns(target_risks, worker_target_risks, (self.target,), columns(), pool)
+        return risks
+    # Ranked plans that make components redundant for at most budget in
+    # total, lowest risk first and cheapest first among equals. Each
+    # round extends every plan in the beam by every affordable candidate
+    # it doesn't have yet, and keeps the beam_width extensions that cut
+    # the most risk per unit of cost. A beam_width of 1 is plain greedy
+    # search. Every plan the search passes through is ranked, so the
+    # list also has the cheaper plans along the way
+    def optimize(self, budget: float, beam_width: int=1, max_steps: int=None) -> list[RedundancyPlan]:
+        g = self.graph
+        base_r0 = g.r0[:g.n].copy()
+        base_risk = float(target_risks(g, self.target, base_r0[:, None])[0])
+
+        beam = [(RedundancyPlan(base_risk), base_r0, np.zeros(len(self.slots), bool))]
+        plans = []
+        max_steps = len(self.slots) if max_steps is None else max_steps
+
+        pool = None
+        if self.workers > 1 and len(self.slots) >= self.MIN_PARALLEL_CANDIDATES:
+            pool = ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(self.arrays, g.engine))
+        try:
+            for _ in range(max_steps):
+                extensions = []
+                for plan, r0, used in beam:
+                    which = ~used & (plan.cost + self.costs <= budget)
+                    risks = self.score(r0, which, pool)
+                    for k in np.flatnonzero(which).tolist():
+                        cost = plan.cost + self.costs[k]
+                        gain = (base_risk - risks[k]) / cost if cost else np.inf
+                        extensions.append((gain, plan, r0, used, k, risks[k]))
+                if not extensions:
+                    break
+
+                extensions.sort(key=lambda e: e[0], reverse=True)
+                beam = []
+                seen = set()
+                for gain, plan, r0, used, k, risk in extensions:
+                    # The same set reached in a different order
+                    chosen = frozenset(plan.keys) | { self.keys[k] }
+                    if chosen in seen:
+                        continue
+                    seen.add(chosen)
+
+                    step = RedundancyStep(self.keys[k], float(self.spare_risks[k]), float(self.costs[k]), float(risk))
+                    new_r0 = r0.copy()
+                    new_r0[self.slots[k]] *= self.spare_risks[k]
+                    new_used = used.copy()
+                    new_used[k] = True
+                    beam.append((plan.extend(step), new_r0, new_used))
+                    if len(beam) == beam_width:
+                        break
+                plans.extend(plan for plan, _, _ in beam)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        if "closure" == self.dg.engine:
+            plans = [ self.as_applied(plan) for plan in plans ]
+        plans.sort(key=lambda plan: (plan.risk, plan.cost))
+        return plans
+
+    # plan with the risks apply_plan() really gives after each step,
+    # found on a copy of the whole graph keyed by position
+    def as_applied(self, plan: RedundancyPlan) -> RedundancyPlan:
+        dg = self.dg
+        slots = np.flatnonzero(dg.active[:dg.n])
+        arrays = { name : a.copy() for name, a in snapshot_arrays(dg) }
+        copy = graph_from_arrays(list(range(len(slots))), arrays, dg.engine)
+        position = { key : i for i, key in enumerate(dg.keys_of(slots).tolist()) }
+        target = position[self.target_key]
+
+        applied = RedundancyPlan(plan.base_risk)
+        for step in plan.steps:
+            moved = RedundancyStep(position[step.key], step.spare_risk, step.cost, step.risk)
+            apply_plan(copy, RedundancyPlan(plan.base_risk, (moved,)))
+            risk = float(copy.get_total_risk(target))
+            applied = applied.extend(RedundancyStep(step.key, step.spare_risk, step.cost, risk))
+        return applied
+
+# Adds the redundancy of every step in plan to dg. make_keys turns a
+# component's key into keys for its primary unit, its spare and their
+# AND gate, so the GUI can hand out its own items. The component keeps
+# its dependencies and dependents, and its own direct risk, along with
+# any Weibull distribution, moves to the primary unit
+def apply_plan(dg: DepGraph, plan: RedundancyPlan,
+               make_keys: Callable[[Hashable], tuple[Hashable]]=None) -> None:
+    if make_keys is None:
+        make_keys = lambda key: ((key, "primary"), (key, "spare"), (key, "redundancy"))
+
+    for step in plan.steps:
+        primary, spare, gate = make_keys(step.key)
+        i = dg.refi[step.key]
+
+        dg.add_vertices([primary, spare], [dg.r0[i], step.spare_risk])
+        # Copied as is, since the direct risk may be for any mission time
+        j = dg.refi[primary]
+        dg.weibull[j] = dg.weibull[i]
+        dg.has_weibull[j] = dg.has_weibull[i]
+        dg.add_AND_gate(gate)
+        dg.add_edges([(primary, gate), (spare, gate), (gate, step.key)])
+        dg.update_vertex(step.key, 0)
+
+if __name__ == "__main__":
+    ########### Testing code ################
+    # Run from the repository root with python -m graph.redundancy
+    dg = DepGraph(engine="topological")
+    dg.add_vertices(['power', 'pump', 'valve', 'sensor', 'top'], [0.02, 0.1, 0.05, 0.08, 0])
+    dg.add_edges([('power', 'pump'), ('pump', 'top'), ('valve', 'top'), ('sensor', 'valve')],
+                 [1, 1, 0.8, 0.5])
+
+    optimizer = RedundancyOptimizer(dg, 'top', costs={ 'pump' : 2 })
+    for plan in optimizer.optimize(budget=3, beam_width=2)[:3]:
+        print(plan.as_dict())
+
+    best = optimizer.optimize(budget=3)[0]
+    apply_plan(dg, best)
+    print("Predicted", best.risk, "after applying", dg.get_r_dict()['top'])
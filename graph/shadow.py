@@ -0,0 +1,192 @@
+# @file shadow.py
+# @author Evan Brody
+# @brief Checks DepGraph's incremental closure against a replay of its edges
+
+import logging
+import numpy as np
+from graph.dep_graph import DepGraph
+
+# add_edge_i() and update_edge_i() keep A_tc and one_count up to date
+# by ORing paths in and dividing them back out. Dividing is only an
+# exact inverse when no other path shares the edge, and counts of
+# weight-1 paths only stay right as long as every edge that was
+# counted is uncounted the same way. A ShadowChecker keeps a log of
+# the edges in the order they went in, by key, with the weight each
+# has now. Every check_every mutations it replays that log into a
+# fresh graph with add_edge_i(), which is the closure the graph would
+# have if none of its edges had ever been updated or deleted, and
+# measures how far the incremental state has wandered from it. It also
+# checks that A_tc and r are still probabilities. With resync_every,
+# or when a check finds more than tolerance and resync is set, the
+# replayed closure replaces the incremental one.
+# Whenever the graph's closure is rebuilt with build_closure(), the
+# log starts over from closure_edge_order(), the order that rebuilds it
+
+logger = logging.getLogger(__name__)
+
+class ShadowChecker:
+    DEFAULT_CHECK_EVERY = 100
+    DEFAULT_TOLERANCE = 1e-9
+
+    def __init__(self, dg: DepGraph, check_every: int=DEFAULT_CHECK_EVERY,
+                 resync_every: int=0, tolerance: float=DEFAULT_TOLERANCE,
+                 resync: bool=False) -> None:
+        self.dg = dg
+        self.check_every = check_every
+        self.resync_every = resync_every
+        self.tolerance = tolerance
+        self.resync = resync
+
+        self.mutations = 0
+        self.checks = 0
+        self.resyncs = 0
+        # Checks that found more than tolerance
+        self.failures = 0
+        self.max_divergence = 0.0
+        # Mutation count at which max_divergence was seen
+        self.max_divergence_at = None
+        self.last = None
+        # (key a, key b) -> weight of every edge a -> b, in the
+        # order they went in
+        self.edges = {}
+
+    # Called by the graph after its closure was built from scratch
+    def closure_rebuilt(self) -> None:
+        dg = self.dg
+        self.edges = { (dg.iref[a], dg.iref[b]) : dg.succ[a][b] for a, b in dg.closure_edge_order() }
+
+    # Called by the graph after every change to its closure, with the
+    # edge that changed and its new weight
+    def after_mutation(self, edge: tuple[int], weight: float) -> None:
+        if "closure" != self.dg.engine:
+            return
+
+        key = (self.dg.iref[edge[0]], self.dg.iref[edge[1]])
+        if not weight:
+            self.edges.pop(key, None)
+        else:
+            # An update keeps the edge where it was
+            self.edges[key] = weight
+
+        self.mutations += 1
+        check = self.check_every and 0 == self.mutations % self.check_every
+        resync = self.resync_every and 0 == self.mutations % self.resync_every
+        if not (check or resync):
+            return
+
+        reference = self.replay()
+        if check:
+            divergence = self.check(reference)
+            resync = resync or (self.resync and self.diverged(divergence))
+        if resync:
+            self.resync_from(reference)
+
+    # A graph with the same slots, which had the logged edges
+    # added one by one and nothing else
+    def replay(self) -> DepGraph:
+        dg = self.dg
+        n = dg.n
+        reference = DepGraph(max(n, 1))
+        reference.n = n
+        for name in ("iref", "active", "r0", "is_AND", "vote_k"):
+            getattr(reference, name)[:n] = getattr(dg, name)[:n]
+        reference.refi = dict(dg.refi)
+        reference.succ = { a : {} for a in dg.succ }
+        reference.pred = { b : {} for b in dg.pred }
+        for (a, b), weight in self.edges.items():
+            reference.add_edge_i((dg.refi[a], dg.refi[b]), weight)
+        return reference
+
+    # How far the graph is from reference, as a dict of
+    #   A_tc: largest difference in the closure probabilities
+    #   one_count: how many cells disagree on whether there's a weight-1 path
+    #   one_count_values: how many disagree on how many there are, which
+    #       decides what later deletions leave behind
+    #   Ac_full: largest difference in the closure calc_r() uses
+    #   r: largest difference in the risks that come out of it
+    #   max: the largest of A_tc, Ac_full and r
+    #   A_tc_out_of_range: how many closure cells aren't in [0, 1]
+    #   r_out_of_range: how many risks aren't
+    # r is worked out with calc_r_batch(), which leaves the graph's
+    # own r, and so what get_r_changes() reports, alone
+    def check(self, reference: DepGraph) -> dict:
+        dg = self.dg
+        n = dg.n
+        active = np.flatnonzero(dg.active[:n])
+        block = np.ix_(active, active)
+
+        A_tc = np.abs(dg.A_tc[:n, :n][block] - reference.A_tc[:n, :n][block])
+        counts = dg.one_count[:n, :n][block]
+        reference_counts = reference.one_count[:n, :n][block]
+        Ac_full = np.abs(dg.calc_Ac_full()[block] - reference.calc_Ac_full()[block])
+        r0 = dg.r0[:n, None]
+        r_dg = dg.calc_r_batch(r0, active)
+        r = np.abs(r_dg - reference.calc_r_batch(r0, active))
+        in_range = lambda x: (0 <= x) & (x <= 1)
+
+        divergence = {
+            "A_tc" : float(A_tc.max(initial=0)),
+            "one_count" : int(np.count_nonzero((counts > 0) != (reference_counts > 0))),
+            "one_count_values" : int(np.count_nonzero(counts != reference_counts)),
+            "Ac_full" : float(Ac_full.max(initial=0)),
+            "r" : float(r.max(initial=0)),
+            "A_tc_out_of_range" : int(np.count_nonzero(~in_range(dg.A_tc[:n, :n][block]))),
+            "r_out_of_range" : int(np.count_nonzero(~in_range(r_dg))),
+        }
+        divergence["max"] = max(divergence["A_tc"], divergence["Ac_full"], divergence["r"])
+
+        self.checks += 1
+        self.last = divergence
+        if divergence["max"] > self.max_divergence:
+            self.max_divergence = divergence["max"]
+            self.max_divergence_at = self.mutations
+        if self.diverged(divergence):
+            self.failures += 1
+            logger.warning("DepGraph closure diverged after %d mutations: %s", self.mutations, divergence)
+
+        return divergence
+
+    def diverged(self, divergence: dict) -> bool:
+        return (divergence["max"] > self.tolerance or 0 < divergence["one_count"]
+                or 0 < divergence["A_tc_out_of_range"] or 0 < divergence["r_out_of_range"])
+
+    # Replaces the graph's closure with the replayed one
+    def resync_from(self, reference: DepGraph) -> None:
+        dg = self.dg
+        n = dg.n
+        dg.A_tc[:n, :n] = reference.A_tc[:n, :n]
+        dg.one_count[:n, :n] = reference.one_count[:n, :n]
+        dg.Ac_full_dirty = True
+        # The reachability index holds whatever the closure connects
+        dg.reach_dirty = True
+        dg.r_dirty[:n] = dg.active[:n]
+        self.resyncs += 1
+
+    def report(self) -> dict:
+        return {
+            "mutations" : self.mutations,
+            "checks" : self.checks,
+            "failures" : self.failures,
+            "resyncs" : self.resyncs,
+            "max_divergence" : self.max_divergence,
+            "max_divergence_at" : self.max_divergence_at,
+            "last" : self.last,
+        }
+
+if __name__ == "__main__":
+    ########### Testing code ################
+    # Run from the repository root with python -m graph.shadow
+    rng = np.random.default_rng(0)
+    dg = DepGraph()
+    dg.add_vertices(list(range(50)), rng.uniform(0, 0.1, 50))
+    shadow = dg.enable_shadow(check_every=25, resync=True)
+
+    # Edges go forward only, so the graph stays acyclic. Adding them
+    # never diverges, updating and deleting edges that share paths does
+    for _ in range(500):
+        a, b = np.sort(rng.choice(50, 2, replace=False)).tolist()
+        if b in dg.succ[a]:
+            dg.update_edge((a, b), float(rng.choice([1, rng.uniform(0.1, 0.9), 0])))
+        else:
+            dg.add_edge((a, b), float(rng.choice([1, rng.uniform(0.1, 0.9)])))
+    print(shadow.report())
@@ -0,0 +1,246 @@
+# @file snapshot.py
+# @author Evan Brody
+# @brief Binary snapshots of dependency graphs, with memory-mapped loading
+
+import json
+import hashlib
+import numpy as np
+from collections.abc import Hashable
+from graph.dep_graph import DepGraph
+
+# Layout of a snapshot file:
+#   MAGIC, then the version and the header length as little-endian uint32
+#   The header, JSON encoded, describing everything below
+#   Zero padding up to a multiple of ALIGN
+#   The arrays, each starting on a multiple of ALIGN from the data start
+# Only active vertices are written, in slot order, so a snapshot of a
+# graph with free slots comes back compacted. Arrays are stored
+# little-endian and C-contiguous, which is exactly what np.memmap
+# needs to map them without copying
+
+MAGIC = b"DEPGRAPH"
+VERSION = 2
+ALIGN = 64
+PREFIX_LEN = len(MAGIC) + 8
+
+# Square arrays, mapped when loading with mmap=True
+MAPPED_ARRAYS = ("A_tc", "one_count")
+
+# Keys have to survive JSON. Ints, floats, strings, bools and None do
+# as they are, and tuples of those are tagged since JSON only has lists
+def encode_key(key: Hashable) -> object:
+    if isinstance(key, tuple):
+        return { "tuple" : [ encode_key(k) for k in key ] }
+    if isinstance(key, np.generic):
+        return key.item()
+    if key is None or isinstance(key, (int, float, str, bool)):
+        return key
+    raise TypeError(f"Can't store vertex key {key!r}, pass keys to save() instead")
+
+def decode_key(key: object) -> Hashable:
+    if isinstance(key, dict):
+        return tuple(decode_key(k) for k in key["tuple"])
+    return key
+
+def padding(offset: int) -> int:
+    return -offset % ALIGN
+
+# Everything that goes in a snapshot, as (name, array) pairs. slots
+# takes only those vertices and the edges between them, every active
+# one by default. For the risks to come out the same, they should
+# hold everything upstream of themselves, see DepGraph.ancestor_cone()
+def snapshot_arrays(dg: DepGraph, slots: np.ndarray=None) -> list[tuple[str, np.ndarray]]:
+    if slots is None:
+        slots = np.flatnonzero(dg.active[:dg.n])
+    index = np.full(dg.n, -1, np.intp)
+    index[slots] = np.arange(len(slots))
+
+    # A is sparse, so it's stored as a list of edges (a -> b)
+    edges = [ (a, b, w) for a, out_edges in dg.succ.items() if 0 <= index[a]
+              for b, w in out_edges.items() if 0 <= index[b] ]
+    edge_ab = np.array([ (index[a], index[b]) for a, b, _ in edges ], np.int64).reshape(-1, 2)
+    edge_w = np.array([ w for _, _, w in edges ], np.double)
+
+    # Without free slots the active block is just a view. The
+    # topological engine has no closure, so it writes empty ones.
+    # The closure engine may not have built its closure yet
+    if "closure" == dg.engine and not dg.closure_built:
+        dg.build_closure()
+    if "topological" == dg.engine:
+        take_mat = lambda M: M[:0, :0]
+        take_vec = lambda v: v[slots]
+    elif np.array_equal(slots, np.arange(dg.n)):
+        take_vec = lambda v: v[:dg.n]
+        take_mat = lambda M: M[:dg.n, :dg.n]
+    else:
+        take_vec = lambda v: v[slots]
+        take_mat = lambda M: M[np.ix_(slots, slots)]
+
+    arrays = [
+        ("edges", edge_ab),
+        ("edge_weights", edge_w),
+        ("r0", take_vec(dg.r0)),
+        ("is_AND", take_vec(dg.is_AND)),
+        ("weibull", take_vec(dg.weibull)),
+        ("has_weibull", take_vec(dg.has_weibull)),
+        ("vote_k", take_vec(dg.vote_k)),
+        ("A_tc", take_mat(dg.A_tc)),
+        ("one_count", take_mat(dg.one_count)),
+    ]
+    return [ (name, np.ascontiguousarray(a, a.dtype.newbyteorder("<"))) for name, a in arrays ]
+
+# blake2b of the key table and every array, shapes and types included,
+# so equal graphs get equal fingerprints wherever they're saved
+def fingerprint(keys: list, arrays: list[tuple[str, np.ndarray]]) -> str:
+    h = hashlib.blake2b(digest_size=32)
+    h.update(json.dumps(keys, separators=(",", ":")).encode())
+    for name, a in arrays:
+        h.update(json.dumps([name, a.dtype.str, a.shape]).encode())
+        h.update(a.reshape(-1).view(np.uint8))
+    return h.hexdigest()
+
+# keys replaces the graph's own keys in the file, one per active vertex
+# in slot order, for graphs keyed by things JSON can't hold. Returns
+# the fingerprint
+def save(dg: DepGraph, path: str, keys: list[Hashable]=None) -> str:
+    if keys is None:
+        keys = dg.keys_of(np.flatnonzero(dg.active[:dg.n])).tolist()
+    keys = [ encode_key(k) for k in keys ]
+
+    arrays = snapshot_arrays(dg)
+    if len(keys) != len(arrays[2][1]):
+        raise ValueError(f"Expected {len(arrays[2][1])} keys, got {len(keys)}")
+
+    layout = {}
+    offset = 0
+    for name, a in arrays:
+        layout[name] = { "dtype" : a.dtype.str, "shape" : a.shape, "offset" : offset }
+        offset += a.nbytes + padding(a.nbytes)
+
+    header = {
+        "n" : len(keys),
+        "engine" : dg.engine,
+        "keys" : keys,
+        "arrays" : layout,
+        "fingerprint" : fingerprint(keys, arrays),
+    }
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.array([VERSION, len(header_bytes)], "<u4").tobytes())
+        f.write(header_bytes)
+        f.write(bytes(padding(PREFIX_LEN + len(header_bytes))))
+        for name, a in arrays:
+            f.write(a.reshape(-1).view(np.uint8))
+            f.write(bytes(padding(a.nbytes)))
+
+    return header["fingerprint"]
+
+# The header and where the arrays start
+def read_header(path: str) -> tuple[dict, int]:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a DepGraph snapshot")
+        version, header_len = np.frombuffer(f.read(8), "<u4").tolist()
+        if version > VERSION:
+            raise ValueError(f"{path} is snapshot version {version}, newest supported is {VERSION}")
+        header = json.loads(f.read(header_len))
+
+    data_start = PREFIX_LEN + header_len
+    return header, data_start + padding(data_start)
+
+# With mmap, A_tc and one_count are mapped copy-on-write instead of
+# read, so opening is instant whatever the size, and processes loading
+# the same file share its pages. Writes stay private to the process.
+# verify rereads everything to check the fingerprint
+def load(path: str, mmap: bool=True, verify: bool=False) -> DepGraph:
+    header, data_start = read_header(path)
+
+    arrays = {}
+    with open(path, "rb") as f:
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            shape = tuple(spec["shape"])
+            offset = data_start + spec["offset"]
+            if mmap and name in MAPPED_ARRAYS and np.prod(shape):
+                arrays[name] = np.memmap(path, dtype, "c", offset, shape)
+            else:
+                f.seek(offset)
+                count = int(np.prod(shape))
+                arrays[name] = np.fromfile(f, dtype, count).reshape(shape)
+
+    keys = [ decode_key(k) for k in header["keys"] ]
+    if verify:
+        named = [ (name, arrays[name]) for name in header["arrays"] ]
+        if fingerprint(header["keys"], named) != header["fingerprint"]:
+            raise ValueError(f"{path} doesn't match its fingerprint")
+
+    # Snapshots from before the topological engine are all closures
+    return graph_from_arrays(keys, arrays, header.get("engine", "closure"))
+
+# A graph keyed by keys, one per vertex, from arrays named like the
+# ones snapshot_arrays() gives. Square ones are used as they are, so
+# they can be memory-mapped
+def graph_from_arrays(keys: list[Hashable], arrays: dict, engine: str) -> DepGraph:
+    n = len(keys)
+    dg = DepGraph(0, engine)
+    dg.n = n
+    dg.capacity = n
+    dg.refi = { key : i for i, key in enumerate(keys) }
+    dg.iref = np.empty(n, object)
+    for i, key in enumerate(keys):
+        dg.iref[i] = key
+    dg.active = np.ones(n, bool)
+    dg.r0 = arrays["r0"].astype(np.double)
+    dg.is_AND = arrays["is_AND"].astype(bool)
+    dg.weibull = arrays["weibull"].astype(np.double)
+    dg.has_weibull = arrays["has_weibull"].astype(bool)
+    # Version 1 snapshots predate voting gates
+    if "vote_k" in arrays:
+        dg.vote_k = arrays["vote_k"].astype(np.int64)
+    else:
+        dg.vote_k = np.zeros(n, np.int64)
+    dg.topo_pos = np.zeros(n, np.int64)
+    dg.scc_of = np.full(n, -1, np.int64)
+    dg.A_tc = arrays["A_tc"]
+    dg.one_count = arrays["one_count"]
+
+    # Ac_full is left to be rebuilt when it's first needed. Fresh
+    # zeroed memory isn't touched until then, so this costs nothing
+    dg.Ac_full = np.zeros(dg.A_tc.shape, np.double)
+    dg.Ac_full_dirty = True
+    # Rebuilt from the edges when it's first needed
+    if "closure" == dg.engine:
+        dg.closure_built = True
+        dg.reach.reserve(n, 0)
+    dg.r = np.full(n, np.nan)
+    dg.r_dirty = np.ones(n, bool)
+    dg.r_unreported = np.zeros(n, bool)
+
+    dg.succ = { i : {} for i in range(n) }
+    dg.pred = { i : {} for i in range(n) }
+    for (a, b), w in zip(arrays["edges"].tolist(), arrays["edge_weights"].tolist()):
+        dg.succ[a][b] = w
+        dg.pred[b][a] = w
+
+    # The order isn't stored since it's one pass over the edges
+    if "topological" == dg.engine:
+        dg.set_engine("topological")
+    return dg
+
+if __name__ == "__main__":
+    ########### Testing code ################
+    # Run from the repository root with python -m graph.snapshot
+    import os, tempfile
+
+    dg = DepGraph()
+    dg.add_vertices(['a', 'b', 'c', ('d', 1)], [0.25] * 4)
+    dg.add_AND_gate('AND')
+    dg.add_edges([('a', 'b'), ('b', 'AND'), ('c', 'AND'), ('AND', ('d', 1))], [0.5, 1, 1, 0.75])
+    print(dg.get_r_dict())
+
+    path = os.path.join(tempfile.mkdtemp(), "graph.dg")
+    print("Saved", save(dg, path))
+    loaded = load(path, verify=True)
+    print(loaded.get_r_dict())
@@ -33,7 +33,6 @@ TODO: UI Bug fixes
     TODO: fix dependency arrow snapping when dragging rectangles over each other
 
 TODO:
-    # Success criteria: fails if n or more components fail
     # Eraser cursor
 """
 
@@ -139,6 +138,9 @@ class DepQMenu(QMenu):
         self.weibull_action = self.addAction("Generate Weibull Distribution")
         self.dr_action.triggered.connect(self.gen_weibull)
 
+        self.importance_action = self.addAction("Rank Component Importance")
+        self.importance_action.triggered.connect(self.show_importance)
+
         self.exec(pos)
     
     def input_dr(self) -> None:
@@ -156,6 +158,35 @@ class DepQMenu(QMenu):
     def reset_dr(self) -> None:
         pass
 
+    # Ranks every component by how much it matters to the risk of
+    # this one, most important first by Birnbaum importance
+    def show_importance(self) -> None:
+        importance = self.dg.calc_importance(self.parent_rect)
+        ranking = sorted(importance.items(), key=lambda kv: kv[1][0], reverse=True)
+
+        dialog = QDialog()
+        dialog.setWindowTitle("Component Importance")
+        layout = QVBoxLayout(dialog)
+
+        table = QTableWidget(len(ranking), 5)
+        table.setHorizontalHeaderLabels(
+            ["Component", "Birnbaum", "Fussell-Vesely", "Risk Achievement Worth", "Risk Reduction Worth"]
+        )
+        for row, (rect, measures) in enumerate(ranking):
+            comp_str = rect.data(self.COMP_STR)
+            name = comp_str if isinstance(comp_str, str) and comp_str else "(unnamed)"
+            if rect is self.parent_rect:
+                name += " (this)"
+            table.setItem(row, 0, QTableWidgetItem(name))
+            for col, m in enumerate(measures, 1):
+                table.setItem(row, col, QTableWidgetItem(f"{m:.4g}"))
+        table.resizeColumnsToContents()
+        table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+
+        layout.addWidget(table)
+        dialog.resize(700, 400)
+        dialog.exec()
+
     def set_new_risk(self, risk: float) -> None:
         self.dg.update_vertex(self.parent_rect, risk)
         self.parent_scene.update_rect_colors()
@@ -217,25 +248,17 @@ class DepQComboBox(QComboBox):
         self.addItems(self.parent_window.components["name"])
         self.textActivated.connect(self.update_comp_fail_rate)
 
-    def set_new_weight(self, three_params: list[float]) -> None:
+    # The graph keeps the whole distribution so it can be evaluated
+    # at any mission time, and the direct risk shown is at mission_time
+    def set_new_weight(self, three_params: list[float],
+                       mission_time: float=DepGraph.DEFAULT_MISSION_TIME) -> None:
         self.three_param = three_params
-        unclamped_weight = self.get_prob_from_3param_weibull(*three_params)
-
-        # Weight is a probability, so it should be in [0, 1]
-        new_weight = min(max(0, unclamped_weight), 1)
-        self.parent_scene.dg.update_vertex(self.parent_rect, new_weight)
+        self.parent_scene.dg.set_weibull(self.parent_rect, three_params, mission_time)
         self.parent_scene.update_rect_colors()
     
     def get_prob_from_3param_weibull(self, lb: float, be: float, ub: float) -> float:
-        if be == 0: return 0 # Prevent division by zero
-        t = 1_000_000 # We choose failures per one million hours
-
-        # Ensure reasonable values
-        ub = max(0, min(ub, 10))
-
         # Cumulative distribution function of the 3 paramater Weibull distribution
-        e_power = ((t - lb) / be) ** abs(ub)
-        return 1 - math.exp(-e_power)
+        return float(DepGraph.weibull_cdf(DepGraph.DEFAULT_MISSION_TIME, lb, be, ub))
 
     def update_comp_fail_rate(self, comp_str: str) -> None:
         self.parent_rect.setData(self.COMP_STR, comp_str)
@@ -252,8 +275,12 @@ class DepQComboBox(QComboBox):
             lb = comp_fail_rows["lower_bound"].sum()
             be = comp_fail_rows["best_estimate"].sum()
             ub = comp_fail_rows["upper_bound"].sum()
-            
-            self.set_new_weight([lb, be, ub])
+            # The longest any of the failure modes is meant to run for
+            mission_time = comp_fail_rows["mission_time"].max()
+            if pd.isna(mission_time):
+                mission_time = DepGraph.DEFAULT_MISSION_TIME
+
+            self.set_new_weight([lb, be, ub], float(mission_time))
         else:
             # If we don't, predict the failure rate using the RNN
             self.set_new_weight(
@@ -501,6 +528,18 @@ class DepQGraphicsScene(QGraphicsScene):
         self.update_rect_colors()
 
     def add_AND_gate(self, event: QGraphicsSceneMouseEvent) -> None:
+        self.add_gate(event, "AND")
+
+    def add_voting_gate(self, event: QGraphicsSceneMouseEvent) -> None:
+        k, res = QInputDialog.getInt(self.parent_window, "Voting Gate Input",
+                                     "Fails if at least this many inputs fail:", 2, 1)
+        if not res:
+            return
+        self.add_gate(event, f"\u2265{k}", k)
+
+    # Gates are drawn the same way whatever their kind, k > 0 making a
+    # k-out-of-n voting gate instead of an AND gate
+    def add_gate(self, event: QGraphicsSceneMouseEvent, label: str, k: int=0) -> None:
         # Create and add rectangle
         rect_w, rect_h = self.RECT_DIMS
         rect_x = event.scenePos().x() - rect_w // 2
@@ -516,10 +555,13 @@ class DepQGraphicsScene(QGraphicsScene):
         self.rect_influences[rect_item] = []
         self.rect_arrs_in[rect_item] = []
         self.rect_arrs_out[rect_item] = []
-        self.dg.add_AND_gate(rect_item)
+        if k > 0:
+            self.dg.add_voting_gate(rect_item, k)
+        else:
+            self.dg.add_AND_gate(rect_item)
 
         # Create text
-        text_widg = QLabel("AND")
+        text_widg = QLabel(label)
         text_widg.setWordWrap(True)
         text_widg.setAlignment(Qt.AlignHCenter)
 
@@ -557,10 +599,11 @@ class DepQGraphicsScene(QGraphicsScene):
             self.removeItem(self.dyn_arr)
             self.dyn_arr = None
 
+    # Only components whose risk changed need repainting
     def update_rect_colors(self) -> None:
-        self.rect_risks = self.dg.get_r_dict()
-        for rect in filter(lambda x: x.data(self.IS_COMPONENT), self.items()):
-            risk = self.rect_risks[rect]
+        changed = self.dg.get_r_changes()
+        self.rect_risks.update(changed)
+        for rect, risk in changed.items():
             brush = rect.brush()
             bcolor = brush.color()
             bcolor.setAlphaF(risk)
@@ -572,17 +615,24 @@ class DepQGraphicsScene(QGraphicsScene):
 
     # Properly deletes components and AND gates
     def delete_rect(self, rect_item: QGraphicsRectItem) -> None:
-        for arr in self.rect_arrs_out[rect_item] + self.rect_arrs_in[rect_item]:
-            if arr.scene():
-                self.removeItem(arr)
-        self.rect_arrs_out[rect_item].clear()
-        self.rect_arrs_in[rect_item].clear()
+        self.delete_rects([rect_item])
+
+    # Deletes several at once so the graph only compacts once
+    def delete_rects(self, rect_items: list[QGraphicsRectItem]) -> None:
+        for rect_item in rect_items:
+            for arr in self.rect_arrs_out[rect_item] + self.rect_arrs_in[rect_item]:
+                if arr.scene():
+                    self.removeItem(arr)
+            self.rect_arrs_out[rect_item].clear()
+            self.rect_arrs_in[rect_item].clear()
 
-        self.rect_depends_on[rect_item].clear()
-        self.rect_influences[rect_item].clear()
+            self.rect_depends_on[rect_item].clear()
+            self.rect_influences[rect_item].clear()
 
-        self.dg.delete_vertex(rect_item)
-        self.removeItem(rect_item)
+        self.dg.delete_vertices(rect_items)
+        for rect_item in rect_items:
+            self.rect_risks.pop(rect_item, None)
+            self.removeItem(rect_item)
 
     def erase_in_circle(self, pos: QPointF) -> None:
         eraser = self.addEllipse(
@@ -612,10 +662,13 @@ class DepQGraphicsScene(QGraphicsScene):
                 something_erased = True
         
         # Now deal with components and AND gates
-        for item in to_erase:
-            if item.data(self.IS_COMPONENT) or item.data(self.IS_AND_GATE):
-                self.delete_rect(item)
-                something_erased = True
+        to_delete = [
+            item for item in to_erase
+            if item.data(self.IS_COMPONENT) or item.data(self.IS_AND_GATE)
+        ]
+        if to_delete:
+            self.delete_rects(to_delete)
+            something_erased = True
 
         if something_erased:
             self.update_rect_colors()
@@ -814,6 +867,9 @@ class DepQGraphicsScene(QGraphicsScene):
                 case self.parent_window.AND_gate_button:
                     if not self.released_on_1:
                         self.add_AND_gate(event)
+                case self.parent_window.voting_gate_button:
+                    if not self.released_on_1:
+                        self.add_voting_gate(event)
                 case self.parent_window.eraser_button:
                     self.erase_in_circle(pos)
             return
@@ -896,10 +952,10 @@ class DepQGraphicsScene(QGraphicsScene):
     def keyReleaseEvent(self, event) -> None:
         match event.key():
             case Qt.Key_Delete:
-                something_deleted = False
-                for item in self.selectedItems():
-                    self.delete_rect(item)
-                    something_deleted = True
+                selected = self.selectedItems()
+                something_deleted = bool(selected)
+                if something_deleted:
+                    self.delete_rects(selected)
 
                 self.dep_origin = None
                 self.del_dyn_arr()
@@ -1368,6 +1424,22 @@ class MainWindow(QMainWindow):
             self.AND_gate_icon, "Add AND Gate", self.dep_toolbar, self.system_vis_scene, self
         )
 
+        # Voting gate button, drawn here since there's no image for it
+        voting_pixmap = QPixmap(64, 64)
+        voting_pixmap.fill(Qt.transparent)
+        painter = QPainter(voting_pixmap)
+        font = painter.font()
+        font.setBold(True)
+        font.setPixelSize(28)
+        painter.setFont(font)
+        painter.drawRect(4, 12, 56, 40)
+        painter.drawText(voting_pixmap.rect(), Qt.AlignCenter, "k/n")
+        painter.end()
+        self.voting_gate_icon = QIcon(voting_pixmap)
+        self.voting_gate_button = DepQAction(
+            self.voting_gate_icon, "Add Voting Gate", self.dep_toolbar, self.system_vis_scene, self
+        )
+
         # Eraser button
         self.eraser_icon = QIcon(os.path.join(self.IMAGES_PATH, "eraser.png"))
         self.eraser_button = DepQAction(
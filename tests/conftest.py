@@ -0,0 +1,138 @@
+import random
+import itertools
+import numpy as np
+from graph.dep_graph import DepGraph
+
+# Helpers shared by the tests. References are always fresh graphs
+# that had the same edits made to them, never copies of the graph
+# under test, so they can't inherit anything its incremental updates
+# got wrong
+
+# A DepGraph that logs every edit made to it, so that replay() can
+# make them again on a fresh graph. Only the outermost call is
+# logged, since add_edges() and the like go through add_edge()
+class RecordedGraph(DepGraph):
+    EDITS = ("add_vertex", "add_vertices", "add_AND_gate", "add_voting_gate", "set_vote_k",
+             "add_edge", "add_edges", "update_edge", "update_edges", "update_vertex",
+             "delete_edge", "delete_edges", "delete_vertex", "delete_vertices", "set_engine")
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.init_args = (args, kwargs)
+        self.log = []
+        self.in_edit = False
+
+    # A fresh DepGraph with every logged edit made to it in order, and
+    # nothing else. The closure engine's closure depends on the order
+    # edges go in, but not on when risks are asked for
+    def replay(self) -> DepGraph:
+        args, kwargs = self.init_args
+        fresh = DepGraph(*args, **kwargs)
+        for name, args, kwargs in self.log:
+            getattr(fresh, name)(*args, **kwargs)
+        return fresh
+
+def logged(name: str):
+    def edit(self, *args, **kwargs):
+        if self.in_edit:
+            return getattr(DepGraph, name)(self, *args, **kwargs)
+        self.log.append((name, args, kwargs))
+        self.in_edit = True
+        try:
+            return getattr(DepGraph, name)(self, *args, **kwargs)
+        finally:
+            self.in_edit = False
+    return edit
+
+for name in RecordedGraph.EDITS:
+    setattr(RecordedGraph, name, logged(name))
+
+# Random components and AND gates without any edges, with the closure
+# built so that every edge after this goes through add_edge_i()
+def random_vertices(rng: random.Random, n: int) -> DepGraph:
+    dg = DepGraph()
+    for k in range(n):
+        if rng.random() < 0.25:
+            dg.add_AND_gate(k)
+        else:
+            dg.add_vertex(k, rng.random() * 0.3)
+    dg.calc_Ac_full()
+    return dg
+
+# Random graph of components, AND gates and voting gates, with
+# edge_count tries at adding an edge. With forward the edges only go
+# from earlier keys to later ones, so the graph stays acyclic, and
+# with calc_r_chance risks are worked out now and then along the way
+def random_graph(seed: int, engine: str="closure", keys: list=None, n: int=14,
+                 edge_count: int=25, AND_chance: float=0.2, vote_chance: float=0,
+                 forward: bool=False, calc_r_chance: float=0) -> RecordedGraph:
+    rng = random.Random(seed)
+    keys = list(range(n)) if keys is None else keys
+    dg = RecordedGraph(engine=engine)
+    for k in keys:
+        u = rng.random()
+        if u < vote_chance:
+            dg.add_voting_gate(k, rng.choice([1, 2]))
+        elif u < vote_chance + AND_chance:
+            dg.add_AND_gate(k)
+        else:
+            dg.add_vertex(k, rng.random() * 0.3)
+
+    for _ in range(edge_count):
+        i, j = rng.sample(range(len(keys)), 2)
+        if forward and i > j:
+            i, j = j, i
+        if dg.refi[keys[j]] not in dg.succ[dg.refi[keys[i]]]:
+            dg.add_edge((keys[i], keys[j]), rng.choice([1, 0.5]))
+        if rng.random() < calc_r_chance:
+            dg.calc_r()
+    return dg
+
+# Risks of every vertex worked out from scratch on dg.replay(), by
+# dg's slots
+def full_r(dg: RecordedGraph) -> np.ndarray:
+    fresh = dg.replay()
+    r_fresh = fresh.calc_r()
+    r = np.zeros(dg.n)
+    for key, i in dg.refi.items():
+        r[i] = r_fresh[fresh.refi[key]]
+    return r
+
+# Exact failure probability of every slot, summed over every way the
+# direct failures and edge transmissions can turn out, with failures
+# spread to the least fixed point in each. Only for graphs small
+# enough to enumerate
+def enumerated_r(dg: DepGraph) -> np.ndarray:
+    slots = np.flatnonzero(dg.active[:dg.n]).tolist()
+    events = [ (v, dg.r0[v]) for v in slots if not dg.is_AND[v] ]
+    events += [ ((a, b), w) for a, out_edges in dg.succ.items() for b, w in out_edges.items() ]
+    uncertain = [ (event, p) for event, p in events if 0 < p < 1 ]
+    happens = { event : 1 <= p for event, p in events }
+
+    r = np.zeros(dg.n)
+    for outcome in itertools.product((False, True), repeat=len(uncertain)):
+        weight = 1.0
+        for (event, p), happened in zip(uncertain, outcome):
+            happens[event] = happened
+            weight *= p if happened else 1 - p
+
+        fail = dict.fromkeys(slots, False)
+        changed = True
+        while changed:
+            changed = False
+            for v in slots:
+                inputs = [ fail[a] and happens[(a, v)] for a in dg.pred[v] ]
+                if dg.vote_k[v] > 0:
+                    new = sum(inputs) >= dg.vote_k[v]
+                elif dg.is_AND[v]:
+                    new = bool(inputs) and all(inputs)
+                else:
+                    new = happens[v] or any(inputs)
+                if new != fail[v]:
+                    fail[v] = new
+                    changed = True
+
+        for v in slots:
+            if fail[v]:
+                r[v] += weight
+    return r
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from graph.dep_graph import DepGraph
+from graph.bdd import BDDEvaluator
+from conftest import enumerated_r, random_graph
+
+@pytest.mark.parametrize("forward", (False, True))
+@pytest.mark.parametrize("seed", range(15))
+def test_matches_enumeration(seed: int, forward: bool):
+    dg = random_graph(seed, n=7, edge_count=10, vote_chance=0.15, forward=forward)
+    assert np.allclose(dg.calc_r_exact(), enumerated_r(dg), rtol=0, atol=1e-12)
+
+# Edits only re-evaluate or recompile the BDD, and either
+# way it has to keep up
+def test_keeps_up_with_edits():
+    dg = DepGraph()
+    dg.add_vertices(['a', 'b', 'c', 'd'], [0.25] * 4)
+    dg.add_edges([('a', 'b'), ('a', 'c'), ('b', 'd'), ('c', 'd')], [0.5] * 4)
+    exact = BDDEvaluator(dg)
+    assert np.allclose(exact.calc_r(), enumerated_r(dg), rtol=0, atol=1e-12)
+
+    dg.update_vertex('a', 0.5)
+    dg.update_edge(('b', 'd'), 0.9)
+    assert np.allclose(exact.calc_r(), enumerated_r(dg), rtol=0, atol=1e-12)
+
+    dg.update_edge(('c', 'd'), 1)
+    dg.add_AND_gate('G')
+    dg.add_edges([('b', 'G'), ('c', 'G')], [0.5, 1])
+    assert np.allclose(exact.calc_r(), enumerated_r(dg), rtol=0, atol=1e-12)
+
+# Every column of r0 evaluated together, as if one at a time
+def test_batched_direct_risks():
+    dg = random_graph(3, n=7, edge_count=10, forward=True)
+    exact = BDDEvaluator(dg)
+    r0 = np.random.default_rng(0).uniform(0, 0.5, (dg.n, 4))
+    batched = exact.calc_r(r0)
+    for k in range(4):
+        assert np.allclose(batched[:, k], exact.calc_r(r0[:, k]), rtol=0, atol=1e-15)
@@ -0,0 +1,254 @@
+import random
+import numpy as np
+import pytest
+from graph.dep_graph import DepGraph
+from conftest import RecordedGraph, full_r, random_vertices
+
+# The closure update add_edge_i() replaced, one cell at a time, on
+# copies of A_tc and one_count
+def scalar_add_edge(A_tc: np.ndarray, one_count: np.ndarray, is_AND: np.ndarray,
+                    a: int, b: int, weight: float) -> None:
+    n = len(is_AND)
+    or_scl = lambda x, y: 1 - (1 - x) * (1 - y)
+    if 1 == weight:
+        one_count[b, a] += 1
+    else:
+        A_tc[b, a] = or_scl(A_tc[b, a], weight)
+    Ac_full = np.maximum(A_tc, one_count > 0)
+
+    for i in range(n):
+        if i == b or (is_AND[b] and not is_AND[i]):
+            continue
+        new_path = weight
+        if not is_AND[b] or is_AND[a]:
+            new_path *= Ac_full[i, b]
+        if 1 == new_path:
+            one_count[i, a] += 1
+        else:
+            A_tc[i, a] = or_scl(A_tc[i, a], new_path)
+    A_tc[a, a] = 0
+    one_count[a, a] = 0
+
+    for j in range(n):
+        if j in (a, b):
+            continue
+        for i in range(n):
+            if i == a or (is_AND[a] and not is_AND[i]):
+                continue
+            new_path = Ac_full[a, j]
+            if not is_AND[a] or is_AND[j]:
+                new_path *= Ac_full[i, a]
+            if 1 == new_path:
+                one_count[i, j] += 1
+            else:
+                A_tc[i, j] = or_scl(A_tc[i, j], new_path)
+    np.fill_diagonal(A_tc, 0)
+    np.fill_diagonal(one_count, 0)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_add_edge_matches_the_scalar_update(seed: int):
+    rng = random.Random(seed)
+    dg = random_vertices(rng, 12)
+    n = dg.n
+    A_tc = np.zeros((n, n))
+    one_count = np.zeros((n, n), np.uint64)
+    for _ in range(30):
+        a, b = rng.sample(range(n), 2)
+        if b in dg.succ[a]:
+            continue
+        weight = rng.choice([1, 0.5, 0.3])
+        dg.add_edge_i((a, b), weight)
+        scalar_add_edge(A_tc, one_count, dg.is_AND[:n], a, b, weight)
+        assert np.allclose(dg.A_tc[:n, :n], A_tc, rtol=0, atol=1e-12)
+        assert np.array_equal(dg.one_count[:n, :n], one_count)
+
+# Random edges for from_arrays(), cycles included
+def random_arrays(rng: random.Random, n: int, count: int) -> tuple:
+    edges = {}
+    for _ in range(count):
+        edges[tuple(rng.sample(range(n), 2))] = rng.choice([1, 0.5, 0.3])
+    is_AND = np.array([ rng.random() < 0.25 for _ in range(n) ])
+    r0 = np.array([ rng.random() * 0.3 for _ in range(n) ])
+    return np.array(list(edges), np.intp).reshape(-1, 2), np.array(list(edges.values())), r0, is_AND
+
+def one_by_one(n: int, edges: list[tuple[int]], weights: dict, r0: np.ndarray,
+               is_AND: np.ndarray) -> DepGraph:
+    dg = DepGraph()
+    for k in range(n):
+        if is_AND[k]:
+            dg.add_AND_gate(k)
+        else:
+            dg.add_vertex(k, r0[k])
+    dg.calc_r()
+    for a, b in edges:
+        dg.add_edge_i((a, b), weights[(a, b)])
+    return dg
+
+def assert_same_closure(dg: DepGraph, other: DepGraph, atol: float) -> None:
+    n = dg.n
+    assert np.allclose(dg.A_tc[:n, :n], other.A_tc[:n, :n], rtol=0, atol=atol)
+    assert np.array_equal(dg.one_count[:n, :n], other.one_count[:n, :n])
+    assert np.allclose(dg.calc_r(), other.calc_r(), rtol=0, atol=atol)
+
+# from_arrays() adds all edges out of a vertex at once, which has to
+# give what adding them one at a time in closure_edge_order() does
+@pytest.mark.parametrize("seed", range(30))
+def test_from_arrays_matches_edges_one_by_one(seed: int):
+    rng = random.Random(seed)
+    n = 14
+    edges, weights, r0, is_AND = random_arrays(rng, n, rng.choice([10, 20, 40]))
+    built = DepGraph.from_arrays(list(range(n)), edges, weights, r0, is_AND)
+    weights = { tuple(e) : w for e, w in zip(edges.tolist(), weights.tolist()) }
+    dg = one_by_one(n, built.closure_edge_order(), weights, r0, is_AND)
+    assert_same_closure(built, dg, 1e-12)
+
+@pytest.mark.parametrize("seed", range(10))
+def test_from_arrays_can_keep_the_given_order(seed: int):
+    rng = random.Random(seed)
+    n = 12
+    edges, weights, r0, is_AND = random_arrays(rng, n, 30)
+    built = DepGraph.from_arrays(list(range(n)), edges, weights, r0, is_AND, keep_order=True)
+    weights = { tuple(e) : w for e, w in zip(edges.tolist(), weights.tolist()) }
+    dg = one_by_one(n, list(weights), weights, r0, is_AND)
+    assert_same_closure(built, dg, 0)
+
+@pytest.mark.parametrize("engine", DepGraph.ENGINES)
+@pytest.mark.parametrize("seed", range(20))
+def test_incremental_risks_match_full_recomputation(engine: str, seed: int):
+    rng = random.Random(seed)
+    dg = RecordedGraph(engine=engine)
+    for k in range(14):
+        u = rng.random()
+        if u < 0.15:
+            dg.add_voting_gate(k, rng.choice([1, 2]))
+        elif u < 0.3:
+            dg.add_AND_gate(k)
+        else:
+            dg.add_vertex(k, rng.random() * 0.3)
+    dg.calc_r()
+    for _ in range(40):
+        a, b = rng.sample(range(14), 2)
+        u = rng.random()
+        if b not in dg.succ[dg.refi[a]]:
+            dg.add_edge((a, b), rng.choice([1, 0.5]))
+        elif u < 0.5:
+            dg.update_edge((a, b), rng.choice([1, 0.4, 0]))
+        else:
+            dg.update_vertex(a, rng.random() * 0.3)
+        if rng.random() < 0.3:
+            r = dg.calc_r().copy()
+            # The closure engine's r means nothing for gates
+            rows = ~dg.is_AND[:dg.n] if "closure" == engine else slice(None)
+            assert np.allclose(r[rows], full_r(dg)[rows], rtol=0, atol=1e-9)
+
+# Asking for risks between edges used to build the closure at that
+# point, in one pass, instead of edge by edge
+@pytest.mark.parametrize("seed", range(20))
+def test_queries_between_edges_dont_change_the_closure(seed: int):
+    rng = random.Random(seed)
+    edges = []
+    for _ in range(30):
+        a, b = rng.sample(range(12), 2)
+        edges.append(((a, b), rng.choice([1, 0.5, 0.3])))
+    is_AND = [ rng.random() < 0.25 for _ in range(12) ]
+
+    graphs = []
+    for eager in (False, True):
+        dg = DepGraph()
+        for k in range(12):
+            if is_AND[k]:
+                dg.add_AND_gate(k)
+            else:
+                dg.add_vertex(k, 0.2)
+        for edge, weight in edges:
+            if eager:
+                dg.calc_r()
+            if edge[1] not in dg.succ[edge[0]]:
+                dg.add_edge(edge, weight)
+        graphs.append(dg)
+
+    lazy, eager = graphs
+    n = lazy.n
+    assert np.array_equal(lazy.A_tc[:n, :n], eager.A_tc[:n, :n])
+    assert np.array_equal(lazy.one_count[:n, :n], eager.one_count[:n, :n])
+    assert np.array_equal(lazy.calc_r(), eager.calc_r())
+
+def test_chain_risk_doesnt_depend_on_when_it_was_asked_for():
+    risks = []
+    for eager in (False, True):
+        dg = DepGraph()
+        dg.add_vertices(['a', 'b', 'c', 'd'], [0.1, 0.2, 0.15, 0.05])
+        if eager:
+            dg.calc_r()
+        dg.add_edges([('a', 'b'), ('b', 'c'), ('a', 'c'), ('c', 'd')], [1, 1, 1, 0.5])
+        risks.append(dg.get_total_risk('d'))
+    assert risks[0] == risks[1]
+
+def test_closure_engine_stops_at_its_limit(monkeypatch):
+    monkeypatch.setattr(DepGraph, "MAX_CLOSURE_VERTICES", 8)
+    dg = DepGraph(4)
+    dg.add_vertices(list(range(8)))
+    dg.delete_vertex(0, compact=False)
+    with pytest.raises(ValueError, match="topological"):
+        dg.add_vertices([8, 9])
+    # Nothing was taken, so the free slot is still there
+    assert 7 == dg.vertex_count and [0] == dg.free_slots
+    dg.add_vertex(8)
+    assert 8 == dg.capacity
+
+    big = DepGraph(engine="topological")
+    big.add_vertices(list(range(12)))
+    with pytest.raises(ValueError, match="topological"):
+        big.set_engine("closure")
+    big.delete_vertices(list(range(5)))
+    assert "closure" == big.set_engine("closure")
+    assert big.capacity <= 8
+
+# Random in-tree of components: every vertex but 0 feeds one earlier
+# one, so there's at most one path between any two vertices
+def random_tree(rng: random.Random, n: int) -> list[tuple]:
+    return [ ((k, rng.randrange(k)), rng.choice([1, 0.5, 0.3])) for k in range(1, n) ]
+
+def built_from(n: int, edges: list[tuple], r0: list[float]) -> DepGraph:
+    dg = DepGraph.from_arrays(list(range(n)), [ e for e, _ in edges ], [ w for _, w in edges ], r0)
+    dg.calc_r()
+    return dg
+
+# Removing a path with mat_or_inv() only undoes ORing it in exactly
+# when no other path shares its edges, which trees guarantee
+@pytest.mark.parametrize("seed", range(30))
+def test_update_and_revert_matches_a_fresh_build(seed: int):
+    rng = random.Random(seed)
+    n = 12
+    r0 = [ rng.random() * 0.3 for _ in range(n) ]
+    edges = random_tree(rng, n)
+    dg = built_from(n, edges, r0)
+    edge, weight = rng.choice(edges)
+    dg.update_edge_i(edge, rng.choice([1, 0.7, 0.2]))
+    dg.update_edge_i(edge, weight)
+    assert_same_closure(dg, built_from(n, edges, r0), 1e-12)
+
+@pytest.mark.parametrize("seed", range(30))
+def test_delete_matches_a_fresh_build(seed: int):
+    rng = random.Random(seed)
+    n = 12
+    r0 = [ rng.random() * 0.3 for _ in range(n) ]
+    edges = random_tree(rng, n)
+    dg = built_from(n, edges, r0)
+    k = rng.randrange(len(edges))
+    dg.delete_edge_i(edges[k][0])
+    assert_same_closure(dg, built_from(n, edges[:k] + edges[k + 1:], r0), 1e-12)
+
+# With shared paths the inverse is approximate, but whatever it
+# leaves behind is still a probability
+@pytest.mark.parametrize("seed", range(10))
+def test_updates_keep_the_closure_in_range(seed: int):
+    rng = random.Random(seed)
+    dg = random_vertices(rng, 14)
+    for _ in range(300):
+        a, b = sorted(rng.sample(range(14), 2))
+        dg.update_edge_i((a, b), rng.choice([0, 1, 0.999, 0.5, 0.1]))
+    n = dg.n
+    assert 0 <= dg.A_tc[:n, :n].min() and dg.A_tc[:n, :n].max() <= 1
+    r = dg.calc_r()
+    assert 0 <= r.min() and r.max() <= 1
@@ -0,0 +1,11 @@
+from graph.dep_graph import DepGraph
+from graph.cut_sets import CutSets
+
+def test_components_that_cant_fail_are_in_no_cut_set():
+    dg = DepGraph()
+    dg.add_vertices(['a', 'b', 'top'], [0, 0.1, 0])
+    dg.add_edges([('a', 'top'), ('b', 'top')])
+    cs = CutSets(dg)
+    cut_sets = [ cs.keys_of(c) for c in cs.generate('top') ]
+    assert cut_sets == [['b']]
+    assert all(cs.probability(c) > 0 for c in cs.generate('top'))
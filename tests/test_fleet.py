@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from graph.dep_graph import DepGraph
+
+def small_graph(engine: str) -> DepGraph:
+    dg = DepGraph(engine=engine)
+    dg.add_vertices(['a', 'b', 'c', 'd'], [0.1, 0.2, 0.3, 0.05])
+    dg.add_AND_gate('G')
+    dg.add_edges([('a', 'G'), ('b', 'G'), ('G', 'd'), ('c', 'd'), ('a', 'c')], [1, 1, 1, 0.5, 0.4])
+    return dg
+
+# Each copy's weights laid out like A
+def own_weights(dg: DepGraph, copies: int) -> np.ndarray:
+    weights = np.zeros((copies, dg.n, dg.n))
+    for a, out_edges in dg.succ.items():
+        for b, weight in out_edges.items():
+            weights[:, b, a] = weight
+    return weights
+
+def test_closure_engine_rejects_edge_weights():
+    dg = small_graph("closure")
+    r0 = np.tile(dg.r0[:dg.n], (3, 1))
+    with pytest.raises(ValueError, match="topological"):
+        dg.calc_r_fleet(r0, own_weights(dg, 3))
+
+def test_own_weights_match_the_shared_ones():
+    dg = small_graph("topological")
+    r0 = np.random.default_rng(0).uniform(0, 0.3, (5, dg.n))
+    r0[:, dg.is_AND[:dg.n]] = 0
+    assert np.allclose(dg.calc_r_fleet(r0, own_weights(dg, 5)), dg.calc_r_fleet(r0))
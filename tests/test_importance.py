@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from graph.dep_graph import DepGraph
+from conftest import RecordedGraph, random_graph
+
+# Risk of target on a fresh replay of dg, with the direct
+# risk of key set to r0 by hand
+def risk_with(dg: RecordedGraph, target, key, r0: float) -> float:
+    fresh = dg.replay()
+    fresh.update_vertex(key, r0)
+    return fresh.get_total_risk(target)
+
+@pytest.mark.parametrize("engine", DepGraph.ENGINES)
+@pytest.mark.parametrize("forward", (False, True))
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_one_component_at_a_time(engine: str, forward: bool, seed: int):
+    dg = random_graph(seed, engine, n=10, edge_count=18, forward=forward)
+    target = 9
+    base = dg.replay().get_total_risk(target)
+    importance = dg.calc_importance(target)
+    assert set(importance) == { k for k in range(10) if not dg.is_AND[dg.refi[k]] }
+
+    for key, (birnbaum, fussell_vesely, raw, rrw) in importance.items():
+        r_fail = risk_with(dg, target, key, 1)
+        r_ok = risk_with(dg, target, key, 0)
+        assert birnbaum == pytest.approx(r_fail - r_ok, abs=1e-12)
+        assert fussell_vesely == pytest.approx((base - r_ok) / base, abs=1e-9)
+        assert raw == pytest.approx(r_fail / base, rel=1e-9)
+        if r_ok > 0:
+            assert rrw == pytest.approx(base / r_ok, rel=1e-9)
+
+def test_series_and_parallel():
+    dg = DepGraph()
+    dg.add_vertices(['a', 'b', 'c', 't'], [0.1, 0.2, 0.3, 0])
+    dg.add_AND_gate('G')
+    # t fails if a does, or if b and c both do
+    dg.add_edges([('a', 't'), ('b', 'G'), ('c', 'G'), ('G', 't')])
+    importance = dg.calc_importance('t')
+    assert importance['a'][0] == pytest.approx(1 - 0.2 * 0.3)
+    assert importance['b'][0] == pytest.approx(0.9 * 0.3)
+    assert importance['t'][0] == pytest.approx(1 - 0.1 - 0.9 * 0.06)
@@ -0,0 +1,43 @@
+import random
+import numpy as np
+import pytest
+from graph.dep_graph import DepGraph
+from conftest import RecordedGraph, full_r
+
+def test_changed_AND_gate_input_reaches_the_query():
+    dg = DepGraph()
+    dg.add_vertices(['a', 'b', 't'], [0.5, 0.5, 0.1])
+    dg.add_AND_gate('G')
+    dg.add_edges([('a', 'G'), ('b', 'G'), ('G', 't')])
+    assert dg.get_total_risk('t') == pytest.approx(0.325)
+    dg.update_vertex('a', 0.9)
+    assert dg.get_total_risk('t') == pytest.approx(0.505)
+
+@pytest.mark.parametrize("engine", DepGraph.ENGINES)
+@pytest.mark.parametrize("seed", range(60))
+def test_lazy_matches_full_after_edits(engine: str, seed: int):
+    rng = random.Random(seed)
+    dg = RecordedGraph(engine=engine)
+    names = list(range(20))
+    for k in names:
+        if rng.random() < 0.3:
+            dg.add_AND_gate(k)
+        else:
+            dg.add_vertex(k, rng.random() * 0.5)
+
+    for _ in range(40):
+        a, b = rng.sample(names, 2)
+        ia = dg.refi[a]
+        if rng.random() < 0.7:
+            if dg.refi[b] not in dg.succ[ia]:
+                dg.add_edge((a, b), rng.choice([1, 0.5]))
+        elif rng.random() < 0.5 and dg.succ[ia]:
+            dg.update_edge((a, dg.iref[rng.choice(list(dg.succ[ia]))]), rng.choice([0, 1, 0.3]))
+        elif not dg.is_AND[ia]:
+            dg.update_vertex(a, rng.random() * 0.5)
+
+        q = rng.choice([ k for k in names if not dg.is_AND[dg.refi[k]] ])
+        assert dg.get_total_risk(q) == pytest.approx(full_r(dg)[dg.refi[q]], abs=1e-12)
+
+    # Whatever the queries left behind, a full update agrees too
+    assert np.allclose(dg.calc_r(), full_r(dg), atol=1e-12)
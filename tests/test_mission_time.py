@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from graph.dep_graph import DepGraph
+from conftest import random_graph
+
+TIMES = np.array([0, 10, 100, 500, 1000, 5000])
+
+# Weibull (location, scale, shape) for every third component
+def with_weibull(dg: DepGraph, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    params = {}
+    for key, i in sorted(dg.refi.items()):
+        if not dg.is_AND[i] and 0 == key % 3:
+            params[key] = (float(rng.uniform(0, 50)), float(rng.uniform(100, 2000)), float(rng.uniform(0.5, 3)))
+            dg.set_weibull(key, params[key])
+    return params
+
+@pytest.mark.parametrize("engine", DepGraph.ENGINES)
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_calc_r_at_each_time(engine: str, seed: int):
+    dg = random_graph(seed, engine, n=12, edge_count=20)
+    params = with_weibull(dg, seed)
+    swept = dg.calc_r_at(TIMES)
+
+    for k, t in enumerate(TIMES.tolist()):
+        # A fresh graph with every distribution evaluated at t
+        fresh = dg.replay()
+        for key, p in params.items():
+            fresh.set_weibull(key, p, mission_time=t)
+        r = fresh.calc_r()
+        for key, i in dg.refi.items():
+            assert swept[k, i] == pytest.approx(r[fresh.refi[key]], abs=1e-9)
+
+def test_rows_and_crossing_time():
+    dg = DepGraph()
+    dg.add_vertices(['a', 'b'], [0, 0.1])
+    dg.add_edge(('a', 'b'))
+    # Exponential with a mean of 1000 hours
+    dg.set_weibull('a', (0, 1000, 1))
+    r = dg.calc_r_at(TIMES, dg.refi['b'])[:, 0]
+    assert r == pytest.approx(1 - 0.9 * np.exp(-TIMES / 1000))
+
+    # 1 - 0.9 exp(-t / 1000) = 0.5 at t = 1000 ln 1.8
+    t = dg.crossing_time('b', 0.5, np.linspace(0, 2000, 2001))
+    assert t == pytest.approx(1000 * np.log(1.8), abs=0.1)
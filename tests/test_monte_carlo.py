@@ -0,0 +1,36 @@
+import pytest
+from graph.dep_graph import DepGraph
+from graph.monte_carlo import MonteCarlo
+from conftest import enumerated_r, random_graph
+
+# Small graphs of every kind of vertex, cycles included, whose
+# estimates have to bracket the exact risks
+@pytest.mark.parametrize("forward", (False, True))
+@pytest.mark.parametrize("seed", range(5))
+def test_estimates_bracket_the_exact_risks(seed: int, forward: bool):
+    dg = random_graph(seed, n=6, edge_count=8, vote_chance=0.15, forward=forward)
+    exact = enumerated_r(dg)
+    res = MonteCarlo(dg, workers=1, seed=seed).run(1 << 16, confidence=0.999)
+    for key, (p, lo, hi) in res.as_dict().items():
+        i = dg.refi[key]
+        assert lo <= exact[i] <= hi
+        assert p == pytest.approx(exact[i], abs=0.02)
+
+def test_system_is_any_target_failing():
+    dg = DepGraph()
+    dg.add_vertices(['a', 'b', 'c'], [0.2, 0.3, 0])
+    dg.add_edges([('a', 'c'), ('b', 'c')], [0.5, 0.5])
+    res = MonteCarlo(dg, workers=1, seed=0).run(1 << 16, targets=['a', 'b'], confidence=0.999)
+    assert res.system_lo <= 1 - 0.8 * 0.7 <= res.system_hi
+
+# Plain sampling would never see 1e-8 in this many trials
+def test_biased_estimate_brackets_a_rare_event():
+    dg = DepGraph()
+    dg.add_vertices(['x', 'y', 'top'], [1e-4, 1e-4, 0])
+    dg.add_AND_gate('AND')
+    dg.add_edges([('x', 'AND'), ('y', 'AND'), ('AND', 'top')])
+    exact = enumerated_r(dg)[dg.refi['top']]
+    res = MonteCarlo(dg, workers=1, seed=0).run(1 << 18, targets=['top'], bias=2000, confidence=0.999)
+    assert exact == pytest.approx(1e-8)
+    assert res.system_lo <= exact <= res.system_hi
+    assert res.system_p == pytest.approx(exact, rel=0.1)
@@ -0,0 +1,19 @@
+import numpy as np
+from graph import or_algebra
+
+def test_mat_or_vec_matches_the_product_form():
+    rng = np.random.default_rng(0)
+    a = np.where(rng.random((300, 300)) < 0.3, rng.choice([1, 0.5, 0.25], (300, 300)), 0)
+    v = rng.random((300, 4)) * 0.2
+    v[7] = 1
+    expected = np.stack([ 1 - np.prod(1 - a * v[:, k], axis=1) for k in range(4) ], axis=1)
+    assert np.allclose(or_algebra.mat_or_vec(a, v, block_rows=64), expected, rtol=0, atol=1e-13)
+    assert np.allclose(or_algebra.mat_or_vec(a, v[:, 0]), expected[:, 0], rtol=0, atol=1e-13)
+
+def test_mat_or_vec_keeps_rare_events():
+    a = np.array([[0.5, 0], [0.9, 0.5], [1, 0]])
+    v = np.array([1e-18, 1e-12])
+    r = or_algebra.mat_or_vec(a, v)
+    assert np.allclose(r, [5e-19, 0.9e-18 + 5e-13, 1e-18], rtol=1e-12, atol=0)
+    assert np.allclose(or_algebra.mat_or_vec(np.array([[0.9]]), [1e-12]), 9e-13, rtol=1e-12, atol=0)
+    assert np.allclose(or_algebra.mat_or_mat(a, np.stack([v, v], axis=1))[:, 1], r, rtol=1e-12, atol=0)
@@ -0,0 +1,85 @@
+import random
+import numpy as np
+import pytest
+from graph.dep_graph import DepGraph
+from graph.reach import ReachIndex
+
+# [a, b] = whether a path of one or more edges leads from a to b,
+# found by searching from every vertex
+def searched(succ: dict, n: int) -> np.ndarray:
+    reach = np.zeros((n, n), bool)
+    for a in succ:
+        stack = list(succ[a])
+        while stack:
+            v = stack.pop()
+            if not reach[a, v]:
+                reach[a, v] = True
+                stack.extend(succ[v])
+    return reach
+
+def index_matrix(index: ReachIndex, n: int) -> np.ndarray:
+    return np.array([ [ index.reaches(a, b) for b in range(n) ] for a in range(n) ], bool)
+
+# More than two words to a row, so bits cross word boundaries
+@pytest.mark.parametrize("seed", range(5))
+def test_added_edges_match_search(seed: int):
+    rng = random.Random(seed)
+    n = 150
+    index = ReachIndex(n)
+    succ = { a : set() for a in range(n) }
+    for _ in range(200):
+        a, b = rng.sample(range(n), 2)
+        succ[a].add(b)
+        index.add_edge(a, b, n)
+    expected = searched(succ, n)
+    assert np.array_equal(index_matrix(index, n), expected)
+
+    slots = rng.sample(range(n), 5)
+    assert np.array_equal(index.descendants(slots, n), expected[slots].any(axis=0))
+    for b in slots:
+        assert np.array_equal(index.ancestors(b, n), expected[:, b])
+
+@pytest.mark.parametrize("seed", range(5))
+def test_rebuild_and_compact_match_search(seed: int):
+    rng = random.Random(seed)
+    dg = DepGraph(engine="topological")
+    n = 100
+    dg.add_vertices(list(range(n)))
+    for _ in range(150):
+        a, b = rng.sample(range(n), 2)
+        dg.add_edge((a, b))
+    index = ReachIndex(n)
+    index.rebuild(dg.strongly_connected_components(), dg.succ, n)
+    expected = searched(dg.succ, n)
+    assert np.array_equal(index_matrix(index, n), expected)
+
+    keep = np.array(sorted(rng.sample(range(n), 60)))
+    index.compact(keep, n)
+    assert np.array_equal(index_matrix(index, 60), expected[np.ix_(keep, keep)])
+
+# Whatever the edits, DepGraph.reaches() answers like a search would,
+# from the index while it's exact and by searching once it isn't
+@pytest.mark.parametrize("engine", DepGraph.ENGINES)
+@pytest.mark.parametrize("seed", range(10))
+def test_graph_reaches_matches_search(engine: str, seed: int):
+    rng = random.Random(seed)
+    dg = DepGraph(engine=engine)
+    dg.add_vertices(list(range(30)))
+    for step in range(80):
+        keys = list(dg.refi)
+        a, b = rng.sample(keys, 2)
+        u = rng.random()
+        if u < 0.7:
+            if dg.refi[b] not in dg.succ[dg.refi[a]]:
+                dg.add_edge((a, b), rng.choice([1, 0.5]))
+        elif u < 0.9 and dg.succ[dg.refi[a]]:
+            dg.delete_edge((a, dg.iref[next(iter(dg.succ[dg.refi[a]]))]))
+        elif len(keys) > 10:
+            dg.delete_vertex(a)
+
+        if 0 == step % 10:
+            n = dg.n
+            expected = searched(dg.succ, n)
+            for a in dg.refi:
+                for b in dg.refi:
+                    assert dg.reaches(a, b) == expected[dg.refi[a], dg.refi[b]]
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from graph.dep_graph import DepGraph
+from graph.redundancy import RedundancyOptimizer, apply_plan, target_risks
+from conftest import RecordedGraph, random_graph
+
+# Keys that can't be pickled, like the GUI's items
+class Item:
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __reduce__(self):
+        raise TypeError("Items can't be pickled")
+
+# Forward edges only, so the sweep has an order
+def forward_graph(engine: str, seed: int, keys: list=None) -> RecordedGraph:
+    return random_graph(seed, engine, keys, forward=True)
+
+@pytest.mark.parametrize("engine", DepGraph.ENGINES)
+@pytest.mark.parametrize("seed", range(10))
+def test_scores_match_full_recomputation(engine: str, seed: int):
+    dg = forward_graph(engine, seed)
+    optimizer = RedundancyOptimizer(dg, 13, workers=1)
+    g = optimizer.graph
+    r0 = g.r0[:g.n].copy()
+    assert target_risks(g, optimizer.target, r0[:, None])[0] == pytest.approx(dg.get_total_risk(13))
+
+    which = np.ones(len(optimizer.slots), bool)
+    columns = np.repeat(r0[:, None], len(optimizer.slots), axis=1)
+    columns[optimizer.slots, np.arange(len(optimizer.slots))] *= optimizer.spare_risks
+    expected = target_risks(g, optimizer.target, columns)
+    assert np.allclose(optimizer.score(r0, which), expected)
+
+@pytest.mark.parametrize("engine", DepGraph.ENGINES)
+@pytest.mark.parametrize("seed", range(10))
+def test_plan_risk_is_what_apply_plan_gives(engine: str, seed: int):
+    dg = forward_graph(engine, seed)
+    plans = RedundancyOptimizer(dg, 13, workers=1).optimize(budget=3)
+    if not plans:
+        return
+    apply_plan(dg, plans[0])
+    assert dg.get_total_risk(13) == pytest.approx(plans[0].risk)
+
+def test_workers_only_get_arrays():
+    keys = [ Item(str(i)) for i in range(14) ]
+    dg = forward_graph("closure", 3, keys)
+    serial = RedundancyOptimizer(dg, keys[13], workers=1).optimize(budget=2)
+    parallel = RedundancyOptimizer(dg, keys[13], workers=2)
+    parallel.MIN_PARALLEL_CANDIDATES = 1
+    plans = parallel.optimize(budget=2)
+    assert [ p.keys for p in plans ] == [ p.keys for p in serial ]
+    assert np.allclose([ p.risk for p in plans ], [ p.risk for p in serial ])
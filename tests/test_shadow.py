@@ -0,0 +1,86 @@
+import random
+import pytest
+from graph.dep_graph import DepGraph
+from conftest import random_vertices
+
+# Adding edges is what the replay does too, so any order of them,
+# cycles and AND gates included, has nothing to report
+@pytest.mark.parametrize("seed", range(20))
+def test_added_edges_never_diverge(seed: int):
+    rng = random.Random(seed)
+    dg = random_vertices(rng, 12)
+    shadow = dg.enable_shadow(check_every=1)
+    for _ in range(30):
+        a, b = rng.sample(range(12), 2)
+        if b not in dg.succ[a]:
+            dg.add_edge((a, b), rng.choice([1, 0.5, 0.3]))
+    assert shadow.checks > 0
+    assert 0 == shadow.failures
+    assert 0 == shadow.max_divergence
+
+# Enabling rebuilds the closure, so edges added before then don't
+# count as divergence either
+@pytest.mark.parametrize("seed", range(10))
+def test_edges_from_before_enabling_are_replayed(seed: int):
+    rng = random.Random(seed)
+    dg = random_vertices(rng, 12)
+    for _ in range(20):
+        a, b = rng.sample(range(12), 2)
+        if b not in dg.succ[a]:
+            dg.add_edge((a, b), rng.choice([1, 0.5]))
+    shadow = dg.enable_shadow(check_every=1)
+    for _ in range(10):
+        a, b = rng.sample(range(12), 2)
+        if b not in dg.succ[a]:
+            dg.add_edge((a, b), rng.choice([1, 0.5]))
+    assert 0 == shadow.failures
+
+# Without shared paths, updates and deletions are exact inverses, so
+# a tree stays in step with the replay however its edges change, and
+# through compaction, which moves every slot
+def test_tree_edits_stay_in_step():
+    rng = random.Random(0)
+    dg = DepGraph()
+    dg.add_vertices(list(range(30)), [ rng.random() * 0.3 for _ in range(30) ])
+    shadow = dg.enable_shadow(check_every=1)
+    for k in range(1, 30):
+        dg.add_edge((k, rng.randrange(k)), rng.choice([1, 0.5, 0.3]))
+    for _ in range(30):
+        a = rng.randrange(1, 30)
+        if a in dg.refi:
+            b = dg.iref[next(iter(dg.succ[dg.refi[a]]))]
+            dg.update_edge((a, b), rng.choice([1, 0.7, 0.2]))
+    dg.delete_vertices(list(range(10, 30)))
+    assert dg.compactions > 0
+    dg.add_vertex('new', 0.1)
+    dg.add_edge(('new', 0), 0.5)
+    assert 0 == shadow.failures
+    assert shadow.max_divergence < 1e-12
+
+def test_closure_out_of_range_is_reported_and_resynced():
+    dg = DepGraph()
+    dg.add_vertices(['a', 'b', 'c', 'd'], [0.1, 0.2, 0.3, 0.4])
+    shadow = dg.enable_shadow(check_every=1, resync=True)
+    dg.add_edges([('a', 'b'), ('b', 'c')], [0.5, 0.5])
+    a, c = dg.refi['a'], dg.refi['c']
+    dg.A_tc[c, a] = -4.5e10
+    dg.Ac_full_dirty = True
+    dg.add_edge(('c', 'd'), 0.5)
+
+    assert 1 == shadow.failures
+    assert shadow.last["A_tc_out_of_range"] > 0
+    assert 1 == shadow.resyncs
+    assert dg.A_tc[c, a] == pytest.approx(0.25)
+    assert 0 <= dg.get_total_risk('d') <= 1
+
+def test_switching_engines_starts_the_log_over():
+    dg = DepGraph()
+    dg.add_vertices(list(range(6)), [0.1] * 6)
+    shadow = dg.enable_shadow(check_every=1)
+    dg.add_edges([(0, 1), (1, 2)], [0.5, 1])
+    dg.set_engine("topological")
+    dg.add_edges([(2, 3), (3, 4)], [1, 0.5])
+    dg.set_engine("closure")
+    dg.add_edges([(4, 5), (0, 3)], [0.5, 0.3])
+    assert 4 == shadow.checks
+    assert 0 == shadow.failures
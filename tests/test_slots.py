@@ -0,0 +1,83 @@
+import random
+import numpy as np
+import pytest
+from graph.dep_graph import DepGraph
+from conftest import RecordedGraph, full_r
+
+# Every way refi, iref, active, the free list and the adjacency have
+# to agree with each other
+def assert_consistent(dg: DepGraph) -> None:
+    n = dg.n
+    assert all(dg.iref[i] == key for key, i in dg.refi.items())
+    assert sorted(dg.refi.values()) == np.flatnonzero(dg.active[:n]).tolist()
+    assert sorted(dg.free_slots) == np.flatnonzero(~dg.active[:n]).tolist()
+    assert all(dg.iref[i] is None for i in dg.free_slots)
+    assert sorted(dg.succ) == sorted(dg.pred) == sorted(dg.refi.values())
+    for a, out_edges in dg.succ.items():
+        for b, weight in out_edges.items():
+            assert dg.pred[b][a] == weight
+
+@pytest.mark.parametrize("engine", DepGraph.ENGINES)
+def test_deleted_slot_is_reused_clean(engine: str):
+    dg = DepGraph(engine=engine)
+    dg.add_vertices(list("abcdef"), [0.1, 0.2, 0.3, 0.4, 0.5, 0.6])
+    dg.add_edges([('a', 'c'), ('c', 'e'), ('b', 'c')], [1, 0.5, 1])
+    dg.calc_r()
+    c = dg.refi['c']
+    dg.delete_vertex('c', compact=False)
+    assert [c] == dg.free_slots
+
+    dg.add_vertex('g', 0.05)
+    assert c == dg.refi['g']
+    assert 6 == dg.n
+    assert not dg.free_slots
+    assert not dg.succ[c] and not dg.pred[c]
+    assert dg.get_r_dict()['g'] == pytest.approx(0.05)
+    assert dg.get_r_dict()['e'] == pytest.approx(0.5)
+    assert_consistent(dg)
+
+@pytest.mark.parametrize("engine", DepGraph.ENGINES)
+@pytest.mark.parametrize("seed", range(10))
+def test_compaction_keeps_risks_and_keys(engine: str, seed: int):
+    rng = random.Random(seed)
+    dg = RecordedGraph(engine=engine)
+    keys = [ f"v{k}" for k in range(20) ]
+    dg.add_vertices(keys, [ rng.random() * 0.3 for _ in keys ])
+    for _ in range(40):
+        a, b = rng.sample(keys, 2)
+        if dg.refi[b] not in dg.succ[dg.refi[a]]:
+            dg.add_edge((a, b), rng.choice([1, 0.5]))
+    doomed = rng.sample(keys, 8)
+    dg.delete_vertices(doomed[:4])
+    for key in doomed[4:]:
+        dg.delete_vertex(key, compact=False)
+    before = dg.get_r_dict()
+    edges = { (dg.iref[a], dg.iref[b]) : w for a, out_edges in dg.succ.items() for b, w in out_edges.items() }
+
+    dg.compact()
+    assert 12 == dg.n
+    assert_consistent(dg)
+    assert set(dg.refi) == set(keys) - set(doomed)
+    assert dg.get_r_dict() == pytest.approx(before, abs=1e-12)
+    assert edges == { (dg.iref[a], dg.iref[b]) : w for a, out_edges in dg.succ.items() for b, w in out_edges.items() }
+    assert np.allclose(dg.calc_r(), full_r(dg), atol=1e-12)
+
+# Adds and deletes in any mix, with the free list compacted whenever
+# it passes the threshold, never leave the bookkeeping inconsistent
+@pytest.mark.parametrize("seed", range(10))
+def test_slots_stay_consistent(seed: int):
+    rng = random.Random(seed)
+    dg = DepGraph()
+    next_key = 0
+    for _ in range(200):
+        if dg.refi and rng.random() < 0.4:
+            dg.delete_vertex(rng.choice(list(dg.refi)), compact=rng.random() < 0.5)
+        elif len(dg.refi) > 1 and rng.random() < 0.5:
+            a, b = rng.sample(list(dg.refi), 2)
+            if dg.refi[b] not in dg.succ[dg.refi[a]]:
+                dg.add_edge((a, b), rng.choice([1, 0.5]))
+        else:
+            dg.add_vertex(next_key, rng.random() * 0.3)
+            next_key += 1
+        assert_consistent(dg)
+    assert dg.compactions > 0
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from graph.dep_graph import DepGraph
+from graph import snapshot
+from conftest import full_r, random_graph
+
+def edges_by_key(dg: DepGraph) -> dict:
+    return { (dg.iref[a], dg.iref[b]) : w for a, out_edges in dg.succ.items() for b, w in out_edges.items() }
+
+# Voting gates, Weibull distributions and free slots, which
+# the snapshot has to compact away
+def saved_graph(engine: str, seed: int) -> DepGraph:
+    dg = random_graph(seed, engine, n=16, edge_count=30, vote_chance=0.1)
+    dg.set_weibull(0, (0, 500, 1.5))
+    dg.delete_vertices([3, 7])
+    return dg
+
+@pytest.mark.parametrize("mmap", (False, True))
+@pytest.mark.parametrize("engine", DepGraph.ENGINES)
+@pytest.mark.parametrize("seed", range(5))
+def test_round_trip_keeps_the_graph(engine: str, seed: int, mmap: bool, tmp_path):
+    dg = saved_graph(engine, seed)
+    r = dg.get_r_dict()
+    path = str(tmp_path / "graph.dg")
+    fingerprint = snapshot.save(dg, path)
+
+    loaded = snapshot.load(path, mmap, verify=True)
+    # Saving what was loaded gives the same file, before gate weights
+    # are worked out again
+    assert fingerprint == snapshot.save(loaded, str(tmp_path / "again.dg"))
+    assert engine == loaded.engine
+    assert set(loaded.refi) == set(dg.refi)
+    assert edges_by_key(loaded) == edges_by_key(dg)
+    for key, i in dg.refi.items():
+        j = loaded.refi[key]
+        assert loaded.r0[j] == dg.r0[i]
+        assert loaded.is_AND[j] == dg.is_AND[i]
+        assert loaded.vote_k[j] == dg.vote_k[i]
+        assert np.array_equal(loaded.weibull[j], dg.weibull[i])
+    assert loaded.get_r_dict() == pytest.approx(r, abs=1e-12)
+    # And the same as a fresh graph with the edits that built it
+    r_fresh = full_r(dg)
+    assert loaded.get_r_dict() == pytest.approx({ k : r_fresh[dg.refi[k]] for k in r }, abs=1e-12)
+
+def test_mapped_closure_is_copy_on_write(tmp_path):
+    dg = saved_graph("closure", 0)
+    path = str(tmp_path / "graph.dg")
+    snapshot.save(dg, path)
+    before = open(path, "rb").read()
+
+    loaded = snapshot.load(path, mmap=True)
+    assert isinstance(loaded.A_tc, np.memmap)
+    loaded.add_edge((1, 2) if 2 not in loaded.succ[loaded.refi[1]] else (2, 1), 0.5)
+    loaded.update_vertex(1, 0.9)
+    loaded.calc_r()
+    assert before == open(path, "rb").read()
+
+    # The edits show up on the loaded graph, just like on the original
+    dg.add_edge((1, 2) if 2 not in dg.succ[dg.refi[1]] else (2, 1), 0.5)
+    dg.update_vertex(1, 0.9)
+    assert loaded.get_r_dict() == pytest.approx(dg.get_r_dict(), abs=1e-12)
+
+def test_verify_catches_corruption(tmp_path):
+    dg = saved_graph("closure", 1)
+    path = str(tmp_path / "graph.dg")
+    snapshot.save(dg, path)
+    header, data_start = snapshot.read_header(path)
+
+    data = bytearray(open(path, "rb").read())
+    data[data_start + header["arrays"]["r0"]["offset"]] ^= 0xFF
+    open(path, "wb").write(bytes(data))
+    snapshot.load(path)
+    with pytest.raises(ValueError, match="fingerprint"):
+        snapshot.load(path, verify=True)
+
+def test_keys_that_json_cant_hold(tmp_path):
+    dg = DepGraph()
+    dg.add_vertices([('a', 1), ('b', 2)], [0.1, 0.2])
+    dg.add_edge((('a', 1), ('b', 2)), 0.5)
+    path = str(tmp_path / "graph.dg")
+    snapshot.save(dg, path)
+    assert set(snapshot.load(path).refi) == { ('a', 1), ('b', 2) }
+
+    dg.add_vertex(object(), 0.3)
+    with pytest.raises(TypeError):
+        snapshot.save(dg, path)
+    snapshot.save(dg, path, keys=["x", "y", "z"])
+    assert snapshot.load(path).get_r_dict() == pytest.approx({ "x" : 0.1, "y" : 1 - 0.8 * 0.95, "z" : 0.3 })
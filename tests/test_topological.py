@@ -0,0 +1,54 @@
+import random
+import numpy as np
+import pytest
+from graph.dep_graph import DepGraph
+
+# Same vertices as dg, with its edges added from scratch
+def rebuilt(dg: DepGraph) -> DepGraph:
+    fresh = DepGraph(engine="topological")
+    for i in np.flatnonzero(dg.active[:dg.n]).tolist():
+        if dg.is_AND[i]:
+            fresh.add_AND_gate(dg.iref[i])
+        else:
+            fresh.add_vertex(dg.iref[i], dg.r0[i])
+    for a, out_edges in dg.succ.items():
+        for b, weight in out_edges.items():
+            fresh.add_edge((dg.iref[a], dg.iref[b]), weight)
+    return fresh
+
+def test_edge_created_by_update_joins_the_order():
+    dg = DepGraph(engine="topological")
+    dg.add_vertices(['a', 'b', 'c'], [0.1, 0.2, 0.3])
+    dg.add_edge(('b', 'c'), 1)
+    dg.calc_r()
+    # a is ahead of c in the order, and c -> a has to move it after c
+    dg.update_edge(('c', 'a'), 1)
+    assert dg.get_r_dict() == pytest.approx({ 'a' : 0.496, 'b' : 0.2, 'c' : 0.44 })
+
+def test_edge_created_by_update_can_close_a_cycle():
+    dg = DepGraph(engine="topological")
+    dg.add_vertices(['a', 'b'], [0.1, 0.2])
+    dg.add_edge(('a', 'b'), 1)
+    dg.calc_r()
+    dg.update_edge(('b', 'a'), 1)
+    assert dg.get_r_dict() == pytest.approx({ 'a' : 0.28, 'b' : 0.28 })
+
+@pytest.mark.parametrize("seed", range(20))
+def test_updates_match_a_fresh_build(seed: int):
+    rng = random.Random(seed)
+    dg = DepGraph(engine="topological")
+    for k in range(12):
+        if rng.random() < 0.2:
+            dg.add_AND_gate(k)
+        else:
+            dg.add_vertex(k, rng.random() * 0.3)
+    for _ in range(40):
+        a, b = rng.sample(range(12), 2)
+        if rng.random() < 0.7:
+            # Creates the edge when it isn't there yet
+            dg.update_edge((a, b), rng.choice([1, 0.5, 0]))
+        else:
+            dg.update_vertex(a, rng.random() * 0.3)
+        if rng.random() < 0.3:
+            assert dg.get_r_dict() == pytest.approx(rebuilt(dg).get_r_dict(), abs=1e-12)
+    assert dg.get_r_dict() == pytest.approx(rebuilt(dg).get_r_dict(), abs=1e-12)
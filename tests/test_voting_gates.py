@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from graph import snapshot
+from conftest import RecordedGraph, full_r, random_graph
+
+# Components, AND gates and voting gates feeding each other, with
+# risks worked out now and then along the way
+def voting_graph(seed: int) -> RecordedGraph:
+    return random_graph(seed, n=16, edge_count=35, AND_chance=0.15, vote_chance=0.2, calc_r_chance=0.3)
+
+@pytest.mark.parametrize("seed", range(40))
+def test_calc_r_twice_gives_the_same_risks(seed: int):
+    dg = voting_graph(seed)
+    first = dg.calc_r().copy()
+    assert np.array_equal(first, dg.calc_r())
+
+@pytest.mark.parametrize("seed", range(40))
+def test_incremental_matches_full(seed: int):
+    dg = voting_graph(seed)
+    assert np.allclose(dg.calc_r(), full_r(dg), atol=1e-9)
+
+@pytest.mark.parametrize("seed", range(40))
+def test_snapshot_reload_keeps_the_risks(seed: int, tmp_path):
+    dg = voting_graph(seed)
+    r = dg.calc_r().copy()
+    path = str(tmp_path / "graph.dg")
+    snapshot.save(dg, path)
+    assert np.allclose(snapshot.load(path).calc_r(), r, atol=1e-9)